@@ -3,9 +3,498 @@ import ui_components as ui
 import database as db
 import processor as proc
 import pandas as pd
+import functools
+import os
+import statistics
+import tempfile
+import time
+from collections import deque
+from datetime import date
+from invoice_generator import VAT_RATE, render_invoice_pdf
+import bulk_export
+import forecasting
 
 # --- Page Setup ---
+APP_RUN_STARTED = time.perf_counter()
 ui.setup_page()
+# Pending invoices past the payment terms turn Overdue in the background, not per page view
+db.start_overdue_sweeper()
+
+INVOICE_TABLE_CONFIG = {
+    "amount": st.column_config.NumberColumn("Amount", format="€%.2f"),
+    "date": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
+    "client_name": "Client",
+    "status": "Status"
+}
+
+SEARCH_TABLE_CONFIG = {**INVOICE_TABLE_CONFIG, "match": "Conceptos"}
+
+# Latest invoices in the Dashboard's transaction list (one HTML payload, scrolls in place)
+RECENT_TRANSACTIONS = 500
+# Dashboard fragments rerun after invoices are deleted from the transaction list
+DASHBOARD_INVOICE_FRAGMENTS = ["hero_metrics", "recent_transactions", "database_records"]
+# Server time samples kept per section (full app run or fragment) for the sidebar panel
+RENDER_TIME_SAMPLES = 50
+
+STREAMED_FIELD_LABELS = {
+    "client_name": "Cliente",
+    "client_address": "Dirección",
+    "invoice_number": "Nº Factura",
+    "date": "Fecha",
+    "total_amount": "Total",
+    "currency": "Moneda"
+}
+
+def pager_controls(key, positions, next_position):
+    """
+    Previous/Next buttons over a stack of page positions (keyset cursors or offsets) kept in session state.
+    The stack moves in the click callbacks, so inside a fragment only that fragment reruns.
+    """
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button("← Previous", key=f"{key}_prev", disabled=len(positions) == 1, on_click=positions.pop)
+    with col_page:
+        st.caption(f"Page {len(positions)}")
+    with col_next:
+        st.button("Next →", key=f"{key}_next", disabled=next_position is None,
+                  on_click=positions.append, args=(next_position,))
+
+def record_render_time(section, seconds):
+    """Appends one run's server time to the section's recent samples in session state."""
+    samples = st.session_state.setdefault('render_times', {})
+    samples.setdefault(section, deque(maxlen=RENDER_TIME_SAMPLES)).append(seconds * 1000)
+
+def timed_fragment(key):
+    """@st.fragment under a rerun key (for st.rerun(key) in callbacks) that records each run's server time."""
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_render_time(key, time.perf_counter() - start)
+        return st.fragment(run, key=key)
+    return decorate
+
+def invoice_pager(key, user_id, page_size=50, **filters):
+    """Renders one page of invoices with Previous/Next controls; keyset cursors live in session state."""
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    page_df, next_cursor = db.get_invoice_page(user_id, limit=page_size, cursor=cursors[-1], **filters)
+
+    if page_df.empty:
+        st.info("No invoices found.")
+    else:
+        st.dataframe(page_df, use_container_width=True, hide_index=True, column_config=INVOICE_TABLE_CONFIG)
+    pager_controls(key, cursors, next_cursor)
+
+def search_pager(key, user_id, query, page_size=20):
+    """Renders ranked full-text search results with Previous/Next controls; offsets live in session state."""
+    offsets = st.session_state.setdefault(f"{key}_offsets", [0])
+    results, next_offset = db.search(user_id, query, limit=page_size, offset=offsets[-1])
+
+    if results.empty:
+        st.info("Sin resultados.")
+    else:
+        st.dataframe(results, use_container_width=True, hide_index=True, column_config=SEARCH_TABLE_CONFIG)
+    pager_controls(key, offsets, next_offset)
+
+@timed_fragment("hero_metrics")
+def hero_metrics(user_id):
+    """Balance hero and quick stats; rerun with the transaction list when invoices are deleted."""
+    # 1. Hero Balance Section
+    metrics = db.get_dashboard_metrics(user_id)
+    ui.hero_section(f"€{metrics['total_revenue']:,.2f}", metrics['delta_revenue'])
+    
+    # 2. Quick Stats Row
+    st.markdown("#### Stats Overview")
+    col1, col2, col3 = st.columns(3)
+    client_count = db.count_clients(user_id)
+    
+    with col1:
+        ui.stat_card("Pending", f"€{metrics['pending_revenue']:,.2f}", "#FBBF24") # Amber
+    with col2:
+        ui.stat_card("Overdue", f"€{metrics['overdue_revenue']:,.2f}", "#F87171") # Red
+    with col3:
+        ui.stat_card("Active Clients", f"{client_count}", "#3B82F6") # Blue
+
+def delete_transactions(user_id, invoice_ids):
+    """Delete callback of the transaction list: reruns only the Dashboard fragments that show invoices."""
+    if db.delete_invoices(user_id, invoice_ids):
+        st.session_state['recent_flash'] = ("success", f"{len(invoice_ids)} invoice(s) deleted")
+    else:
+        st.session_state['recent_flash'] = ("error", "❌ Error en la Base de Datos")
+    st.rerun(DASHBOARD_INVOICE_FRAGMENTS)
+
+@timed_fragment("recent_transactions")
+def recent_transactions(user_id):
+    """Latest invoices with the selection-based delete."""
+    # 3. Transaction List
+    st.markdown("#### Recent Transactions")
+    if 'recent_flash' in st.session_state:
+        kind, message = st.session_state.pop('recent_flash')
+        getattr(st, kind)(message)
+    invoices, _ = db.get_invoice_page(user_id, limit=RECENT_TRANSACTIONS)
+    
+    if not invoices.empty:
+        ui.transaction_list(invoices, key="recent", on_delete=lambda ids: delete_transactions(user_id, ids))
+    else:
+        st.info("No recent transactions.")
+
+@timed_fragment("database_records")
+def database_records(user_id):
+    """Invoice pager, revenue by service and client registry expanders."""
+    with st.expander("View All Invoices (Live Data)", expanded=False):
+        invoice_pager("dashboard_invoices", user_id)
+
+    with st.expander("Revenue by Service", expanded=False):
+        services = db.get_revenue_by_service(user_id)
+        if not services.empty:
+            st.dataframe(
+                services,
+                use_container_width=True,
+                hide_index=True,
+                column_config={"revenue": st.column_config.NumberColumn(format="€%.2f")}
+            )
+        else:
+            st.info("No line items recorded yet.")
+
+    with st.expander("Client Registry", expanded=False):
+        all_clients = db.get_clients(user_id)
+        if not all_clients.empty:
+            st.dataframe(
+                all_clients, 
+                use_container_width=True, 
+                hide_index=True
+            )
+        else:
+            st.info("No clients registered.")
+
+@timed_fragment("upload_analyze")
+def upload_and_analyze(user_id, api_key):
+    """Upload or record a document, stream its extraction, then show the actions for the result."""
+    st.markdown("#### Documentos y Notas de Voz")
+    
+    col_up, col_rec = st.columns(2)
+    with col_up:
+        uploaded_file = st.file_uploader(
+            "📂 Subir Archivo", 
+            type=["png", "jpg", "jpeg", "pdf", "mp3", "wav", "m4a", "mp4"]
+        )
+    with col_rec:
+        recorded_audio = st.audio_input("🎙️ Grabar Nota Directamente")
+        
+    active_file = recorded_audio if recorded_audio else uploaded_file
+    
+    if active_file and api_key:
+        mime_type = getattr(active_file, "type", "audio/wav")
+        
+        if mime_type.startswith("audio") or mime_type == "video/mp4":
+            st.audio(active_file, format=mime_type)
+        else:
+            st.image(active_file, caption="Vista Previa", width=300)
+        
+        if st.button("Analizar con Gemini", use_container_width=True):
+            # Read file based on type
+            bytes_data = active_file.getvalue()
+
+            # Render fields and line items progressively as the model streams them
+            with st.status("La IA está analizando la estructura...", expanded=True) as status:
+                fields_box = st.empty()
+                items_box = st.empty()
+                fields, items = {}, []
+                for kind, key, value in proc.stream_invoice_data(bytes_data, mime_type):
+                    if kind == "field":
+                        fields[key] = value
+                        fields_box.markdown("\n".join(
+                            f"**{STREAMED_FIELD_LABELS.get(name, name)}:** {val}"
+                            for name, val in fields.items()
+                        ))
+                    elif kind == "item":
+                        items.append(value)
+                        items_box.dataframe(pd.DataFrame(items), use_container_width=True, hide_index=True)
+                    elif kind == "prepared":
+                        stage_ms = ", ".join(f"{name} {secs * 1000:.0f} ms" for name, secs in value['stages'].items())
+                        st.caption(
+                            f"Upload: {value['original_bytes'] / 1024:,.0f} KB → {value['bytes'] / 1024:,.0f} KB"
+                            + (f" ({stage_ms})" if stage_ms else "")
+                        )
+                    elif kind == "error":
+                        status.update(label="Fallo en Análisis", state="error")
+                        st.error(f"Fallo en Análisis: {value}")
+                    elif kind == "done":
+                        status.update(label="Extracción Completada", state="complete", expanded=False)
+                        st.json(value.to_dict())
+
+                        # Save to Session State for PDF generation/DB Save
+                        st.session_state['last_invoice_data'] = value
+                    
+    elif not api_key:
+        st.warning("Por favor configura tu API Key en el menú lateral.")
+
+    # Nested, so a finished analysis shows its actions while Save reruns only the actions
+    invoice_actions(user_id)
+
+@timed_fragment("invoice_actions")
+def invoice_actions(user_id):
+    """Save and PDF download for the last extracted invoice."""
+    # PDF Generation & Database Save Section
+    if 'last_invoice_data' not in st.session_state:
+        return
+    st.markdown("---")
+    st.markdown("### 📄 Acciones")
+    
+    col_save, col_pdf = st.columns(2)
+    
+    data = st.session_state['last_invoice_data']
+    
+    with col_save:
+        if st.button("Guardar en Base de Datos", use_container_width=True):
+            saved = db.add_invoice(user_id=user_id, **data.to_record())
+            if saved:
+                st.success("✅ Factura Guardada en el Registro")
+                st.balloons() # Interactive feedback
+            else:
+                st.error("❌ Error en la Base de Datos")
+
+    with col_pdf:
+        # Rendered in memory only when the download is requested, and memoized per invoice content;
+        # the click itself does not rerun anything
+        st.download_button(
+            label="Generate Premium PDF",
+            data=lambda: render_invoice_pdf(data),
+            file_name=f"Invoice_{data.invoice_number or 'Draft'}.pdf",
+            mime="application/pdf",
+            on_click="ignore"
+        )
+
+@timed_fragment("batch")
+def batch_processing(user_id, api_key):
+    """Batch upload, parallel extraction and bulk save."""
+    st.markdown("#### Procesamiento por Lotes")
+    batch_files = st.file_uploader(
+        "📦 Subir varios documentos o un ZIP",
+        type=["png", "jpg", "jpeg", "pdf", "mp3", "wav", "m4a", "mp4", "zip"],
+        accept_multiple_files=True,
+        key="batch_files"
+    )
+    concurrency = st.slider("Documentos en paralelo", 1, 8, proc.BATCH_MAX_WORKERS)
+
+    if batch_files and api_key:
+        if st.button("Procesar Lote", use_container_width=True):
+            documents, skipped = proc.expand_documents((f.name, f.getvalue()) for f in batch_files)
+            if skipped:
+                st.warning(f"Ignorados ({len(skipped)}): {', '.join(skipped[:10])}")
+
+            progress = st.progress(0.0, text=f"0 / {len(documents)}")
+            results = []
+            for result in proc.iter_batch_extraction(documents, max_workers=concurrency):
+                results.append(result)
+                progress.progress(len(results) / len(documents), text=f"{len(results)} / {len(documents)}")
+            st.session_state['batch_results'] = sorted(results, key=lambda r: r['index'])
+    elif batch_files and not api_key:
+        st.warning("Por favor configura tu API Key en el menú lateral.")
+
+    if st.session_state.get('batch_results'):
+        results = st.session_state['batch_results']
+        st.dataframe(
+            pd.DataFrame([{
+                "Documento": r['name'],
+                "Estado": "✅" if r['status'] == 'ok' else "❌",
+                "Cliente": r['data'].client_name if r['data'] else None,
+                "Total": r['data'].total if r['data'] else None,
+                "Error": r['error'],
+                "Segundos": round(r['seconds'], 2)
+            } for r in results]),
+            use_container_width=True,
+            hide_index=True
+        )
+
+        ok_results = [r for r in results if r['status'] == 'ok']
+        if ok_results and st.button(f"Guardar {len(ok_results)} facturas", use_container_width=True):
+            records = [r['data'].to_record() for r in ok_results]
+            saved, skipped_count = db.add_invoices_bulk(user_id, records)
+            drafts = sum(1 for record in records if not record['invoice_number'])
+            st.success(
+                f"✅ {saved} facturas guardadas"
+                + (f" ({drafts} sin número, guardadas como borrador)" if drafts else "")
+                + (f", {skipped_count} duplicadas omitidas" if skipped_count else "")
+            )
+            del st.session_state['batch_results']
+
+@timed_fragment("history")
+def invoice_history(user_id):
+    """Invoice search and history pager, with the quarterly PDF export."""
+    col_search, col_status = st.columns([3, 1])
+    with col_search:
+        search_text = st.text_input(
+            "Buscar", placeholder="Cliente, email, nº de factura o concepto (p. ej. catering)", key="history_search"
+        ).strip()
+    with col_status:
+        status_filter = st.selectbox("Estado", ["Todos", "Pending", "Paid", "Overdue"], key="history_status")
+
+    if search_text:
+        search_pager(f"search_{search_text}", user_id, search_text)
+    else:
+        invoice_pager(
+            f"history_{status_filter}",
+            user_id,
+            status=None if status_filter == "Todos" else status_filter
+        )
+
+    with st.expander("📦 Exportar PDFs por trimestre"):
+        col_year, col_quarter = st.columns(2)
+        with col_year:
+            export_year = st.number_input("Año", min_value=2000, max_value=2100, value=date.today().year, step=1)
+        with col_quarter:
+            export_quarter = st.selectbox("Trimestre", [1, 2, 3, 4], index=(date.today().month - 1) // 3)
+        date_from, date_to = bulk_export.quarter_bounds(int(export_year), export_quarter)
+        export_status = None if status_filter == "Todos" else status_filter
+
+        if st.button("Generar ZIP", use_container_width=True):
+            export_progress = st.progress(0.0, text="Renderizando PDFs...")
+
+            def report(done, total):
+                export_progress.progress(done / total if total else 1.0, text=f"{done}/{total} facturas")
+
+            discard_export()
+            # The archive goes to disk as it is rendered; the session only keeps its path
+            fd, path = tempfile.mkstemp(prefix="facturas_", suffix=".zip")
+            os.close(fd)
+            summary = bulk_export.export_invoices_zip(
+                user_id, path, progress=report,
+                status=export_status, date_from=date_from, date_to=date_to
+            )
+            st.session_state['export_zip'] = (f"facturas_{int(export_year)}_T{export_quarter}.zip", path, summary)
+
+        if 'export_zip' in st.session_state:
+            file_name, path, summary = st.session_state['export_zip']
+            st.caption(f"{summary['invoices']} PDFs en {summary['seconds']:.1f}s" +
+                       (f" · {len(summary['failed'])} con errores" if summary['failed'] else ""))
+            st.download_button("Descargar ZIP", data=functools.partial(take_export, path), file_name=file_name,
+                               mime="application/zip",
+                               # take_export deletes the file; the click only forgets it here
+                               on_click=st.session_state.pop, args=('export_zip', None))
+
+def take_export(path):
+    """Reads an exported archive when its download is requested and deletes the file."""
+    with open(path, "rb") as archive:
+        data = archive.read()
+    os.remove(path)
+    return data
+
+def discard_export():
+    """Deletes the session's previous exported archive if it was never downloaded."""
+    export = st.session_state.pop('export_zip', None)
+    if export and os.path.exists(export[1]):
+        os.remove(export[1])
+
+@timed_fragment("financial_planning")
+def financial_planning(user_id):
+    """Revenue forecast, expected cash-in, quarterly VAT and the per-client outlook."""
+    plan = forecasting.get_forecast(user_id)
+    history, forecast, vat = plan['history'], plan['forecast'], plan['vat']
+    if not history['revenue'].any() and not plan['open_total']:
+        st.info("Not enough invoice history to forecast yet.")
+        return
+
+    upcoming_vat = vat[vat['due_date'] >= date.today()]
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        ui.stat_card("Forecast · next 3 months", f"€{forecast['revenue'][:3].sum():,.2f}", "#3B82F6") # Blue
+    with col2:
+        ui.stat_card("Expected cash-in · next 3 months", f"€{forecast['cash_in'][:3].sum():,.2f}", "#34D399") # Green
+    with col3:
+        if not upcoming_vat.empty:
+            next_vat = upcoming_vat.iloc[0]
+            ui.stat_card(f"VAT {next_vat['quarter']} · due {next_vat['due_date']:%d/%m}", f"€{next_vat['vat']:,.2f}", "#FBBF24") # Amber
+
+    st.markdown("#### Revenue Forecast")
+    st.line_chart(pd.concat([
+        history.set_index('month')['revenue'].rename("Actual"),
+        forecast.set_index('month')[['revenue', 'low', 'high']].rename(
+            columns={'revenue': "Forecast", 'low': "Low", 'high': "High"}
+        )
+    ], axis=1))
+
+    st.markdown("#### Expected Cash-in")
+    st.caption(
+        f"Open invoices (€{plan['open_total']:,.2f}) at {db.PAYMENT_TERMS_DAYS}-day terms, "
+        "plus forecast revenue not invoiced yet."
+    )
+    st.bar_chart(forecast.set_index('month')['cash_in'].rename("Cash-in"))
+
+    st.markdown(f"#### Quarterly VAT ({VAT_RATE:.0%})")
+    st.dataframe(
+        vat,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "quarter": "Quarter",
+            "base": st.column_config.NumberColumn("Taxable base", format="€%.2f"),
+            "vat": st.column_config.NumberColumn("VAT", format="€%.2f"),
+            "due_date": st.column_config.DateColumn("Due", format="DD/MM/YYYY"),
+            "projected": st.column_config.CheckboxColumn("Projected")
+        }
+    )
+
+    st.markdown("#### Client Outlook")
+    st.caption(
+        f"Clients billed in fewer than {forecasting.MIN_TREND_MONTHS} months are forecast flat "
+        "at their average monthly revenue and marked as low support."
+    )
+    st.dataframe(
+        plan['clients'],
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "client": "Client",
+            "last_12m": st.column_config.NumberColumn("Last 12 months", format="€%.2f"),
+            "next_12m": st.column_config.NumberColumn("Next 12 months", format="€%.2f"),
+            "change": st.column_config.NumberColumn("Change", format="percent"),
+            "low_support": st.column_config.CheckboxColumn("Low support")
+        }
+    )
+
+@timed_fragment("receivables_aging")
+def receivables_aging(user_id):
+    """Open receivables by age (days since the invoice date), in total and per client."""
+    aging = db.get_aging_report(user_id)
+    if aging.empty:
+        st.info("No open invoices.")
+        return
+
+    colors = ("#34D399", "#FBBF24", "#FB923C", "#F87171") # Green to red
+    for col, (label, _), color in zip(st.columns(len(db.AGING_BUCKETS)), db.AGING_BUCKETS, colors):
+        with col:
+            ui.stat_card(f"{label} days", f"€{aging[label].sum():,.2f}", color)
+    st.dataframe(
+        aging,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "client_name": "Client",
+            "invoices": "Invoices",
+            **{label: st.column_config.NumberColumn(label, format="€%.2f") for label, _ in db.AGING_BUCKETS},
+            "total": st.column_config.NumberColumn("Total", format="€%.2f")
+        }
+    )
+
+@st.fragment
+def render_time_panel():
+    """Median server time of recent full runs ('app') and of each fragment's runs."""
+    samples = st.session_state.get('render_times', {})
+    if samples:
+        st.dataframe(
+            pd.DataFrame([
+                {"Section": section, "Runs": len(times), "Last ms": round(times[-1], 1),
+                 "Median ms": round(statistics.median(times), 1)}
+                for section, times in samples.items()
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+    st.button("Refresh", key="render_times_refresh")
 
 # Initialize session state for auth
 if 'user_id' not in st.session_state:
@@ -76,11 +565,32 @@ with st.sidebar:
     if api_key:
         if proc.configure_gemini(api_key):
             st.success("System Online")
+            cache_stats = proc.get_extraction_cache_stats()
+            st.caption(
+                f"AI cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses · "
+                f"{cache_stats['entries']} stored"
+            )
+            gemini_stats = proc.get_scheduler_metrics()
+            if gemini_stats['circuit_state'] != "closed":
+                st.warning("Gemini temporarily unavailable, retrying shortly.")
+            st.caption(
+                f"Gemini: {gemini_stats['successes']}/{gemini_stats['calls']} calls ok · "
+                f"{gemini_stats['retries']} retries"
+            )
+            path_stats = proc.get_extraction_path_stats()
+            if path_stats['local'] or path_stats['fallback']:
+                st.caption(
+                    f"PDF text layer: {path_stats['local']} local · "
+                    f"{path_stats['fallback_ratio']:.0%} sent to Gemini"
+                )
         else:
             st.error("Connection Failed")
     else:
         st.warning("API Key Required")
         
+    with st.expander("⏱ Server time"):
+        render_time_panel()
+
     st.markdown("---")
     if st.button("Cerrar Sesión", use_container_width=True):
         st.session_state['user_id'] = None
@@ -93,173 +603,26 @@ with st.sidebar:
 user_id = st.session_state['user_id']
 
 if page == "Dashboard":
-    # 1. Hero Balance Section
-    metrics = db.get_dashboard_metrics(user_id)
-    ui.hero_section(f"€{metrics['total_revenue']:,.2f}", metrics['delta_revenue'])
-    
-    # 2. Quick Stats Row
-    st.markdown("#### Stats Overview")
-    col1, col2, col3 = st.columns(3)
-    client_count = len(db.get_clients(user_id))
-    
-    with col1:
-        ui.stat_card("Pending", f"€{metrics['pending_revenue']:,.2f}", "#FBBF24") # Amber
-    with col2:
-        ui.stat_card("Overdue", f"€{metrics['overdue_revenue']:,.2f}", "#F87171") # Red
-    with col3:
-        ui.stat_card("Active Clients", f"{client_count}", "#3B82F6") # Blue
-
-    # 3. Transaction List
-    st.markdown("#### Recent Transactions")
-    invoices = db.get_invoices(user_id)
-    
-    if not invoices.empty:
-        # Iterate over last 5 invoices and render as beautiful rows
-        for _, row in invoices.head(10).iterrows():
-            delete_clicked = ui.transaction_row(
-                invoice_id=row['id'],
-                client=row['client_name'],
-                date=row['date'],
-                amount=row['amount'],
-                status=row['status']
-            )
-            
-            if delete_clicked:
-                if db.delete_invoice(user_id, row['id']):
-                    st.success("Invoice Deleted")
-                    st.rerun()
-        
-        if st.button("View All Transactions"):
-            page = "Smart Invoicing" # Simple navigation simulation
-    else:
-        st.info("No recent transactions.")
+    hero_metrics(user_id)
+    recent_transactions(user_id)
 
     # 4. Database Views (Restored)
     st.markdown("### 📂 Database Records")
-    
-    with st.expander("View All Invoices (Live Data)", expanded=False):
-        all_invoices = db.get_invoices(user_id)
-        if not all_invoices.empty:
-            st.dataframe(
-                all_invoices,
-                use_container_width=True,
-                hide_index=True,
-                column_config={
-                    "amount": st.column_config.NumberColumn("Amount", format="€%.2f"),
-                    "date": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
-                    "client_name": "Client",
-                    "status": "Status"
-                }
-            )
-        else:
-            st.info("No invoices found.")
-
-    with st.expander("Client Registry", expanded=False):
-        all_clients = db.get_clients(user_id)
-        if not all_clients.empty:
-            st.dataframe(
-                all_clients, 
-                use_container_width=True, 
-                hide_index=True
-            )
-        else:
-            st.info("No clients registered.")
+    database_records(user_id)
 
 elif page == "Smart Invoicing":
     ui.section_header("Gestión Inteligente", "Procesamiento de documentos por IA")
     
-    tab1, tab2 = st.tabs(["Subir & Procesar", "Historial"])
+    tab1, tab_batch, tab2 = st.tabs(["Subir & Procesar", "Lote", "Historial"])
     
     with tab1:
-        st.markdown("#### Documentos y Notas de Voz")
-        
-        col_up, col_rec = st.columns(2)
-        with col_up:
-            uploaded_file = st.file_uploader(
-                "📂 Subir Archivo", 
-                type=["png", "jpg", "jpeg", "pdf", "mp3", "wav", "m4a", "mp4"]
-            )
-        with col_rec:
-            recorded_audio = st.audio_input("🎙️ Grabar Nota Directamente")
-            
-        active_file = recorded_audio if recorded_audio else uploaded_file
-        
-        if active_file and api_key:
-            mime_type = getattr(active_file, "type", "audio/wav")
-            
-            if mime_type.startswith("audio") or mime_type == "video/mp4":
-                st.audio(active_file, format=mime_type)
-            else:
-                st.image(active_file, caption="Vista Previa", width=300)
-            
-            if st.button("Analizar con Gemini", use_container_width=True):
-                with st.spinner("La IA está analizando la estructura..."):
-                    # Read file based on type
-                    bytes_data = active_file.getvalue()
-                    
-                    data = proc.extract_invoice_data(bytes_data, mime_type)
-                    
-                    if "error" in data:
-                        st.error(f"Fallo en Análisis: {data['error']}")
-                    else:
-                        st.success("Extracción Completada")
-                        st.json(data)
-                        
-                        # Save to Session State for PDF generation/DB Save
-                        st.session_state['last_invoice_data'] = data
-                        
-        elif not api_key:
-            st.warning("Por favor configura tu API Key en el menú lateral.")
-            
-        # PDF Generation & Database Save Section
-        if 'last_invoice_data' in st.session_state:
-            st.markdown("---")
-            st.markdown("### 📄 Acciones")
-            
-            col_save, col_pdf = st.columns(2)
-            
-            data = st.session_state['last_invoice_data']
-            
-            with col_save:
-                if st.button("Guardar en Base de Datos", use_container_width=True):
-                    saved = db.add_invoice(
-                        user_id=st.session_state['user_id'],
-                        client_name=data.get('client_name', 'Unknown Client'),
-                        invoice_number=data.get('invoice_number', 'Draft'),
-                        date=data.get('date', pd.Timestamp.now().strftime('%Y-%m-%d')),
-                        amount=data.get('total_amount', 0.0),
-                        items=data.get('items', []),
-                        status='Pending'
-                    )
-                    if saved:
-                        st.success("✅ Factura Guardada en el Registro")
-                        st.balloons() # Interactive feedback
-                    else:
-                        st.error("❌ Error en la Base de Datos")
+        upload_and_analyze(user_id, api_key)
+
+    with tab_batch:
+        batch_processing(user_id, api_key)
 
-            with col_pdf:
-                # Prepare PDF for download
-                from invoice_generator import PremiumInvoicePDF
-                import tempfile
-                
-                try:
-                    pdf = PremiumInvoicePDF(data)
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                        pdf.generate(tmp.name)
-                        tmp_path = tmp.name
-                        
-                    with open(tmp_path, "rb") as f:
-                        st.download_button(
-                            label="Generate Premium PDF",
-                            data=f,
-                            file_name=f"Invoice_{data.get('invoice_number', 'Draft')}.pdf",
-                            mime="application/pdf"
-                        )
-                except Exception as e:
-                    st.error(f"PDF Generation Error: {e}")
-                        
     with tab2:
-        st.dataframe(db.get_invoices(st.session_state['user_id']), use_container_width=True)
+        invoice_history(user_id)
 
 elif page == "CRM & Clients":
     ui.section_header("CRM Suite", "Client management & delinquency tracking")
@@ -283,7 +646,12 @@ elif page == "CRM & Clients":
         st.markdown("### Client Directory")
         st.dataframe(db.get_clients(st.session_state['user_id']), use_container_width=True)
 
+    st.markdown("### Receivables Aging")
+    receivables_aging(st.session_state['user_id'])
+
 elif page == "Financial Planning":
     ui.section_header("Financial Planning", "Future forecasting & Tax Sentinel")
-    st.info("Module under construction. Will include AI-driven revenue forecasting.")
+    financial_planning(user_id)
 
+# Full runs only; fragment reruns record their own time
+record_render_time("app", time.perf_counter() - APP_RUN_STARTED)
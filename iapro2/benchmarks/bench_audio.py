@@ -0,0 +1,102 @@
+"""
+Audio normalization check on a deterministic generated corpus (no network access):
+stereo WAV voice-note stand-ins at common recorder sample rates, made of tone
+bursts with known amounts of leading and trailing silence.
+
+Checks that each output is mono at the target rate, that silence is trimmed
+to within the configured padding and that the payload shrinks. Exits 1 on a
+failed check. With ffmpeg on PATH (or FFMPEG_BINARY set) the outputs are Opus
+and only the size is checked.
+
+Usage: python benchmarks/bench_audio.py [--repeat 3]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import preprocessing
+
+
+def voice_note(rate, lead_silence, speech, trail_silence, channels=2, noise_db=-70.0, seed=0):
+    """Tone bursts (150-400 Hz, roughly speech pitch) between silences with a faint noise floor."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(speech * rate)) / rate
+    pitch = 150 + 250 * (0.5 + 0.5 * np.sin(2 * np.pi * 0.7 * t))
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 3 * t) # syllable-like amplitude modulation
+    tone = 0.5 * envelope * np.sin(2 * np.pi * np.cumsum(pitch) / rate)
+    signal = np.concatenate([np.zeros(int(lead_silence * rate)), tone, np.zeros(int(trail_silence * rate))])
+    signal = signal + rng.normal(0, 10 ** (noise_db / 20), len(signal))
+    frames = np.repeat(signal[:, None], channels, axis=1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((np.clip(frames, -1, 1) * 32767).astype("<i2").tobytes())
+    return buffer.getvalue(), speech
+
+
+CORPUS = [
+    ("44.1k stereo", 44100, 1.5, 4.0, 2.0),
+    ("48k stereo", 48000, 3.0, 8.0, 0.5),
+    ("22.05k mono", 22050, 0.0, 3.0, 5.0),
+    ("16k no silence", 16000, 0.0, 5.0, 0.0),
+]
+
+
+def check_wav(content, speech_seconds):
+    with wave.open(io.BytesIO(content)) as wav:
+        channels, rate, frames = wav.getnchannels(), wav.getframerate(), wav.getnframes()
+    duration = frames / rate
+    slack = 2 * preprocessing.AUDIO_SILENCE_PAD_SECONDS + 2 * preprocessing.AUDIO_SILENCE_FRAME_SECONDS
+    problems = []
+    if channels != 1:
+        problems.append(f"{channels} channels")
+    if rate != preprocessing.AUDIO_SAMPLE_RATE:
+        problems.append(f"{rate} Hz")
+    if not speech_seconds - 0.05 <= duration <= speech_seconds + slack:
+        problems.append(f"duration {duration:.2f}s for {speech_seconds:.2f}s of speech")
+    return duration, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'clip':<16}{'in KB':>9}{'out KB':>9}{'in s':>7}{'out s':>7}{'ms':>7}  result")
+    for index, (name, rate, lead, speech, trail) in enumerate(CORPUS):
+        channels = 1 if "mono" in name else 2
+        content, speech_seconds = voice_note(rate, lead, speech, trail, channels=channels, seed=index)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = preprocessing.preprocess_document(content, "audio/wav")
+            timings.append(time.perf_counter() - start)
+
+        problems = []
+        if result.bytes_saved <= 0:
+            problems.append("not smaller")
+        out_seconds = "-"
+        if result.mime_type == "audio/wav" and result.content is not content:
+            duration, wav_problems = check_wav(result.content, speech_seconds)
+            out_seconds = f"{duration:.2f}"
+            problems += wav_problems
+        failures += bool(problems)
+        print(f"{name:<16}{len(content) / 1024:>9,.0f}{len(result.content) / 1024:>9,.0f}"
+              f"{lead + speech + trail:>7.2f}{out_seconds:>7}{min(timings) * 1000:>7.0f}  "
+              f"{'; '.join(problems) or 'ok'} ({result.mime_type})")
+    print(preprocessing.get_preprocessing_stats())
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Bulk PDF export benchmark: invoices/second versus worker processes, rendering a
+quarter of seeded invoices into a ZIP archive on disk. The "auto" row is the
+default the app and CLI use (bulk_export.export_workers).
+
+Usage: python benchmarks/bench_bulk_export.py [--invoices 2000] [--workers 1 2 4 8]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_export
+import database as db
+
+
+def seed(invoice_count):
+    rng = random.Random(3)
+    conn = db.get_connection()
+    with conn:
+        user_id = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('bench', 'x')").lastrowid
+        client_ids = [
+            conn.execute("INSERT INTO clients (user_id, name) VALUES (?, ?)", (user_id, f"Client {c} S.L.")).lastrowid
+            for c in range(50)
+        ]
+        rows, items = [], {}
+        for i in range(invoice_count):
+            lines = [
+                {"description": f"Service line {n}", "quantity": rng.randint(1, 9), "unit_price": round(rng.uniform(10, 900), 2)}
+                for n in range(rng.randint(1, 12))
+            ]
+            for item in lines:
+                item["total"] = round(item["quantity"] * item["unit_price"], 2)
+            number = f"INV-{i:05d}"
+            items[number] = lines
+            rows.append((client_ids[i % 50], user_id, number, f"2024-{i % 3 + 1:02d}-{i % 28 + 1:02d}",
+                         sum(item["total"] for item in lines), "Paid"))
+        conn.executemany(
+            "INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, status) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        ids = db._invoice_ids(conn, user_id, items)
+        db._insert_items(conn, {ids[number]: lines for number, lines in items.items()})
+    return user_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        user_id = seed(args.invoices)
+        date_from, date_to = bulk_export.quarter_bounds(2024, 1)
+        print(f"{os.cpu_count()} CPUs, {args.invoices} invoices")
+        print(f"{'workers':>8}{'seconds':>10}{'invoices/s':>12}{'zip MB':>9}")
+        for workers in args.workers + [None]:
+            path = os.path.join(tmp, f"export-{workers}.zip")
+            summary = bulk_export.export_invoices_zip(user_id, path, workers=workers, date_from=date_from, date_to=date_to)
+            with zipfile.ZipFile(path) as archive:
+                assert len(archive.namelist()) == args.invoices and not summary["failed"]
+            label = workers or f"auto:{summary['workers']}"
+            print(f"{label:>8}{summary['seconds']:>10.2f}{summary['invoices'] / summary['seconds']:>12.0f}"
+                  f"{os.path.getsize(path) / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
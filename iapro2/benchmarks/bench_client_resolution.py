@@ -0,0 +1,153 @@
+"""
+Client resolution benchmark: saves invoices whose client names come in the
+variants an extraction model produces ('Pepsi', 'PEPSI S.A.', 'pepsi sa ',
+accent and spacing changes, one-letter typos) and checks that the clients table
+holds exactly one row per real client. Times _resolve_client_id for exact and
+fuzzy hits, then runs merge_duplicate_clients on a table filled the old way
+(one client per distinct spelling, a third of them without name_key, as raw
+inserts and older tools left them).
+
+Usage: python benchmarks/bench_client_resolution.py [--clients 2000] [--invoices 20000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+from client_resolution import ClientIndex, client_key
+
+FIRST = ("Comercial", "Distribuciones", "Transportes", "Construcciones", "Talleres", "Suministros", "Hosteleria",
+         "Consultoria", "Ingenieria", "Farmacia", "Panaderia", "Electricidad", "Fontaneria", "Inmobiliaria")
+SECOND = ("Martínez", "Iberia", "Norte", "Levante", "Atlántico", "Castellana", "Galaica", "Rioja", "Montaña",
+          "Bahía", "Mediterráneo", "Pirineos", "Sierra", "Duero", "Guadalquivir", "Cantábrico")
+SUFFIXES = (" S.L.", " S.A.", " SL", " s.l.u.", ", S. A.", "")
+
+
+def base_names(count, rng):
+    names = {}
+    while len(names) < count:
+        name = f"{rng.choice(FIRST)} {rng.choice(SECOND)} {rng.randint(1, 400)}{rng.choice(SUFFIXES)}"
+        names.setdefault(client_key(name), name)
+    return sorted(names.values())
+
+
+def typo(name, rng):
+    words = name.split()
+    word = max(words, key=len)
+    i = rng.randint(1, len(word) - 3)
+    swapped = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return name.replace(word, swapped, 1)
+
+
+def variant(name, rng):
+    choice = rng.randrange(6)
+    if choice == 0:
+        return name.upper()
+    if choice == 1:
+        return f"  {name.lower()} "
+    if choice == 2:
+        return name.replace("á", "a").replace("í", "i").replace("é", "e").replace(" ", "  ")
+    if choice == 3:
+        return name.split(" S.")[0].split(",")[0] + rng.choice(SUFFIXES)
+    if choice == 4:
+        return typo(name, rng)
+    return name
+
+
+def timed_resolutions(user_id, names):
+    conn = db.get_connection()
+    timings = []
+    with conn:
+        created = ClientIndex()
+        for name in names:
+            start = time.perf_counter()
+            db._resolve_client_id(conn, user_id, name, created)
+            timings.append((time.perf_counter() - start) * 1e6)
+        conn.rollback()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--invoices", type=int, default=20000)
+    args = parser.parse_args()
+    rng = random.Random(21)
+    bases = base_names(args.clients, rng)
+    failures = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        conn = db.get_connection()
+        with conn:
+            user_id = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('bench', 'x')").lastrowid
+            legacy_user = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('legacy', 'x')").lastrowid
+
+        # 1. Saves through add_invoices_bulk with varying spellings. Each client's first invoice
+        # carries its registered name: two different typos of a name not yet on file stay apart
+        spellings = [(n, bases[n] if n < len(bases) else variant(bases[n % len(bases)], rng)) for n in range(args.invoices)]
+        start = time.perf_counter()
+        for offset in range(0, len(spellings), 1000):
+            db.add_invoices_bulk(user_id, [
+                {"client_name": name, "invoice_number": f"F-{n:06d}", "date": "2024-05-01", "amount": 10.0, "items": []}
+                for n, name in spellings[offset:offset + 1000]
+            ])
+        save_seconds = time.perf_counter() - start
+        clients = db.count_clients(user_id)
+        ids = {}
+        for n, client_id in conn.execute("SELECT CAST(substr(invoice_number, 3) AS INTEGER), client_id FROM invoices WHERE user_id = ?", (user_id,)):
+            ids.setdefault(bases[n % len(bases)], set()).add(client_id)
+        wrong = sum(1 for client_ids in ids.values() if len(client_ids) != 1)
+        shared = len(ids) - len({min(client_ids) for client_ids in ids.values()})
+        print(f"{args.invoices} invoices over {len(bases)} clients saved in {save_seconds:.1f}s; "
+              f"clients table {clients} rows, {wrong} clients split, {shared} clients merged by mistake")
+        failures += clients != len(bases) or wrong or shared
+
+        # 2. Resolution latency with a warm index
+        exact = timed_resolutions(user_id, [variant(rng.choice(bases), rng) for _ in range(5000)])
+        fuzzy = timed_resolutions(user_id, [typo(rng.choice(bases), rng) for _ in range(2000)])
+        print(f"resolve p50 {statistics.median(exact):.1f} us (mixed variants), "
+              f"{statistics.median(fuzzy):.1f} us (typos, fuzzy path); p99 {sorted(exact + fuzzy)[int(0.99 * len(exact + fuzzy))]:.1f} us")
+
+        # 3. Merge job on clients created the old way: one row per distinct spelling, in order of first use
+        legacy_names = list(dict.fromkeys(name for _, name in spellings))
+        with conn:
+            legacy_ids = {}
+            for n, name in enumerate(legacy_names):
+                legacy_ids[name] = conn.execute(
+                    "INSERT INTO clients (user_id, name, name_key) VALUES (?, ?, ?)",
+                    (legacy_user, name, client_key(name) if n % 3 else None)
+                ).lastrowid
+            conn.executemany(
+                "INSERT INTO invoices (client_id, user_id, invoice_number, date, amount) VALUES (?, ?, ?, '2024-05-01', 10.0)",
+                [(legacy_ids[name], legacy_user, f"L-{n:06d}") for n, name in spellings],
+            )
+        before = db.count_clients(legacy_user)
+        planned = db.merge_duplicate_clients(legacy_user, dry_run=True)
+        start = time.perf_counter()
+        merges = db.merge_duplicate_clients(legacy_user)
+        merge_seconds = time.perf_counter() - start
+        after = db.count_clients(legacy_user)
+        orphans = conn.execute("""
+            SELECT COUNT(*) FROM invoices i LEFT JOIN clients c ON c.id = i.client_id WHERE i.user_id = ? AND c.id IS NULL
+        """, (legacy_user,)).fetchone()[0]
+        unkeyed = conn.execute("SELECT COUNT(*) FROM clients WHERE user_id = ? AND name_key IS NULL", (legacy_user,)).fetchone()[0]
+        print(f"merge job: {before} -> {after} clients in {merge_seconds * 1000:.0f} ms "
+              f"({len(merges)} groups, {orphans} orphaned invoices, {unkeyed} clients left without name_key)")
+        failures += after != len(bases) or orphans or unkeyed or planned != merges
+        db.close_connection()
+
+    print("ok" if not failures else "FAILED")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
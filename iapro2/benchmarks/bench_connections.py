@@ -0,0 +1,113 @@
+"""
+Connection layer benchmark: ops/sec for concurrent sessions, one connection per
+call (legacy behaviour, rollback journal) versus the per-thread WAL connection.
+Reads call the uncached functions (__wrapped__), so every op reaches SQLite
+instead of the query cache.
+
+Usage: python benchmarks/bench_connections.py [--sessions 8] [--seconds 3]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+_legacy = threading.local()
+
+
+def legacy_connection():
+    """Fresh connection per call; close_legacy_connections() closes it after the op, as the old code did."""
+    conn = sqlite3.connect(db.DB_FILE)
+    _legacy.__dict__.setdefault("opened", []).append(conn)
+    return conn
+
+
+def close_legacy_connections():
+    for conn in _legacy.__dict__.pop("opened", []):
+        conn.close()
+
+
+def seed(user_count, invoices_per_user):
+    db.init_db()
+    conn = db.get_connection()
+    with conn:
+        for u in range(user_count):
+            user_id = conn.execute("INSERT INTO users (dni, password_hash) VALUES (?, 'x')", (f"bench-{u}",)).lastrowid
+            client_ids = [
+                conn.execute("INSERT INTO clients (user_id, name) VALUES (?, ?)", (user_id, f"Client {c}")).lastrowid
+                for c in range(20)
+            ]
+            conn.executemany(
+                "INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, status) VALUES (?, ?, ?, ?, ?, 'Paid')",
+                [(client_ids[i % 20], user_id, f"INV-{i}", f"2024-{i % 12 + 1:02d}-15", 100.0 + i) for i in range(invoices_per_user)],
+            )
+
+
+def session_worker(user_id, deadline, counter, lock):
+    ops = failed = 0
+    n = 0
+    while time.perf_counter() < deadline:
+        db.get_dashboard_metrics.__wrapped__(user_id)
+        db.get_invoices.__wrapped__(user_id)
+        db.get_clients.__wrapped__(user_id)
+        saved = db.add_invoice(user_id, "Bench Client", f"W-{threading.get_ident()}-{n}", "2024-06-01", 10.0, [])
+        close_legacy_connections()
+        # Failed writes are reported, not counted as ops
+        ops += 4 if saved else 3
+        failed += not saved
+        n += 1
+    db.close_connection()
+    with lock:
+        counter[0] += ops
+        counter[1] += failed
+
+
+def run(label, sessions, seconds):
+    counter = [0, 0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=session_worker, args=(u % 4 + 1, deadline, counter, lock))
+        for u in range(sessions)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {counter[0] / elapsed:>10.0f} ops/sec  ({counter[1]} failed writes)")
+    return counter[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    pooled_connection = db.get_connection
+    with tempfile.TemporaryDirectory() as tmp:
+        # Legacy: fresh connection per call, default rollback journal
+        db.DB_FILE = os.path.join(tmp, "legacy.db")
+        db.get_connection = legacy_connection
+        seed(4, 500)
+        close_legacy_connections()
+        failed = run("connect-per-call (DELETE)", args.sessions, args.seconds)
+
+        db.DB_FILE = os.path.join(tmp, "pooled.db")
+        db.get_connection = pooled_connection
+        seed(4, 500)
+        failed += run("per-thread connection (WAL)", args.sessions, args.seconds)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Forecasting benchmark: seeds three years of invoices for thousands of clients
+with trend, seasonality, churn and late starters, then times
+forecasting.get_forecast cold (SQL + vectorized fit) and cached. The same
+model fitted client by client with np.linalg.lstsq checks the vectorized
+results and shows the loop cost. A backtest on the seeded series compares the
+model's 6-month total error with a same-month-last-year baseline.
+
+Usage: python benchmarks/bench_forecasting.py [--clients 3000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import database as db
+import forecasting
+
+TODAY = datetime(2026, 10, 17)
+
+
+def synthetic_series(clients, months, rng):
+    """(clients, months) revenue: level * trend * seasonality * noise, with late starts and churn."""
+    level = rng.lognormal(7, 1, clients)[:, None]
+    t = np.arange(months)[None, :]
+    trend = 1 + rng.normal(0, 0.01, clients)[:, None] * t
+    season = 1 + rng.uniform(0, 0.4, clients)[:, None] * np.cos(2 * np.pi * (t - rng.integers(0, 12, clients)[:, None]) / 12)
+    revenue = level * np.clip(trend, 0.1, None) * season * rng.lognormal(0, 0.15, (clients, months))
+    revenue[t < rng.choice([0, 0, 0, 12, 24, 30], clients)[:, None]] = 0
+    revenue[t >= rng.choice([months, months, months, months, 20], clients)[:, None]] = 0
+    revenue[rng.random((clients, months)) < 0.1] = 0
+    return np.round(revenue, 2)
+
+
+def seed(series, first, current):
+    """One invoice per client and month; the last two months are Pending, the rest Paid."""
+    conn = db.get_connection()
+    with conn:
+        user_id = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('bench', 'x')").lastrowid
+        client_ids = [conn.execute("INSERT INTO clients (user_id, name, name_key) VALUES (?, ?, ?)",
+                                   (user_id, f"Cliente {c}", f"cliente {c}")).lastrowid for c in range(len(series))]
+        conn.executemany(
+            "INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, status) VALUES (?, ?, ?, ?, ?, ?)",
+            [(client_ids[c], user_id, f"F-{c}-{m}", f"{forecasting.month_label(first + m)}-{1 + (c + m) % 28:02d}",
+              float(series[c, m]), "Pending" if first + m >= current - 2 else "Paid")
+             for c, m in zip(*np.nonzero(series))],
+        )
+    return user_id
+
+
+def per_client_forecast(series, first_month, horizon):
+    """The same model as forecasting.fit_forecast, solved one client at a time."""
+    months = series.shape[1]
+    months_of_year = (first_month + np.arange(months + horizon)) % 12
+    steps = np.cumsum(forecasting.TREND_DAMPING ** np.arange(1, horizon + 1))
+    forecast = np.zeros((len(series), horizon))
+    for c, y in enumerate(series):
+        if not y.any():
+            continue
+        offset = min(int(np.argmax(y != 0)), months - forecasting.MIN_FIT_MONTHS)
+        trend = np.count_nonzero(y) >= forecasting.MIN_TREND_MONTHS
+        seasonal = trend and months - offset >= forecasting.SEASONAL_MIN_MONTHS
+        X = forecasting._design(np.arange(months - offset, dtype=float), months_of_year[offset:months], seasonal, trend)
+        coefficients = np.linalg.lstsq(X, y[offset:], rcond=None)[0]
+        forecast[c] = forecasting._design(months - offset - 1 + steps, months_of_year[months:], seasonal, trend) @ coefficients
+    return np.clip(forecast, 0, None)
+
+
+def timed(func, *args, repeat=1):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = np.random.default_rng(24)
+    current = TODAY.year * 12 + TODAY.month - 1
+    first = current - forecasting.HISTORY_MONTHS
+    series = synthetic_series(args.clients, forecasting.HISTORY_MONTHS, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        start = time.perf_counter()
+        user_id = seed(series, first, current)
+        print(f"{args.clients} clients, {np.count_nonzero(series)} invoices seeded in {time.perf_counter() - start:.1f}s")
+
+        _, sql_ms = timed(db.get_monthly_client_revenue, user_id, forecasting.month_label(first), repeat=args.repeat)
+        _, open_ms = timed(db.get_open_by_due_month, user_id, repeat=args.repeat)
+        plan, cold_ms = timed(forecasting.get_forecast.__wrapped__, user_id, TODAY, repeat=args.repeat)
+        forecasting.get_forecast(user_id, TODAY)
+        _, cached_ms = timed(forecasting.get_forecast, user_id, TODAY, repeat=args.repeat)
+        db.close_connection()
+
+    vectorized, fit_ms = timed(lambda: forecasting.fit_forecast(series, first)[0], repeat=args.repeat)
+    looped, loop_ms = timed(per_client_forecast, series, first, forecasting.FORECAST_MONTHS)
+    agree = np.allclose(vectorized, looped, rtol=1e-6, atol=1e-4)
+    matches_db = np.isclose(plan["forecast"]["revenue"].sum(), vectorized.sum(), rtol=1e-9)
+
+    # Backtest: fit on all but the last 6 complete months, compare the monthly totals
+    holdout = 6
+    predicted = forecasting.fit_forecast(series[:, :-holdout], first, horizon=holdout)[0].sum(axis=0)
+    actual = series[:, -holdout:].sum(axis=0)
+    last_year = series[:, -holdout - 12:-12].sum(axis=0)
+    wape = np.abs(predicted - actual).sum() / actual.sum()
+    naive_wape = np.abs(last_year - actual).sum() / actual.sum()
+
+    print(f"get_forecast cold       {cold_ms:>8.1f} ms  (monthly SQL {sql_ms:.1f} ms, open invoices SQL {open_ms:.1f} ms)")
+    print(f"get_forecast cached     {cached_ms:>8.3f} ms")
+    print(f"fit, vectorized         {fit_ms:>8.1f} ms")
+    print(f"fit, per-client lstsq   {loop_ms:>8.1f} ms  ({loop_ms / fit_ms:.0f}x slower)")
+    print(f"6-month backtest WAPE   {wape:>8.1%}  (same month last year: {naive_wape:.1%})")
+    ok = agree and matches_db and cold_ms < 1000
+    print("ok" if ok else f"FAILED: vectorized matches loop {agree}, matches get_forecast {matches_db}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Fragment rerun benchmark: drives app.py through Streamlit's AppTest with a
+seeded database and, for each interaction, compares the server time of a full
+app run (what every click cost before the page was split into fragments) with
+the time of the fragments that interaction now reruns. Both figures come from
+the app's own instrumentation (session_state['render_times']).
+
+Deleting from the transaction list reruns its fragments by key, which AppTest
+executes as a real fragment rerun. Plain widget clicks inside a fragment still
+run the whole script under AppTest, so for those the fragment time is read from
+that same full run.
+
+Usage: python benchmarks/bench_fragments.py [--invoices 5000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+from invoice_data import InvoiceData
+from streamlit.testing.v1 import AppTest
+
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+SERVICES = ("Consulting", "Hosting", "Support", "Design", "Audit")
+
+
+def seed(invoice_count):
+    conn = db.get_connection()
+    with conn:
+        user_id = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('bench', 'x')").lastrowid
+    db.add_invoices_bulk(user_id, [
+        {"client_name": f"Cliente {i % 200} S.L.", "invoice_number": f"F-{i:06d}",
+         "date": f"{2023 + i % 2}-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "amount": 50.0 + i % 900,
+         "status": ("Paid", "Pending", "Overdue")[i % 3],
+         "items": [{"description": SERVICES[i % 5], "quantity": 1 + i % 4, "unit_price": 25.0}]}
+        for i in range(invoice_count)
+    ])
+    return user_id
+
+
+def sample(at, sections):
+    """(full run ms, ms of the given fragments) from the last run's instrumentation."""
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    times = at.session_state["render_times"]
+    return times["app"][-1], sum(times[section][-1] for section in sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        user_id = seed(args.invoices)
+
+        at = AppTest.from_file(APP_FILE, default_timeout=120)
+        at.session_state["user_id"] = user_id
+        at.session_state["dni"] = "bench"
+        at.run()
+        results = {}
+
+        def record(name, sections, samples):
+            full, fragment = zip(*samples)
+            results[name] = (statistics.median(full), statistics.median(fragment), sections)
+
+        # Dashboard: delete two invoices. The delete callback's keyed st.rerun is a real fragment
+        # rerun under AppTest too; the full-run baseline deletes directly and reruns the whole page
+        samples = []
+        for _ in range(args.repeat):
+            db.delete_invoices(user_id, [int(i) for i in db.get_invoice_page(user_id, limit=2)[0]["id"]])
+            full = sample(at.run(), [])[0]
+            at.multiselect(key="recent_selected").set_value(
+                [int(i) for i in db.get_invoice_page(user_id, limit=2)[0]["id"]]).run()
+            full_runs = len(at.session_state["render_times"]["app"])
+            at.button(key="recent_delete").click().run()
+            if len(at.session_state["render_times"]["app"]) != full_runs:
+                raise RuntimeError("deleting from the transaction list reran the whole app")
+            samples.append((full, sample(at, ["hero_metrics", "recent_transactions", "database_records"])[1]))
+        record("delete transactions", "hero + list + records", samples)
+
+        # Dashboard: next page of the invoice pager
+        samples = []
+        for _ in range(args.repeat):
+            at.button(key="dashboard_invoices_next").click().run()
+            samples.append(sample(at, ["database_records"]))
+        record("invoice pager next", "records", samples)
+
+        # Smart Invoicing: save an extracted invoice, then search the history
+        at.sidebar.radio[0].set_value("Smart Invoicing").run()
+        samples = []
+        for n in range(args.repeat):
+            at.session_state["last_invoice_data"] = InvoiceData.from_dict({
+                "client_name": "Bench Client", "invoice_number": f"B-{n}", "date": "2024-06-01",
+                "items": [{"description": "Consulting", "quantity": 2, "unit_price": 80.0}]})
+            at.run()
+            next(b for b in at.button if b.label == "Guardar en Base de Datos").click().run()
+            samples.append(sample(at, ["invoice_actions"]))
+        record("save invoice", "actions", samples)
+
+        samples = []
+        for query in ("cliente 1", "consulting", "F-0001", "hosting", "cliente 42")[:args.repeat]:
+            at.text_input(key="history_search").set_value(query).run()
+            samples.append(sample(at, ["history"]))
+        record("history search", "history", samples)
+        db.close_connection()
+
+    print(f"{'interaction':<22}{'full run ms':>12}{'fragment ms':>13}  reruns")
+    for name, (full, fragment, sections) in results.items():
+        print(f"{name:<22}{full:>12.1f}{fragment:>13.1f}  {sections} ({full / fragment:.1f}x less work)")
+    print("PDF download: no rerun at all (on_click='ignore'); the PDF renders when the file is requested")
+
+
+if __name__ == "__main__":
+    main()
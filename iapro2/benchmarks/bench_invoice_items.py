@@ -0,0 +1,119 @@
+"""
+invoice_items benchmark: converts a legacy database whose line items are repr
+blobs in invoices.items, then compares revenue per service computed in SQL
+against the old path (load every blob, ast.literal_eval, aggregate in Python).
+Also times add_invoices_bulk with line items and checks that both paths agree,
+that repeated numbers are skipped, and that invoices without a number (scans
+with no number, voice notes) are all saved with their items, never deduplicated.
+
+Usage: python benchmarks/bench_invoice_items.py [--invoices 20000]
+"""
+import argparse
+import ast
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+from invoice_data import InvoiceData
+
+SERVICES = [f"Service {name}" for name in ("Consulting", "Hosting", "Support", "Design", "Audit", "Training",
+                                           "Transport", "Storage", "Licence", "Maintenance")]
+
+
+def random_items(rng):
+    items = []
+    for service in rng.sample(SERVICES, rng.randint(1, 6)):
+        quantity, unit_price = rng.randint(1, 20), round(rng.uniform(5, 500), 2)
+        items.append({"description": service, "quantity": quantity, "unit_price": unit_price,
+                      "total": round(quantity * unit_price, 2)})
+    return items
+
+
+def seed_legacy(invoice_count, rng):
+    """Inserts invoices the way the app stored them before invoice_items: str(items) in invoices.items."""
+    conn = db.get_connection()
+    with conn:
+        user_id = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('legacy', 'x')").lastrowid
+        client_id = conn.execute("INSERT INTO clients (user_id, name) VALUES (?, 'Legacy S.L.')", (user_id,)).lastrowid
+        conn.executemany(
+            "INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, items, status) VALUES (?, ?, ?, ?, ?, ?, 'Paid')",
+            [(client_id, user_id, f"L-{i:06d}", f"2024-{i % 12 + 1:02d}-15", 0.0, str(random_items(rng)))
+             for i in range(invoice_count)],
+        )
+    return user_id
+
+
+def blob_revenue(user_id):
+    """The pre-migration approach: every blob is loaded and parsed to aggregate one figure per service."""
+    revenue = defaultdict(float)
+    for (blob,) in db.get_connection().execute("SELECT items FROM invoices WHERE user_id = ?", (user_id,)):
+        for item in ast.literal_eval(blob):
+            revenue[item["description"]] += item["total"]
+    return revenue
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=20000)
+    args = parser.parse_args()
+    rng = random.Random(11)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        user_id = seed_legacy(args.invoices, rng)
+        expected, blob_seconds = timed(blob_revenue, user_id)
+
+        conn = db.get_connection()
+        with conn:
+            _, migrate_seconds = timed(db._copy_item_blobs, conn)
+        line_count = conn.execute("SELECT COUNT(*) FROM invoice_items").fetchone()[0]
+        revenue, sql_seconds = timed(db.get_revenue_by_service.__wrapped__, user_id, None, None, None, None, len(SERVICES))
+        mismatched = [service for service, total in zip(revenue["service"], revenue["revenue"])
+                      if abs(total - expected[service]) > 0.01]
+
+        records = [InvoiceData.from_dict({"client_name": f"Client {i % 40}", "invoice_number": f"N-{i:06d}",
+                                          "date": "2024-06-01", "items": random_items(rng)}).to_record()
+                   for i in range(args.invoices)]
+        drafts = [InvoiceData.from_dict({"client_name": f"Client {i % 40}", "invoice_number": number,
+                                         "date": "2024-06-01", "items": random_items(rng)}).to_record()
+                  for i, number in enumerate([None, "DRAFT-00X"] * 50)]
+        (saved, skipped), write_seconds = timed(db.add_invoices_bulk, user_id, records + records[:100] + drafts)
+        draft_saved, draft_skipped = db.add_invoices_bulk(user_id, drafts)
+        draft_rows, draft_items = conn.execute("""
+            SELECT COUNT(DISTINCT i.id), COUNT(it.invoice_id) FROM invoices i
+            LEFT JOIN invoice_items it ON it.invoice_id = i.id
+            WHERE i.user_id = ? AND i.invoice_number IS NULL
+        """, (user_id,)).fetchone()
+        expected_items = 2 * sum(len(record["items"]) for record in drafts)
+        db.close_connection()
+
+    print(f"{args.invoices} invoices, {line_count} line items")
+    print(f"migrate repr blobs      {migrate_seconds * 1000:>9.0f} ms")
+    print(f"revenue, blob parsing   {blob_seconds * 1000:>9.0f} ms")
+    print(f"revenue, SQL aggregate  {sql_seconds * 1000:>9.0f} ms")
+    print(f"add_invoices_bulk       {write_seconds * 1000:>9.0f} ms ({saved} saved, {skipped} skipped)")
+    print(f"invoices without number {draft_rows} stored over two batches, {draft_items}/{expected_items} line items")
+    drafts_ok = (draft_saved, draft_skipped) == (len(drafts), 0) and draft_rows == 2 * len(drafts) \
+        and draft_items == expected_items
+    ok = not mismatched and len(revenue) == len(expected) and saved == args.invoices + len(drafts) \
+        and skipped == 100 and drafts_ok
+    print("totals match" if ok else f"MISMATCH: {mismatched}, drafts ok: {drafts_ok}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Local text-layer extraction benchmark on generated PDFs (no network access).
+
+The corpus mixes digital invoices (the app's own PremiumInvoicePDF output and a
+Spanish-layout invoice with '1.234,56' amounts) with a scanned, image-only PDF
+and a Spanish invoice without a client line. Digital PDFs should be parsed
+locally in milliseconds; the scan and the invoice without a client must fall back
+to the model, which is replaced here by a stub with a fixed delay. A second
+pass with the extraction cache on checks that local results are cached like
+model results: the repeat of each document is a cache hit.
+
+Usage: python benchmarks/bench_local_extraction.py [--invoices 50] [--model-latency 1.5]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+from PIL import Image, ImageDraw
+
+import database as db
+import processor as proc
+from invoice_generator import PremiumInvoicePDF
+
+warnings.simplefilter("ignore", DeprecationWarning) # fpdf2 ln= in the sample layouts
+
+
+def random_invoice(seed):
+    rng = random.Random(seed)
+    items = []
+    for line in range(rng.randint(1, 8)):
+        quantity = rng.randint(1, 12)
+        unit_price = round(rng.uniform(5, 2500), 2)
+        items.append({"description": f"Servicio {line + 1} ref {rng.randint(100, 999)}",
+                      "quantity": quantity, "unit_price": unit_price, "total": round(quantity * unit_price, 2)})
+    return {
+        "client_name": rng.choice(["Acme S.L.", "Globex SA", "Initech", "Umbrella Corp"]),
+        "client_address": "Calle Mayor 5, Madrid",
+        "invoice_number": f"F-2024-{seed:04d}",
+        "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "items": items,
+        "total_amount": round(sum(item["total"] for item in items), 2),
+    }
+
+
+def premium_pdf(data):
+    return PremiumInvoicePDF(data).generate()
+
+
+def spanish_pdf(data, client=True):
+    """Different vendor layout: European number format, Spanish labels, IVA line."""
+    def eu(value):
+        return f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.cell(0, 10, "Suministros Ibericos S.L.", ln=True)
+    pdf.set_font("Helvetica", "", 10)
+    pdf.cell(0, 6, f"Factura N.: {data['invoice_number']}", ln=True)
+    year, month, day = data["date"].split("-")
+    pdf.cell(0, 6, f"Fecha: {day}/{month}/{year}", ln=True)
+    if client:
+        pdf.cell(0, 6, f"Cliente: {data['client_name']}", ln=True)
+    pdf.ln(8)
+    pdf.set_font("Helvetica", "B", 10)
+    for width, label, align in ((100, "Concepto", "L"), (25, "Cantidad", "R"), (30, "Precio", "R"), (35, "Importe", "R")):
+        pdf.cell(width, 8, label, 0, 0, align)
+    pdf.ln()
+    pdf.set_font("Helvetica", "", 10)
+    for item in data["items"]:
+        pdf.cell(100, 8, item["description"])
+        pdf.cell(25, 8, str(item["quantity"]), 0, 0, "R")
+        pdf.cell(30, 8, eu(item["unit_price"]), 0, 0, "R")
+        pdf.cell(35, 8, eu(item["total"]), 0, 1, "R")
+    base = data["total_amount"]
+    pdf.ln(6)
+    for label, value in (("Base imponible", base), ("IVA 21%", base * 0.21), ("Total factura", base * 1.21)):
+        pdf.cell(155, 8, label, 0, 0, "R")
+        pdf.cell(35, 8, f"{eu(value)} EUR", 0, 1, "R")
+    return bytes(pdf.output())
+
+
+def scanned_pdf(seed):
+    page = Image.new("L", (1240, 1754), 250)
+    draw = ImageDraw.Draw(page)
+    draw.text((100, 100), f"INVOICE F-2024-{seed:04d}", fill=20)
+    buffer = io.BytesIO()
+    page.save(buffer, format="JPEG", quality=80)
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.image(buffer, x=0, y=0, w=210, h=297)
+    return bytes(pdf.output())
+
+
+class StubModel:
+    """Stands in for Gemini: answers after a fixed delay."""
+    CLIENT = "Scan"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, contents, stream=False):
+        time.sleep(self.latency)
+        return type("Response", (), {"text": json.dumps({"client_name": StubModel.CLIENT, "items": [], "total_amount": 0})})()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=50)
+    parser.add_argument("--model-latency", type=float, default=1.5)
+    args = parser.parse_args()
+
+    corpus = []
+    for seed in range(args.invoices):
+        data = random_invoice(seed)
+        corpus.append(("premium", data, premium_pdf(data)))
+        corpus.append(("spanish", data, spanish_pdf(data)))
+    corpus.append(("scan", None, scanned_pdf(1)))
+    corpus.append(("no client", None, spanish_pdf(random_invoice(1), client=False)))
+
+    model = StubModel(args.model_latency)
+    timings, mismatches = {}, []
+    for kind, expected, content in corpus:
+        start = time.perf_counter()
+        result = proc.extract_invoice_data(content, "application/pdf", use_cache=False, model=model, preprocess=False)
+        timings.setdefault(kind, []).append(time.perf_counter() - start)
+        if expected is None:
+            if result.client_name != StubModel.CLIENT:
+                mismatches.append((kind, "model result", "accepted locally"))
+            continue
+        got = (result.invoice_number, result.date, len(result.items), round(result.items_total, 2))
+        want = (expected["invoice_number"], expected["date"], len(expected["items"]), expected["total_amount"])
+        if got != want:
+            mismatches.append((kind, want, got))
+
+    for kind, samples in timings.items():
+        print(f"{kind:<10} n={len(samples):<4} p50 {statistics.median(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+    print(proc.get_extraction_path_stats())
+
+    # Cache pass: each digital PDF and the scan, twice, through the persistent extraction cache
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        before = proc.get_extraction_cache_stats()
+        documents = [content for kind, _, content in corpus if kind in ("premium", "scan")]
+        for content in documents + documents:
+            proc.extract_invoice_data(content, "application/pdf", model=model, preprocess=False)
+        after = proc.get_extraction_cache_stats()
+        hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+        print(f"cache pass: {hits} hits, {misses} misses, {after['entries']} entries for {len(documents)} documents")
+        if hits != len(documents) or misses != len(documents):
+            mismatches.append(("cache", f"{len(documents)} hits", f"{hits} hits"))
+        db.close_connection()
+
+    for mismatch in mismatches[:10]:
+        print("mismatch:", mismatch)
+    print(f"{len(mismatches)} field mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
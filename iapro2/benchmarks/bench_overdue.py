@@ -0,0 +1,157 @@
+"""
+Overdue sweep and aging benchmark: seeds a large invoices table (many users, a
+few years of dates, mostly Paid) and times database.sweep_overdue_invoices on
+the first run (every aged Pending invoice flips) and on a steady-state run (one
+day's worth), against the row-by-row loop it replaces (select the aged ids,
+update each) and against the same UPDATE without the status index, which has
+to walk every aged invoice through the (user_id, date) index. Then times get_aging_report and get_open_by_due_month, and checks
+the results against plain Python over the same rows, including the per-status
+rollup the dashboard reads.
+
+Usage: python benchmarks/bench_overdue.py [--invoices 1000000] [--users 200] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+TODAY = datetime(2026, 10, 17)
+DAYS = 3 * 365
+
+
+def seed(invoice_count, user_count, rng):
+    """Invoices dated over the last three years; older ones are mostly Paid."""
+    conn = db.get_connection()
+    with conn:
+        users = [conn.execute("INSERT INTO users (dni, password_hash) VALUES (?, 'x')", (f"bench{u}",)).lastrowid
+                 for u in range(user_count)]
+        clients = {u: [conn.execute("INSERT INTO clients (user_id, name, name_key) VALUES (?, ?, ?)",
+                                    (u, f"Cliente {c}", f"cliente {c}")).lastrowid for c in range(20)] for u in users}
+        rows = []
+        for n in range(invoice_count):
+            user = users[n % user_count]
+            age = rng.randrange(DAYS)
+            status = "Pending" if rng.random() < (0.6 if age < 45 else 0.05) else "Paid"
+            rows.append((rng.choice(clients[user]), user, f"F-{n}", (TODAY - timedelta(days=age)).strftime('%Y-%m-%d'),
+                         round(rng.uniform(50, 5000), 2), status))
+        conn.executemany(
+            "INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, status) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    return users, rows
+
+
+def sweep_row_by_row(today):
+    """The per-invoice alternative: read the aged ids, then one UPDATE each."""
+    conn = db.get_connection()
+    cutoff = (today - timedelta(days=db.PAYMENT_TERMS_DAYS)).strftime('%Y-%m-%d')
+    with conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM invoices WHERE status = 'Pending' AND date < ?", (cutoff,))]
+        for invoice_id in ids:
+            conn.execute("UPDATE invoices SET status = 'Overdue' WHERE id = ?", (invoice_id,))
+    return len(ids)
+
+
+def timed(func, *args, repeat=1):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(25)
+    cutoff = (TODAY - timedelta(days=db.PAYMENT_TERMS_DAYS)).strftime('%Y-%m-%d')
+    failures = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        start = time.perf_counter()
+        users, rows = seed(args.invoices, args.users, rng)
+        print(f"{args.invoices} invoices for {args.users} users seeded in {time.perf_counter() - start:.1f}s")
+        expected = sum(1 for row in rows if row[5] == "Pending" and row[3] < cutoff)
+
+        conn = db.get_connection()
+        backup = os.path.join(tmp, "before.db")
+        no_status_index = os.path.join(tmp, "no_status_index.db")
+        conn.execute("VACUUM INTO ?", (backup,))
+        conn.execute("VACUUM INTO ?", (no_status_index,))
+
+        # First sweep over the seeded backlog: set-based, then the row-by-row loop on a copy
+        changed, first_ms = timed(db.sweep_overdue_invoices, None, TODAY)
+        if changed != expected:
+            failures.append(f"first sweep changed {changed}, expected {expected}")
+        db.DB_FILE = backup
+        looped, loop_ms = timed(sweep_row_by_row, TODAY)
+        if looped != expected:
+            failures.append(f"row-by-row sweep changed {looped}, expected {expected}")
+        db.DB_FILE = no_status_index
+        db.get_connection().execute("DROP INDEX idx_invoices_user_status_date")
+        changed, unindexed_ms = timed(db.sweep_overdue_invoices, None, TODAY)
+        if changed != expected:
+            failures.append(f"sweep without status index changed {changed}, expected {expected}")
+        _, unindexed_idle_ms = timed(db.sweep_overdue_invoices, None, TODAY, repeat=args.repeat)
+        db.close_connection()
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+
+        # Steady state: one more day ages one day's worth of Pending invoices
+        next_day = TODAY + timedelta(days=1)
+        expected_next = sum(1 for row in rows if row[5] == "Pending" and cutoff <= row[3] < (
+            next_day - timedelta(days=db.PAYMENT_TERMS_DAYS)).strftime('%Y-%m-%d'))
+        changed, daily_ms = timed(db.sweep_overdue_invoices, None, next_day)
+        if changed != expected_next:
+            failures.append(f"daily sweep changed {changed}, expected {expected_next}")
+        _, idle_ms = timed(db.sweep_overdue_invoices, None, next_day, repeat=args.repeat)
+
+        user = users[0]
+        aging, aging_ms = timed(db.get_aging_report.__wrapped__, user, next_day, repeat=args.repeat)
+        _, open_ms = timed(db.get_open_by_due_month, user, repeat=args.repeat)
+        open_rows = [row for row in rows if row[1] == user and row[5] == "Pending"]
+        if abs(aging["total"].sum() - sum(row[4] for row in open_rows)) > 0.01:
+            failures.append("aging total does not match the user's open invoices")
+        oldest = (next_day - timedelta(days=90)).strftime('%Y-%m-%d')
+        if abs(aging["90+"].sum() - sum(row[4] for row in open_rows if row[3] < oldest)) > 0.01:
+            failures.append("aging 90+ bucket does not match")
+
+        conn = db.get_connection()
+        rollup = dict(conn.execute(
+            "SELECT status, SUM(amount) FROM invoice_monthly_totals WHERE user_id = ? GROUP BY status", (user,)))
+        actual = dict(conn.execute(
+            "SELECT status, SUM(amount) FROM invoices WHERE user_id = ? GROUP BY status", (user,)))
+        if any(abs(rollup.get(status, 0) - amount) > 0.01 for status, amount in actual.items()):
+            failures.append(f"status rollup {rollup} differs from invoices {actual}")
+        plan = db.explain_query_plan(db.SWEEP_OVERDUE_SQL.format(where=""), (cutoff,))
+        db.close_connection()
+
+    print(f"sweep, first run        {first_ms:>9.1f} ms  ({expected} invoices; row by row {loop_ms:.1f} ms, "
+          f"{loop_ms / first_ms:.1f}x slower)")
+    print(f"  without status index  {unindexed_ms:>9.1f} ms")
+    print(f"sweep, next day         {daily_ms:>9.1f} ms  ({expected_next} invoices)")
+    print(f"sweep, nothing to do    {idle_ms:>9.1f} ms  (without status index {unindexed_idle_ms:.1f} ms)")
+    print(f"aging report (1 user)   {aging_ms:>9.1f} ms  ({int(aging['invoices'].sum())} open invoices, "
+          f"{len(aging)} clients)")
+    print(f"open by due month       {open_ms:>9.1f} ms")
+    print(f"sweep plan: {' | '.join(plan)}")
+    print("ok" if not failures else "FAILED: " + "; ".join(failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
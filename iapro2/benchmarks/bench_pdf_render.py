@@ -0,0 +1,53 @@
+"""
+PremiumInvoicePDF micro-benchmark: milliseconds per document and per page for
+invoices of increasing length (long invoices span many pages, so per-page header,
+footer and row costs dominate).
+
+Usage: python benchmarks/bench_pdf_render.py [--items 10 100 500 2000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from invoice_data import InvoiceData
+from invoice_generator import PremiumInvoicePDF
+
+
+def invoice(item_count):
+    return InvoiceData.from_dict({
+        "client_name": "Acme Logistics S.L.",
+        "client_address": "Calle Mayor 5, 28013 Madrid",
+        "invoice_number": "F-2024-0420",
+        "date": "2024-04-20",
+        "items": [
+            {"description": f"Pallet transport route {n % 37} - zone {n % 5}", "quantity": n % 9 + 1,
+             "unit_price": round(12.5 + (n * 7.31) % 480, 2)}
+            for n in range(item_count)
+        ],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'items':>7}{'pages':>7}{'ms/doc':>10}{'ms/page':>10}{'KB':>8}")
+    for item_count in args.items:
+        data = invoice(item_count)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            pdf = PremiumInvoicePDF(data)
+            content = pdf.generate()
+            timings.append(time.perf_counter() - start)
+        best = min(timings) * 1000
+        print(f"{item_count:>7}{pdf.pages_count:>7}{best:>10.1f}{best / pdf.pages_count:>10.2f}{len(content) / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Pre-processing benchmark on a generated local corpus (no network access):
+phone-style photos of invoices with EXIF rotation and desk borders, a
+screenshot-style PNG and a scanned (image-only) PDF.
+
+Usage: python benchmarks/bench_preprocessing.py [--repeat 3]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+from PIL import Image, ImageDraw
+
+import preprocessing
+
+
+def invoice_page(width, height, seed):
+    rng = random.Random(seed)
+    page = Image.new("RGB", (width, height), (250, 250, 245))
+    draw = ImageDraw.Draw(page)
+    y = height // 12
+    draw.text((width // 12, y), f"INVOICE #{seed:05d}", fill=(20, 20, 20))
+    for line in range(40):
+        y += height // 50
+        draw.text((width // 12, y), f"Item {line}  qty {rng.randint(1, 9)}  {rng.uniform(5, 500):.2f} EUR", fill=(30, 30, 30))
+        draw.line((width // 12, y + 12, width - width // 12, y + 12), fill=(200, 200, 200))
+    return page
+
+
+def phone_photo(seed):
+    """12 MP photo: document on a dark desk, stored sideways with an EXIF orientation tag."""
+    desk = Image.new("RGB", (4000, 3000), (60, 45, 35))
+    noise = Image.effect_noise((4000, 3000), 18).convert("RGB")
+    desk = Image.blend(desk, noise, 0.15)
+    desk.paste(invoice_page(2300, 2900, seed).rotate(90, expand=True).resize((2800, 2200)), (600, 400))
+    exif = Image.Exif()
+    exif[0x0112] = 6 # Rotate 90 CW on display
+    buffer = io.BytesIO()
+    desk.save(buffer, format="JPEG", quality=95, exif=exif)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def screenshot(seed):
+    buffer = io.BytesIO()
+    invoice_page(1440, 2560, seed).save(buffer, format="PNG")
+    return buffer.getvalue(), "image/png"
+
+
+def scanned_pdf(seed, pages=3):
+    pdf = FPDF()
+    for page in range(pages):
+        buffer = io.BytesIO()
+        scan = invoice_page(2480, 3508, seed + page)
+        scan = Image.blend(scan, Image.effect_noise(scan.size, 12).convert("RGB"), 0.08) # scanner noise
+        scan.save(buffer, format="JPEG", quality=92) # scanners typically embed DCT images
+        pdf.add_page()
+        pdf.image(buffer, x=0, y=0, w=210, h=297)
+    return bytes(pdf.output()), "application/pdf"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = [
+        ("phone photo", *phone_photo(1)),
+        ("phone photo", *phone_photo(2)),
+        ("screenshot png", *screenshot(3)),
+        ("scanned pdf", *scanned_pdf(4)),
+    ]
+    print(f"{'document':<16}{'in KB':>10}{'out KB':>10}{'saved':>8}{'ms':>9}  stages (ms)")
+    for name, content, mime_type in corpus:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = preprocessing.preprocess_document(content, mime_type)
+            timings.append(time.perf_counter() - start)
+        saved = result.bytes_saved / result.original_bytes * 100
+        stages = ", ".join(f"{stage} {secs * 1000:.0f}" for stage, secs in result.stages.items())
+        print(f"{name:<16}{result.original_bytes / 1024:>10,.0f}{len(result.content) / 1024:>10,.0f}"
+              f"{saved:>7.0f}%{min(timings) * 1000:>9.0f}  {stages}")
+    print(preprocessing.get_preprocessing_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Bulk reconciliation benchmark on a generated month of deliveries (no network access).
+
+Each invoice gets one to three delivery notes (weekly deliveries billed monthly)
+with known injected faults: short deliveries, price changes, undelivered and
+uninvoiced lines and reworded descriptions. The script checks that every fault is
+reported, counts blocked vs possible document pairs and how many item pairs would
+go to the model resolver (a stub here).
+
+It then goes through the processor wrappers with a stubbed Gemini model:
+compare_documents with InvoiceData and dict inputs must send only the items the
+local matcher left unresolved to the item-pairing call and apply its pairs. A
+broken or out-of-range reply must leave those items unresolved without failing.
+use_llm=False must not call the model, raw text must get the free-text
+comparison, and reconcile_documents must route leftovers to the same call.
+
+Usage: python benchmarks/bench_reconciliation.py [--invoices 500]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import processor as proc
+import reconciliation
+from invoice_data import InvoiceData, LineItem
+
+PRODUCTS = [
+    "Agua mineral 1,5L caja", "Cafe en grano 1kg", "Papel A4 80g resma", "Toner HP 85A negro",
+    "Aceite de oliva virgen extra 5L", "Harina de trigo 25kg", "Detergente industrial 10L",
+    "Guantes nitrilo talla M caja 100", "Bolsas basura 120L rollo", "Servilletas 2 capas paquete",
+    "Tornillos inox M6 caja 200", "Cable electrico 2,5mm rollo 100m", "Pintura plastica blanca 15L",
+    "Cemento cola saco 25kg", "Leche entera brick 1L", "Azucar blanquilla 1kg",
+]
+REWORDED = {"Cafe en grano 1kg": "Cafe grano natural 1 kg", "Papel A4 80g resma": "Resma papel 80 g A4"}
+REGIONS = ("Norte", "Sur", "Levante", "Poniente", "Centro", "Atlantico", "Mediterraneo", "Pirineo")
+
+
+def build_corpus(invoice_count, seed=7):
+    rng = random.Random(seed)
+    invoices, notes, faults = {}, {}, {}
+    for n in range(invoice_count):
+        invoice_id = f"F-{n:05d}"
+        # One invoice per client and month
+        client = f"Comercial {REGIONS[n // 12 % len(REGIONS)]} {n // 96} S.L."
+        month = n % 12 + 1
+        items = [LineItem(p, rng.randint(4, 60), round(rng.uniform(1, 90), 2)) for p in rng.sample(PRODUCTS, rng.randint(2, 6))]
+        invoices[invoice_id] = InvoiceData(client_name=client, invoice_number=invoice_id, date=f"2024-{month:02d}-28", items=items)
+
+        # Split each line's quantity over 1-3 weekly delivery notes
+        weeks = rng.randint(1, 3)
+        delivered = [[] for _ in range(weeks)]
+        expected = set()
+        for item in items:
+            fault = rng.random()
+            if fault < 0.05:
+                expected.add(("missing_in_delivery", item.description))
+                continue
+            quantity = item.quantity
+            if fault < 0.10:
+                quantity -= rng.randint(1, 3)
+                expected.add(("quantity", item.description))
+            price = item.unit_price
+            if 0.10 <= fault < 0.15:
+                price = round(price * 1.08, 2)
+                expected.add(("unit_price", item.description))
+            description = REWORDED.get(item.description, item.description) if fault > 0.9 else item.description
+            shares = [quantity // weeks] * weeks
+            shares[0] += quantity - sum(shares)
+            for week, share in enumerate(shares):
+                if share:
+                    delivered[week].append(LineItem(description, share, price))
+        if rng.random() < 0.05:
+            extra = rng.choice([p for p in PRODUCTS if p not in {i.description for i in items}])
+            delivered[-1].append(LineItem(extra, 2, 0.0))
+            expected.add(("not_invoiced", extra))
+        for week, lines in enumerate(delivered):
+            if lines:
+                notes[f"A-{n:05d}-{week}"] = InvoiceData(client_name=client.upper().replace(" S.L.", " SL"),
+                                                        date=f"2024-{month:02d}-{7 * week + 3:02d}", items=lines)
+        faults[invoice_id] = expected
+    return invoices, notes, faults
+
+
+class PairingModel:
+    """Stub Gemini for the item-pairing call: pairs lines listed in SYNONYMS, or returns a canned reply."""
+    SYNONYMS = {"Cafe en grano 1kg": "Arabica tostado bolsa kilo", "Toner HP 85A negro": "Cartucho laser CE285A"}
+
+    def __init__(self, reply=None):
+        self.reply = reply
+        self.requests = []
+
+    def generate_content(self, contents):
+        self.requests.append(contents)
+        if self.reply is not None:
+            return type("Response", (), {"text": self.reply})()
+        invoice_part, delivery_part = contents.split("\n\nDelivery note items:\n")
+        invoice_lines = dict(line.split(": ", 1)[::-1] for line in invoice_part.splitlines()[1:])
+        delivery_lines = dict(line.split(": ", 1)[::-1] for line in delivery_part.splitlines())
+        pairs = [{"invoice_item": int(invoice_lines[a]), "delivery_item": int(delivery_lines[b])}
+                 for a, b in self.SYNONYMS.items() if a in invoice_lines and b in delivery_lines]
+        return type("Response", (), {"text": json.dumps({"pairs": pairs})})()
+
+
+def check_processor_wrappers():
+    """Returns the failures found going through proc.compare_documents and proc.reconcile_documents."""
+    # The stub answers instantly; the shared scheduler's rate limit is not under test
+    proc._scheduler = proc.GeminiScheduler(requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12, max_retries=0)
+    invoice = InvoiceData(client_name="Comercial Norte S.L.", invoice_number="F-1", items=[
+        LineItem("Agua mineral 1,5L caja", 10, 3.5), LineItem("Cafe en grano 1kg", 4, 18.0),
+        LineItem("Toner HP 85A negro", 2, 60.0), LineItem("Papel A4 80g resma", 20, 4.2)])
+    note = InvoiceData(client_name="COMERCIAL NORTE SL", items=[
+        LineItem("Agua mineral 1.5 L caja", 10, 3.5), LineItem("Arabica tostado bolsa kilo", 3, 18.0),
+        LineItem("Cartucho laser CE285A", 2, 60.0), LineItem("Papel A4 80g resma", 20, 4.2)])
+    failures = []
+
+    def kinds(result):
+        return sorted((d.kind, d.description) for d in result.discrepancies)
+
+    model = PairingModel()
+    result = proc.compare_documents(invoice, note, model=model)
+    resolved = sorted((i, d) for i, d, _, source in result.matches if source == "resolver")
+    print(f"compare_documents: {len(result.matches)} matches ({len(resolved)} from the model), "
+          f"discrepancies {kinds(result)}, model calls {len(model.requests)}")
+    if len(model.requests) != 1 or "Agua" in model.requests[0] or "Papel" in model.requests[0]:
+        failures.append(f"pairing call should carry only the unresolved items: {model.requests}")
+    if resolved != [(1, 1), (2, 2)] or kinds(result) != [("quantity", "Cafe en grano 1kg")]:
+        failures.append(f"model pairs not applied: {resolved}, {kinds(result)}")
+
+    from_dicts = proc.compare_documents(invoice.to_dict(), note.to_dict(), model=PairingModel())
+    if from_dicts.to_dict() != result.to_dict():
+        failures.append("dict inputs reconcile differently from InvoiceData inputs")
+
+    unresolved = [("missing_in_delivery", "Cafe en grano 1kg"), ("missing_in_delivery", "Toner HP 85A negro"),
+                  ("not_invoiced", "Arabica tostado bolsa kilo"), ("not_invoiced", "Cartucho laser CE285A")]
+    for label, reply in (("not JSON", "Sorry, I cannot help with that."),
+                         ("out of range", '{"pairs": [{"invoice_item": 7, "delivery_item": 0}]}')):
+        broken = PairingModel(reply)
+        outcome = proc.compare_documents(invoice, note, model=broken)
+        if len(broken.requests) != 1 or kinds(outcome) != unresolved:
+            failures.append(f"{label} pairing reply: {kinds(outcome)}")
+
+    offline = PairingModel()
+    if kinds(proc.compare_documents(invoice, note, use_llm=False, model=offline)) != unresolved or offline.requests:
+        failures.append("use_llm=False should leave the items unresolved without calling the model")
+
+    text_model = PairingModel("Both documents list the same goods.")
+    text = proc.compare_documents("Factura F-1: 10 cajas de agua", "Albaran: 10 cajas de agua", model=text_model)
+    if text != "Both documents list the same goods." or "Delivery Note:" not in text_model.requests[0]:
+        failures.append(f"raw text should get the free-text comparison, got {text!r}")
+
+    bulk_model = PairingModel()
+    bulk = proc.reconcile_documents({"F-1": invoice}, {"A-1": note}, model=bulk_model)
+    if len(bulk_model.requests) != 1 or [kinds(r) for r in bulk.results] != [kinds(result)]:
+        failures.append("reconcile_documents did not resolve leftovers through the model")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=500)
+    args = parser.parse_args()
+
+    invoices, notes, faults = build_corpus(args.invoices)
+    resolver_calls = []
+
+    def stub_resolver(invoice_items, delivery_items):
+        resolver_calls.append((len(invoice_items), len(delivery_items)))
+        return []
+
+    start = time.perf_counter()
+    outcome = reconciliation.reconcile_bulk(invoices, notes, resolver=stub_resolver)
+    elapsed = time.perf_counter() - start
+
+    found = {r.invoice: {(d.kind, d.description) for d in r.discrepancies} for r in outcome.results}
+    # An invoice with nothing delivered at all is reported as unmatched instead
+    for invoice_id in outcome.unmatched_invoices:
+        found[invoice_id] = {("missing_in_delivery", item.description) for item in invoices[invoice_id].items}
+    missed = [(invoice_id, sorted(expected - found.get(invoice_id, set())))
+              for invoice_id, expected in faults.items() if expected - found.get(invoice_id, set())]
+    misattached = sum(1 for r in outcome.results for note in r.delivery_notes if note[2:7] != r.invoice[2:7])
+
+    print(f"{len(invoices)} invoices x {len(notes)} delivery notes in {elapsed:.2f}s")
+    print(f"pairs scored {outcome.pairs_scored:,} of {outcome.pairs_possible:,} "
+          f"({outcome.pairs_scored / max(1, outcome.pairs_possible):.2%})")
+    print(f"discrepancies {len(outcome.discrepancies)}, resolver calls {len(resolver_calls)}, "
+          f"unmatched invoices {len(outcome.unmatched_invoices)}, unmatched notes {len(outcome.unmatched_delivery_notes)}, "
+          f"misattached notes {misattached}")
+    for invoice_id, kinds in missed[:10]:
+        print("missed:", invoice_id, kinds)
+    print(f"{len(missed)} invoices with unreported faults")
+
+    failures = check_processor_wrappers()
+    for failure in failures:
+        print("[FAIL]", failure)
+    sys.exit(1 if missed or misattached or failures else 0)
+
+
+if __name__ == "__main__":
+    main()
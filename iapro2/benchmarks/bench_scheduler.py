@@ -0,0 +1,180 @@
+"""
+Exercises the Gemini call scheduler against a local fake that injects 429s,
+latency and an outage, then prints the scheduler metrics. No network access.
+
+Besides retries and the circuit breaker, it runs a batch under a low request
+rate (one-request burst) and checks the spacing between upstream calls, then a
+batch whose deadline expires while waiting for rate capacity and checks that
+those documents fail fast with a deadline error instead of waiting. On a fake
+clock, a half-open breaker's trial call times out in the rate-limit wait; the
+next call must become the trial and close the breaker.
+
+Usage: python benchmarks/bench_scheduler.py [--documents 40] [--error-rate 0.3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+db.DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+db.init_db()
+
+import processor as proc
+from google.api_core import exceptions as api_exceptions
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGemini:
+    """generate_content() with configurable latency, 429 rate and an optional outage window."""
+
+    def __init__(self, error_rate, latency, outage=None):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.outage = outage
+        self.calls = 0
+        self.started = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents):
+        with self._lock:
+            self.calls += 1
+            self.started.append(time.monotonic())
+        time.sleep(self.latency)
+        if self.outage and self.outage[0] <= time.monotonic() < self.outage[1]:
+            raise api_exceptions.ServiceUnavailable("upstream down")
+        if random.random() < self.error_rate:
+            raise api_exceptions.ResourceExhausted("429 quota exceeded")
+        return FakeResponse(json.dumps({"client_name": "Fake", "date": "2026-01-01", "items": [], "total_amount": 1}))
+
+
+def run(label, documents, fake, scheduler, workers):
+    proc._scheduler = scheduler
+    docs = [(f"doc{i}.png", f"{label}-{i}".encode(), "image/png") for i in range(documents)]
+    start = time.perf_counter()
+    # The fake documents are not real images: skip pre-processing, only the scheduler is measured
+    results = proc.extract_batch(docs, max_workers=workers, use_cache=False, model=fake, preprocess=False)
+    elapsed = time.perf_counter() - start
+    ok = sum(r["status"] == "ok" for r in results)
+    metrics = scheduler.metrics()
+    print(f"{label:<22} {ok}/{documents} ok in {elapsed:.2f}s, upstream calls={fake.calls}, "
+          f"failures={metrics['failures']} (rejected by breaker {metrics['rejected']})")
+    print(f"{'':<22} {metrics}")
+    return results, elapsed, metrics
+
+
+def paced_scheduler(requests_per_minute, **kwargs):
+    """Scheduler whose request bucket holds a single request, so every call waits its turn."""
+    scheduler = proc.GeminiScheduler(requests_per_minute=requests_per_minute, **kwargs)
+    scheduler.requests = proc.TokenBucket(requests_per_minute, capacity=1)
+    return scheduler
+
+
+class FakeClock:
+    """time.monotonic/time.sleep pair where sleeping only advances the clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def half_open_recovery():
+    """Returns the breaker state after each step: outage, trial timed out in the rate wait, later call."""
+    clock = FakeClock()
+    breaker = proc.CircuitBreaker(failure_threshold=1, reset_seconds=60, clock=clock)
+    scheduler = proc.GeminiScheduler(max_retries=0, breaker=breaker, clock=clock, sleep=clock.sleep)
+    scheduler.requests = proc.TokenBucket(60, capacity=1, clock=clock, sleep=clock.sleep)
+    states = []
+
+    def step(fn, deadline_seconds=None):
+        try:
+            scheduler.call(fn, deadline_seconds=deadline_seconds)
+        except Exception as e:
+            states.append(f"{breaker.state} ({type(e).__name__})")
+        else:
+            states.append(breaker.state)
+
+    def down(timeout):
+        raise api_exceptions.ServiceUnavailable("upstream down")
+
+    step(down)
+    clock.sleep(breaker.reset_seconds)
+    scheduler.requests.acquire(1) # Another caller takes the only request slot
+    step(lambda timeout: "ok", deadline_seconds=0.5)
+    clock.sleep(2)
+    step(lambda timeout: "ok")
+    return states
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--paced-rpm", type=int, default=600)
+    args = parser.parse_args()
+    random.seed(7)
+    failures = []
+
+    fast_backoff = dict(backoff_base=0.01, backoff_max=0.1)
+    run("no retries", args.documents, FakeGemini(args.error_rate, args.latency),
+        proc.GeminiScheduler(max_retries=0, requests_per_minute=6000, **fast_backoff), args.workers)
+    run("retries + backoff", args.documents, FakeGemini(args.error_rate, args.latency),
+        proc.GeminiScheduler(requests_per_minute=6000, **fast_backoff), args.workers)
+
+    # Pacing: upstream calls start no closer than 60 / rpm seconds apart
+    paced = FakeGemini(0.0, args.latency)
+    interval = 60 / args.paced_rpm
+    results, _, _ = run(f"paced ({args.paced_rpm} rpm)", 20, paced, paced_scheduler(args.paced_rpm), args.workers)
+    gaps = [b - a for a, b in zip(paced.started, paced.started[1:])]
+    print(f"{'':<22} call spacing min {min(gaps) * 1000:.0f} ms (limit {interval * 1000:.0f} ms)")
+    if min(gaps) < interval * 0.95 or any(r["status"] != "ok" for r in results):
+        failures.append("paced calls closer than the request rate allows")
+
+    # Deadline: at 60 rpm only the first calls fit in a 1.5 s deadline; the rest fail without waiting
+    deadline = 1.5
+    results, elapsed, metrics = run("deadline (60 rpm)", args.workers, FakeGemini(0.0, args.latency),
+                                    paced_scheduler(60, deadline_seconds=deadline), args.workers)
+    expected_ok = int(deadline) + 1  # one request per second, the first right away
+    timed_out = sum("Deadline exceeded" in (r["error"] or "") for r in results)
+    ok = sum(r["status"] == "ok" for r in results)
+    if ok != expected_ok or timed_out != args.workers - expected_ok or elapsed > deadline + 0.5:
+        failures.append(f"deadline run: {ok} ok (expected {expected_ok}), {timed_out} deadline errors in {elapsed:.2f}s")
+
+    now = time.monotonic()
+    outage = FakeGemini(0.0, args.latency, outage=(now, now + 60))
+    results, _, metrics = run(
+        "outage (breaker)", args.documents, outage,
+        proc.GeminiScheduler(requests_per_minute=6000, breaker=proc.CircuitBreaker(reset_seconds=60), **fast_backoff),
+        args.workers)
+    if metrics["failures"] != args.documents or not metrics["rejected"]:
+        failures.append(f"outage run counted {metrics['failures']} failures for {args.documents} failed documents")
+
+    states = half_open_recovery()
+    print(f"{'half-open trial':<22} outage -> {states[0]}, trial timed out -> {states[1]}, next call -> {states[2]}")
+    if states[2] != "closed":
+        failures.append(f"breaker did not recover after a timed-out trial: {states}")
+
+    print("ok" if not failures else "FAILED: " + "; ".join(failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Full-text search benchmark: seeds invoices through add_invoices_bulk (so the
+search triggers run on every insert), then times database.search() for typical
+queries, bypassing the query cache. A second user's invoices share the index
+to check that results never leak across users.
+
+Usage: python benchmarks/bench_search.py [--invoices 100000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+CLIENT_WORDS = ("Pepsico", "Pepe", "Acme", "Iberia", "Logistica", "Norte", "Catalana", "Hoteles", "Grupo", "Textil",
+                "Mercados", "Soluciones", "Atlantica", "Digital", "Consultores", "Talleres")
+SERVICES = ("Servicio de catering", "Catering evento corporativo", "Hosting web anual", "Mantenimiento servidores",
+            "Transporte palets", "Consultoria fiscal", "Diseno grafico", "Licencia software", "Limpieza oficinas",
+            "Formacion equipo", "Auditoria contable", "Alquiler furgoneta", "Material de oficina", "Soporte tecnico")
+QUERIES = ("pep", "catering", "F-2024-00001", "hosting web", "acme iberia", "consultoria", "norte catering",
+           "Mantenimiento", "F-2024-0000123", "zzzz")
+
+
+def invoices(user_tag, count, rng):
+    for i in range(count):
+        client = f"{rng.choice(CLIENT_WORDS)} {rng.choice(CLIENT_WORDS)} {i % 500} S.L."
+        items = [{"description": f"{rng.choice(SERVICES)} {rng.randint(1, 99)}", "quantity": rng.randint(1, 9),
+                  "unit_price": round(rng.uniform(10, 900), 2)} for _ in range(rng.randint(1, 5))]
+        yield {"client_name": client, "invoice_number": f"F-{2023 + i % 2}-{user_tag}{i:07d}",
+               "date": f"{2023 + i % 2}-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "amount": 100.0, "items": items}
+
+
+def seed(user_id, user_tag, count, rng, batch=5000):
+    start = time.perf_counter()
+    source = invoices(user_tag, count, rng)
+    for _ in range(0, count, batch):
+        db.add_invoices_bulk(user_id, [next(source) for _ in range(min(batch, count))])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(5)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.close_connection()
+        db.init_db()
+        conn = db.get_connection()
+        with conn:
+            owner = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('owner', 'x')").lastrowid
+            other = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('other', 'x')").lastrowid
+        seconds = seed(owner, "", args.invoices, rng)
+        seed(other, "9", args.invoices // 5, rng)
+        print(f"{args.invoices} invoices seeded with search triggers in {seconds:.1f}s "
+              f"({args.invoices / seconds:,.0f}/s), index {os.path.getsize(db.DB_FILE) / 1e6:.0f} MB database")
+
+        owned = {row[0] for row in conn.execute("SELECT id FROM invoices WHERE user_id = ?", (owner,))}
+        leaked = 0
+        print(f"{'query':<18}{'hits':>6}{'p50 ms':>9}{'max ms':>9}  top result")
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                page, next_offset = db.search.__wrapped__(owner, query, 20, 0)
+                timings.append((time.perf_counter() - start) * 1000)
+            leaked += sum(1 for invoice_id in page["id"] if invoice_id not in owned)
+            top = f"{page.iloc[0]['invoice_number']} {page.iloc[0]['client_name']}" if len(page) else "-"
+            hits = f"{len(page)}{'+' if next_offset else ''}"
+            print(f"{query:<18}{hits:>6}{statistics.median(timings):>9.1f}{max(timings):>9.1f}  {top}")
+        db.close_connection()
+
+    print("no cross-user results" if not leaked else f"LEAKED {leaked} results")
+    sys.exit(1 if leaked else 0)
+
+
+if __name__ == "__main__":
+    main()
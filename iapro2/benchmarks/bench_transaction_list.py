@@ -0,0 +1,143 @@
+"""
+Transaction list render benchmark: runs the Dashboard's list through Streamlit's
+AppTest with the old per-row component (a <style> block, three columns and a
+delete button per invoice) and with ui_components.transaction_list (CSS once,
+one HTML payload, one multi-select delete). Reports script run time, the number
+of deltas sent to the browser and their serialized size, then checks that the
+selection-based delete hands the selected ids to its callback.
+
+Usage: python benchmarks/bench_transaction_list.py [--rows 10 100 500 1000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import local_script_runner
+
+STATUSES = ("Paid", "Pending", "Overdue")
+SENT = {"deltas": 0, "bytes": 0}
+
+
+def record_messages(parse):
+    """Wraps AppTest's message parser to count the deltas of each script run and their size."""
+    def wrapper(messages):
+        deltas = [msg for msg in messages if msg.HasField("delta")]
+        SENT["deltas"] = len(deltas)
+        SENT["bytes"] = sum(msg.ByteSize() for msg in deltas)
+        return parse(messages)
+    return wrapper
+
+
+def invoices(count):
+    return pd.DataFrame({
+        "id": range(1, count + 1),
+        "client_name": [f"Cliente {i % 97} S.L." for i in range(count)],
+        "invoice_number": [f"F-{i:06d}" for i in range(count)],
+        "date": [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(count)],
+        "amount": [round(100 + i * 3.7, 2) for i in range(count)],
+        "status": [STATUSES[i % 3] for i in range(count)],
+    })
+
+
+def per_row_app(count):
+    """The Dashboard list before transaction_list, with its row component inlined."""
+    import streamlit as st
+    import ui_components as ui
+    from bench_transaction_list import invoices
+
+    ui.setup_page()
+    for _, row in invoices(count).iterrows():
+        st.markdown("""
+        <style>
+        .t-row { display: flex; align-items: center; background-color: #121212; padding: 12px;
+                 border-radius: 16px; margin-bottom: 8px; border: 1px solid #1C1C1E; }
+        .t-icon { width: 40px; height: 40px; background: #2C2C2E; border-radius: 50%; display: flex;
+                  align-items: center; justify-content: center; font-weight: bold; color: #6B7280; margin-right: 15px; }
+        .t-details { flex-grow: 1; }
+        .t-title { display: block; font-weight: 600; font-size: 14px; color: #FFF; }
+        .t-sub { display: block; font-size: 12px; color: #6B7280; }
+        .t-amount { font-weight: 700; font-size: 14px; color: #FFF; text-align: right; margin-right: 15px;}
+        .status-badge { font-size: 10px; padding: 4px 8px; border-radius: 6px; font-weight: 600; }
+        .status-paid { background-color: rgba(16, 185, 129, 0.2); color: #34D399; }
+        .status-pending { background-color: rgba(245, 158, 11, 0.2); color: #FBBF24; }
+        .status-overdue { background-color: rgba(239, 68, 68, 0.2); color: #F87171; }
+        </style>
+        """, unsafe_allow_html=True)
+        col1, col2, col3 = st.columns([0.7, 0.2, 0.1])
+        with col1:
+            st.markdown(f"""
+            <div class="t-row">
+                <div class="t-icon">{row['client_name'][0]}</div>
+                <div class="t-details">
+                    <span class="t-title">{row['client_name']}</span>
+                    <span class="t-sub">{row['date']}</span>
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+        with col2:
+            st.markdown(f"""
+            <div style="text-align: right; padding-top: 10px;">
+                <div class="t-amount">€{row['amount']:,.2f}</div>
+                <span class="status-badge status-{row['status'].lower()}">{row['status']}</span>
+            </div>
+            """, unsafe_allow_html=True)
+        with col3:
+            st.markdown("<div style='padding-top: 15px;'>", unsafe_allow_html=True)
+            st.button("🗑️", key=f"del_{row['id']}", help="Delete Invoice")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+
+def single_render_app(count):
+    import streamlit as st
+    import ui_components as ui
+    from bench_transaction_list import invoices
+
+    ui.setup_page()
+    ui.transaction_list(invoices(count), key="recent", on_delete=lambda ids: st.session_state.update(deleted=ids))
+
+
+def measure(app, count, repeat):
+    """Median run time (ms), deltas and delta bytes of a fresh run and of a rerun."""
+    at = AppTest.from_function(app, args=(count,), default_timeout=120)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        at.run()
+        timings.append((time.perf_counter() - start) * 1000)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return statistics.median(timings), SENT["deltas"], SENT["bytes"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 500, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    local_script_runner.parse_tree_from_messages = record_messages(local_script_runner.parse_tree_from_messages)
+
+    print(f"{'rows':>6}  {'per-row ms':>10}{'deltas':>8}{'KB':>8}  {'single ms':>10}{'deltas':>8}{'KB':>8}  speedup")
+    for count in args.rows:
+        old_ms, old_deltas, old_bytes = measure(per_row_app, count, args.repeat)
+        new_ms, new_deltas, new_bytes = measure(single_render_app, count, args.repeat)
+        print(f"{count:>6}  {old_ms:>10.0f}{old_deltas:>8}{old_bytes / 1024:>8.0f}  "
+              f"{new_ms:>10.0f}{new_deltas:>8}{new_bytes / 1024:>8.0f}  {old_ms / new_ms:>6.1f}x")
+
+    # Selection-based delete: pick three rows, click once, get their ids in the callback and a cleared selection
+    at = AppTest.from_function(single_render_app, args=(500,), default_timeout=60).run()
+    at.multiselect(key="recent_selected").select(3).select(250).select(500).run()
+    at.button(key="recent_delete").click().run()
+    deleted = at.session_state["deleted"] if "deleted" in at.session_state else None
+    ok = deleted == [3, 250, 500] and not at.multiselect(key="recent_selected").value and not at.exception
+    print(f"delete callback received {deleted}" if ok else f"DELETE FAILED: {deleted} {at.exception}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Checks batch ingestion end to end with a fake model: expand_documents on loose
+files and ZIP archives, then extract_batch with per-file results.
+
+The upload mixes supported and unsupported loose files, a corrupt ZIP and a ZIP
+holding images, a text file, an oversized image, a folder, macOS metadata and
+more members than the cap. The caps are lowered so the check stays small. Every
+expected document must come back in input order with the client the fake model
+read from its bytes, and the failing ones (a non-retryable model error, a reply
+that is not JSON) only fail themselves. Every ignored name must be reported as
+skipped, and nothing else.
+
+Usage: python benchmarks/check_batch_extraction.py
+Exits non-zero on any mismatch.
+"""
+import io
+import json
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import processor as proc
+from google.api_core import exceptions as api_exceptions
+
+MAX_MEMBERS = 8
+MAX_BYTES = 1024
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Answers with the document's bytes as the client name; b'bad request' and b'garbled' fail."""
+
+    def generate_content(self, contents):
+        data = contents[0]["data"]
+        if data == b"bad request":
+            raise api_exceptions.InvalidArgument("400 unsupported document")
+        if data == b"garbled":
+            return FakeResponse("I could not read this invoice.")
+        return FakeResponse(json.dumps({"client_name": data.decode(), "items": [], "total_amount": 1}))
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in members:
+            if name.endswith("/"):
+                archive.writestr(zipfile.ZipInfo(name), b"")
+            else:
+                archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def upload():
+    """Returns (files, expected documents as (name, client or error marker), expected skipped names)."""
+    zipped = [
+        ("scans/", None),
+        ("scans/a.png", b"Zip Client A"),
+        ("scans/b.JPG", b"Zip Client B"),
+        ("notes.txt", b"not an invoice"),
+        ("scans/huge.png", b"x" * (MAX_BYTES + 1)),
+        ("__MACOSX/scans/._a.png", b"resource fork"),
+        ("scans/c.png", b"bad request"),
+        ("voice.m4a", b"Zip Client Audio"),
+    ]
+    # Members past the cap are skipped in archive order
+    zipped += [(f"extra/{n}.png", f"Extra {n}".encode()) for n in range(MAX_MEMBERS)]
+    files = [
+        ("loose.jpeg", b"Loose Client"),
+        ("readme.md", b"# docs"),
+        ("oversized.pdf", b"y" * (MAX_BYTES + 1)),
+        ("batch.zip", zip_bytes(zipped)),
+        ("broken.zip", b"PK\x03\x04 not really a zip"),
+        ("garbled.png", b"garbled"),
+    ]
+    counted = [name for name, _ in zipped if not name.endswith("/") and not name.startswith("__MACOSX/")]
+    kept = counted[:MAX_MEMBERS]
+    expected = [("loose.jpeg", "Loose Client")]
+    expected += [(f"batch.zip/{name}", content.decode()) for name, content in zipped
+                 if name in kept and proc.guess_mime_type(name) and len(content) <= MAX_BYTES]
+    expected += [("garbled.png", "garbled")]
+    skipped = ["readme.md", "oversized.pdf"]
+    skipped += [f"batch.zip/{name}" for name in kept if name in ("notes.txt", "scans/huge.png")]
+    skipped += [f"batch.zip/{name}" for name in counted[MAX_MEMBERS:]]
+    skipped += ["broken.zip"]
+    return files, expected, skipped
+
+
+def main():
+    proc.BATCH_MAX_ZIP_MEMBERS = MAX_MEMBERS
+    proc.BATCH_MAX_DOCUMENT_BYTES = MAX_BYTES
+    # The fake answers instantly; the shared scheduler's rate limit is not under test
+    proc._scheduler = proc.GeminiScheduler(requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12, max_retries=0)
+    failures = []
+
+    files, expected, expected_skipped = upload()
+    documents, skipped = proc.expand_documents(files)
+    if [name for name, _, _ in documents] != [name for name, _ in expected]:
+        failures.append(f"documents {[name for name, _, _ in documents]} != {[name for name, _ in expected]}")
+    if skipped != expected_skipped:
+        failures.append(f"skipped {skipped} != {expected_skipped}")
+
+    results = proc.extract_batch(documents, max_workers=3, use_cache=False, model=FakeModel(), preprocess=False)
+    print(f"{len(files)} uploads -> {len(documents)} documents, {len(skipped)} skipped")
+    for (name, content, mime_type), result in zip(documents, results):
+        print(f"  {result['status']:<6}{name:<28}{mime_type:<16}{result['error'] or result['data'].client_name}")
+        if result["name"] != name:
+            failures.append(f"result {result['index']} is {result['name']}, expected {name}")
+        elif content in (b"bad request", b"garbled"):
+            if result["status"] != "error" or not result["error"]:
+                failures.append(f"{name}: expected an error, got {result['status']}")
+        elif result["status"] != "ok" or result["data"].client_name != content.decode():
+            failures.append(f"{name}: {result['status']} {result['error'] or result['data'].client_name}")
+    if [result["index"] for result in results] != list(range(len(documents))):
+        failures.append("results are not in input order")
+    for name in skipped:
+        print(f"  skip  {name}")
+
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    print("ok" if not failures else f"FAILED: {len(failures)} mismatches")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
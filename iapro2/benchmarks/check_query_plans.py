@@ -0,0 +1,146 @@
+"""
+Checks that the hot queries are served by indexes rather than full table scans.
+
+Each hot path calls the real database function on a small seeded database
+through a connection that records every statement it executes; the check then
+runs EXPLAIN QUERY PLAN on exactly those statements with their parameters, so
+the plans are the ones the application gets. Keyset page queries must also
+read rows in index order (no sort of the user's invoices).
+
+Usage: python benchmarks/check_query_plans.py
+Exits non-zero if any hot query plan contains a full SCAN of a table.
+"""
+import functools
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+TODAY = datetime(2026, 10, 17)
+RECORDED = []
+# Statements without a plan worth checking
+SKIPPED_PREFIXES = ("EXPLAIN", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE", "INSERT INTO SCHEMA_VERSION")
+
+
+def record(sql, params):
+    if not sql.lstrip().upper().startswith(SKIPPED_PREFIXES):
+        RECORDED.append((sql, tuple(params)))
+
+
+class RecordingCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        record(sql, params)
+        return super().execute(sql, params)
+
+
+class RecordingConnection(sqlite3.Connection):
+    """Records (sql, params) of every statement; pandas reads go through cursor()."""
+
+    def cursor(self, factory=RecordingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        record(sql, params)
+        return super().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            record(sql, seq_of_params[0])
+        return super().executemany(sql, seq_of_params)
+
+
+def seed():
+    conn = db.get_connection()
+    with conn:
+        user_id = conn.execute("INSERT INTO users (dni, password_hash) VALUES ('plans', 'x')").lastrowid
+    db.add_invoices_bulk(user_id, [
+        {"client_name": f"Cliente {i % 20} S.L.", "invoice_number": f"F-{i:04d}",
+         "date": f"{2024 + i % 3}-{i % 12 + 1:02d}-{i % 28 + 1:02d}" if i % 50 else None, "amount": 100.0 + i,
+         "status": ("Paid", "Pending", "Overdue")[i % 3],
+         "items": [{"description": ("Consulting", "Hosting")[i % 2], "quantity": 1, "unit_price": 100.0 + i}]}
+        for i in range(300)
+    ])
+    # A duplicate written the old way, for the merge job
+    with conn:
+        conn.execute("INSERT INTO clients (user_id, name) VALUES (?, 'CLIENTE 3 SL')", (user_id,))
+    return user_id
+
+
+def invoice_pages(user_id, **filters):
+    """First page, then the keyset (date, id) page after it."""
+    _, cursor = db.get_invoice_page(user_id, limit=20, **filters)
+    db.get_invoice_page(user_id, limit=20, cursor=cursor, **filters)
+
+
+HOT_PATHS = {
+    "get_invoices": lambda u: db.get_invoices(u),
+    "get_dashboard_metrics": lambda u: db.get_dashboard_metrics(u, TODAY),
+    "get_invoice_page": lambda u: invoice_pages(u),
+    "get_invoice_page (status)": lambda u: invoice_pages(u, status="Pending"),
+    "get_invoice_page (client, dates)": lambda u: invoice_pages(u, client_id=1, date_from="2024-01-01", date_to="2025-12-31"),
+    "iter_invoices (items)": lambda u: list(db.iter_invoices(u, columns=("id", "items"), batch_size=100)),
+    "count_invoices": lambda u: db.count_invoices(u, status="Paid"),
+    "get_revenue_by_service": lambda u: db.get_revenue_by_service(u, date_from="2024-01-01"),
+    "get_monthly_client_revenue": lambda u: db.get_monthly_client_revenue(u, "2023-10"),
+    "get_open_by_due_month": lambda u: db.get_open_by_due_month(u),
+    "get_aging_report": lambda u: db.get_aging_report(u, TODAY),
+    "sweep_overdue_invoices": lambda u: db.sweep_overdue_invoices(today=TODAY),
+    "sweep_overdue_invoices (user)": lambda u: db.sweep_overdue_invoices(u, today=TODAY),
+    "client resolution": lambda u: (db.reset_client_index(u), db.get_client_id_by_name(u, "Cliente Nuevo S.A.")),
+    "merge_duplicate_clients": lambda u: db.merge_duplicate_clients(u),
+    "delete_invoices": lambda u: db.delete_invoices(u, [1, 2]),
+}
+# Paths whose ORDER BY must come from the index: a sort would read all of the user's invoices
+INDEX_ORDERED = {name for name in HOT_PATHS if name.startswith("get_invoice_page") or name.startswith("iter_invoices")}
+# The search triggers re-point documents with this lookup; trigger statements are not
+# reported by EXPLAIN of the statement that fires them, so it is checked on its own
+TRIGGER_QUERIES = {
+    "clients_search_update": ("SELECT id FROM invoices WHERE client_id = ?", (1,)),
+}
+
+
+def problems(name, plan):
+    found = [line for line in plan
+             if line.startswith("SCAN") and "VIRTUAL TABLE" not in line and line != "SCAN CONSTANT ROW"]
+    if name in INDEX_ORDERED:
+        found += [line for line in plan if "TEMP B-TREE FOR ORDER BY" in line or "FOR RIGHT PART OF ORDER BY" in line]
+    return found
+
+
+def main():
+    failures = 0
+    db._open_connection = functools.partial(db._open_connection, factory=RecordingConnection)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "plans.db")
+        db.close_connection()
+        db.init_db()
+        user_id = seed()
+        checks = []
+        for name, call in HOT_PATHS.items():
+            RECORDED.clear()
+            call(user_id)
+            statements = list(dict.fromkeys(RECORDED))
+            if not statements:
+                print(f"[FAIL] {name}: ran no SQL")
+                failures += 1
+            checks += [(name, sql, params) for sql, params in statements]
+        checks += [(name, sql, params) for name, (sql, params) in TRIGGER_QUERIES.items()]
+
+        for name, sql, params in checks:
+            plan = db.explain_query_plan(sql, params)
+            found = problems(name, plan)
+            failures += bool(found)
+            status = "FAIL" if found else "ok"
+            print(f"[{status}] {name}: {' '.join(sql.split())[:90]}\n       {' | '.join(plan)}")
+        db.close_connection()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
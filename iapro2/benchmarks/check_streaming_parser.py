@@ -0,0 +1,196 @@
+"""
+Checks the streamed extraction path against parsing the whole reply at once.
+
+Random invoice replies (strings with quotes, escapes, braces and non-ASCII text,
+numbers and literals of every kind) are serialized compact, pretty-printed,
+\\u-escaped, inside a ```json fence and in the Python-literal / trailing-comma
+forms that only close()'s fallback accepts. Each reply is split into random
+chunks, 1-character chunks and every two-chunk split. Then:
+
+- IncrementalInvoiceParser: the streamed field and item events, and close(), must
+  equal json.loads of the whole reply (the source dict for the non-JSON forms);
+- stream_invoice_data with a fake streaming model: the events plus the final
+  InvoiceData must match InvoiceData.from_dict of the whole reply.
+
+Usage: python benchmarks/check_streaming_parser.py [--replies 200] [--splits 20]
+Exits non-zero on any mismatch.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import processor as proc
+from invoice_data import InvoiceData
+
+TRICKY_TEXT = ('Café "El Rincón"', "back\\slash \\\\ and \\n literal", "línea\nnueva\ttab", "{llaves} [corchetes], comas: sí",
+               "€ 1.234,56", "emoji 🧾", "quote at end\"", "", "'single' quotes", "} ] , :")
+
+
+def random_reply(rng):
+    """An invoice dict shaped like the model's reply."""
+    def text():
+        return rng.choice(TRICKY_TEXT) + (f" {rng.randint(0, 999)}" if rng.random() < 0.5 else "")
+
+    def number():
+        return rng.choice([rng.randint(-5, 5000), round(rng.uniform(-100, 10000), 2), 1e3, 0, 0.5, 12345678901])
+
+    items = [{"description": text(), "quantity": rng.choice([1, 2, 10, 0.5]), "unit_price": number(),
+              "total": number()} for _ in range(rng.randint(0, 6))]
+    reply = {
+        "client_name": text(),
+        "client_address": rng.choice([text(), None]),
+        "invoice_number": rng.choice([f"F-{rng.randint(1, 9999)}", None]),
+        "date": rng.choice(["2026-10-17", None, "17/10/2026"]),
+        "currency": rng.choice(["EUR", "USD", None]),
+        "items": items,
+        "total_amount": number(),
+        "paid": rng.choice([True, False, None]),
+    }
+    # Field order varies: items may come first, last or in between
+    keys = list(reply)
+    rng.shuffle(keys)
+    return {key: reply[key] for key in keys}
+
+
+def python_literal(reply):
+    """repr() of the dict: single quotes and None/True/False, as some models answer."""
+    return repr(reply)
+
+
+def trailing_commas(reply):
+    body = json.dumps(reply, ensure_ascii=False, indent=1)
+    return body[:-1].rstrip() + ",\n}"
+
+
+# (name, serializer, strict JSON)
+FORMATS = (
+    ("compact", lambda reply: json.dumps(reply, ensure_ascii=False, separators=(",", ":")), True),
+    ("pretty", lambda reply: json.dumps(reply, ensure_ascii=False, indent=2), True),
+    ("ascii escapes", lambda reply: json.dumps(reply), True),
+    ("fenced", lambda reply: "Here is the invoice:\n```json\n" + json.dumps(reply, ensure_ascii=False, indent=2) + "\n```\n", True),
+    ("python literal", python_literal, False),
+    ("trailing comma", trailing_commas, False),
+)
+
+
+def expected_result(text, strict, reply):
+    if not strict:
+        return reply
+    return json.loads(text.split("```json")[1].split("```")[0] if "```json" in text else text)
+
+
+def chunkings(text, rng, splits):
+    yield [text]
+    yield list(text)
+    for _ in range(splits):
+        cuts = sorted(rng.sample(range(1, len(text)), min(rng.randint(1, 12), len(text) - 1)))
+        yield [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def two_chunk_splits(text):
+    for cut in range(1, len(text)):
+        yield [text[:cut], text[cut:]]
+
+
+def rebuild(events):
+    """The dict the UI would show from streamed field and item events."""
+    fields, items = {}, {}
+    for kind, key, value in events:
+        if kind == "field":
+            fields[key] = value
+        elif kind == "item":
+            items[key] = value
+    if items:
+        fields["items"] = [items[index] for index in sorted(items)]
+    return fields
+
+
+def check_parser(chunks, expected, strict):
+    parser = proc.IncrementalInvoiceParser()
+    events = [event for chunk in chunks for event in parser.feed(chunk)]
+    result = parser.close()
+    problems = []
+    if result != expected:
+        problems.append("close() differs from parsing the whole reply")
+    streamed = rebuild(events)
+    if strict:
+        # Strict JSON streams every field and item as it completes, nothing is left for close()
+        wanted = {key: value for key, value in expected.items() if key != "items" or value}
+        if streamed != wanted:
+            problems.append(f"streamed events differ: {streamed} != {wanted}")
+    elif any(streamed.get(key, value) != value for key, value in expected.items()):
+        problems.append("a streamed event differs from the fallback parse")
+    return problems
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStreamingModel:
+    """generate_content(contents, stream=True) yields the reply in the given chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def generate_content(self, contents, stream=False):
+        return (FakeChunk(chunk) for chunk in self.chunks)
+
+
+def check_stream(chunks, expected):
+    events = list(proc.stream_invoice_data(b"fake image", "image/png", use_cache=False, model=FakeStreamingModel(chunks),
+                                           preprocess=False, local_first=False))
+    kind, _, invoice = events[-1]
+    if kind != "done":
+        return [f"stream ended with {kind}: {invoice}"]
+    wanted = InvoiceData.from_dict(expected).to_dict()
+    problems = []
+    if invoice.to_dict() != wanted:
+        problems.append("final InvoiceData differs from parsing the whole reply")
+    if InvoiceData.from_dict(rebuild(events[:-1])).to_dict() != wanted:
+        problems.append("streamed events (with the replay after close()) miss part of the reply")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replies", type=int, default=200)
+    parser.add_argument("--splits", type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(9)
+    # The fake answers instantly; only the parser is under test, not the rate limits
+    proc._scheduler = proc.GeminiScheduler(requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12)
+
+    failures, checked = [], {"parser": 0, "stream": 0}
+    for n in range(args.replies):
+        reply = random_reply(rng)
+        for name, serialize, strict in FORMATS:
+            text = serialize(reply)
+            expected = expected_result(text, strict, reply)
+            splits = list(chunkings(text, rng, args.splits))
+            if n < 5:
+                splits += two_chunk_splits(text)
+            for chunks in splits:
+                checked["parser"] += 1
+                for problem in check_parser(chunks, expected, strict):
+                    failures.append((name, chunks, problem))
+            for chunks in splits[:3]:
+                checked["stream"] += 1
+                for problem in check_stream(chunks, expected):
+                    failures.append((name, chunks, problem))
+
+    print(f"{args.replies} replies x {len(FORMATS)} formats: {checked['parser']} chunkings through the parser, "
+          f"{checked['stream']} through stream_invoice_data")
+    for name, chunks, problem in failures[:10]:
+        print(f"[FAIL] {name}: {problem}\n       chunks {chunks[:6]}{' ...' if len(chunks) > 6 else ''}")
+    print("ok" if not failures else f"FAILED: {len(failures)} mismatches")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+import database as db
+from invoice_generator import render_invoice_records
+
+EXPORT_MAX_WORKERS = os.cpu_count() or 1
+# Starting spawned workers costs seconds (each imports the app), so by default exports render
+# in this process unless they are large and the host has more than two CPUs to spread them over
+EXPORT_PARALLEL_MIN_INVOICES = 1000
+EXPORT_PARALLEL_MIN_CPUS = 3
+# Invoices per pool task (amortizes pickling and IPC) and tasks in flight per worker,
+# which keeps the pool busy while bounding the PDFs held in memory
+EXPORT_CHUNK_SIZE = 16
+EXPORT_PENDING_PER_WORKER = 2
+EXPORT_COLUMNS = ("id", "client_name", "invoice_number", "date", "amount", "status", "items")
+# Workers are started with 'spawn': forking a multi-threaded server process is unsafe
+EXPORT_MP_CONTEXT = "spawn"
+
+def quarter_bounds(year, quarter):
+    """Returns the inclusive ('YYYY-MM-DD', 'YYYY-MM-DD') date range of a calendar quarter."""
+    if quarter not in (1, 2, 3, 4):
+        raise ValueError(f"Quarter must be 1-4, got {quarter}")
+    first_month = 3 * (quarter - 1) + 1
+    last_day = {3: 31, 6: 30, 9: 30, 12: 31}[first_month + 2]
+    return f"{year}-{first_month:02d}-01", f"{year}-{first_month + 2:02d}-{last_day}"
+
+def export_file_name(record):
+    """Archive member name, unique per invoice: date_number_id.pdf with unsafe characters replaced."""
+    number = re.sub(r"[^A-Za-z0-9._-]+", "-", str(record.get("invoice_number") or "Draft")).strip("-")
+    return f"{record.get('date') or 'undated'}_{number or 'Draft'}_{record['id']}.pdf"
+
+def export_workers(total):
+    """Default rendering processes for an export of total invoices; 1 renders in this process."""
+    if total < EXPORT_PARALLEL_MIN_INVOICES or (os.cpu_count() or 1) < EXPORT_PARALLEL_MIN_CPUS:
+        return 1
+    return EXPORT_MAX_WORKERS
+
+def _write(archive, name, pdf):
+    # PDF streams are already deflated by fpdf2; storing avoids recompressing in the parent process
+    archive.writestr(zipfile.ZipInfo(name, date_time=time.localtime()[:6]), pdf, compress_type=zipfile.ZIP_STORED)
+
+def export_invoices_zip(user_id, output, workers=None, progress=None, **filters):
+    """
+    Renders a user's matching invoices to PDF and streams them into a ZIP archive.
+
+    Args:
+        user_id: Owner of the invoices.
+        output: Path or writable file object for the archive.
+        workers: Rendering processes; 0 or 1 renders in this process, None picks export_workers().
+        progress: Optional callable(done, total) called after each rendered chunk.
+        **filters: status, client_id, date_from, date_to (as in database.get_invoice_page).
+
+    Returns:
+        dict: invoices written, failed invoice ids, archive bytes of PDFs, elapsed seconds and workers used.
+    """
+    start = time.perf_counter()
+    total = db.count_invoices(user_id, **filters)
+    if workers is None:
+        workers = export_workers(total)
+    records = db.iter_invoices(user_id, columns=EXPORT_COLUMNS, **filters)
+    summary = {"invoices": 0, "failed": [], "pdf_bytes": 0, "seconds": 0.0, "workers": max(workers, 1)}
+
+    chunks = iter(lambda: list(islice(records, EXPORT_CHUNK_SIZE)), [])
+
+    def collect(chunk, results):
+        for record, (pdf, error) in zip(chunk, results):
+            if error is None:
+                _write(archive, export_file_name(record), pdf)
+                summary["invoices"] += 1
+                summary["pdf_bytes"] += len(pdf)
+            else:
+                print(f"PDF export failed for invoice {record['id']}: {error}")
+                summary["failed"].append(record["id"])
+        if progress:
+            progress(summary["invoices"] + len(summary["failed"]), total)
+
+    with zipfile.ZipFile(output, "w") as archive:
+        if workers <= 1:
+            for chunk in chunks:
+                collect(chunk, render_invoice_records(chunk))
+        else:
+            context = multiprocessing.get_context(EXPORT_MP_CONTEXT)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                pending = {}
+                max_pending = workers * EXPORT_PENDING_PER_WORKER
+                while True:
+                    while len(pending) < max_pending:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                        pending[executor.submit(render_invoice_records, chunk)] = chunk
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        chunk = pending.pop(future)
+                        try:
+                            results = future.result()
+                        except Exception as e: # worker crashed: fail the whole chunk
+                            results = [(None, str(e))] * len(chunk)
+                        collect(chunk, results)
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a user's invoices as PDFs in a ZIP archive.")
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--output", required=True, help="Path of the ZIP archive to write")
+    parser.add_argument("--year", type=int, help="With --quarter: export that calendar quarter")
+    parser.add_argument("--quarter", type=int, choices=(1, 2, 3, 4))
+    parser.add_argument("--from", dest="date_from", help="Inclusive start date YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="Inclusive end date YYYY-MM-DD")
+    parser.add_argument("--status", help="Only invoices with this status")
+    parser.add_argument("--workers", type=int, help="Rendering processes (default: by export size and CPUs)")
+    args = parser.parse_args(argv)
+
+    date_from, date_to = args.date_from, args.date_to
+    if args.quarter:
+        if not args.year:
+            parser.error("--quarter requires --year")
+        date_from, date_to = quarter_bounds(args.year, args.quarter)
+
+    def report(done, total):
+        print(f"\r{done}/{total} invoices", end="", flush=True)
+
+    summary = export_invoices_zip(
+        args.user_id, args.output, workers=args.workers, progress=report,
+        status=args.status, date_from=date_from, date_to=date_to
+    )
+    print(f"\nWrote {summary['invoices']} PDFs to {args.output} in {summary['seconds']:.1f}s"
+          f" ({len(summary['failed'])} failed)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from reconciliation import normalize_client_name
+
+# A one-character typo (insertion, deletion, substitution or adjacent swap) changes at
+# most this many of a key's trigrams
+TYPO_MAX_CHANGED_TRIGRAMS = 4
+# Fuzzy matches differ from a known key by one typo in a single word at least this long;
+# shorter words ('Pepe' / 'Pepa') are too often different names
+CLIENT_FUZZY_MIN_TOKEN = 5
+
+def client_key(name):
+    """
+    Normalized client name stored in clients.name_key: case, accents, punctuation,
+    whitespace and trailing legal suffixes folded, so 'Pepsi', 'PEPSI S.A.' and
+    'pepsi sa ' share the key 'pepsi'. Names made only of a suffix keep their folded text.
+    """
+    return normalize_client_name(name) or " ".join(str(name or "").lower().split())
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _signature(key):
+    """Token count and numeric tokens: a typo variant of a key always has the same ones."""
+    tokens = key.split()
+    return len(tokens), tuple(token for token in tokens if any(c.isdigit() for c in token))
+
+def _one_edit(x, y):
+    """True if x and y differ by one inserted, deleted or replaced character, or one adjacent swap."""
+    if len(x) > len(y):
+        x, y = y, x
+    if len(y) - len(x) > 1 or x == y:
+        return False
+    i = 0
+    while i < len(x) and x[i] == y[i]:
+        i += 1
+    if len(x) < len(y):
+        return x[i:] == y[i + 1:]
+    return x[i + 1:] == y[i + 1:] or (x[i:i + 2] == y[i + 1::-1][:2] and x[i + 2:] == y[i + 2:])
+
+def is_typo_variant(a, b):
+    """True if two keys differ only by a one-character typo in one long, digit-free word."""
+    tokens_a, tokens_b = a.split(), b.split()
+    if len(tokens_a) != len(tokens_b):
+        return False
+    differing = [(x, y) for x, y in zip(tokens_a, tokens_b) if x != y]
+    if len(differing) != 1:
+        return False
+    x, y = differing[0]
+    return min(len(x), len(y)) >= CLIENT_FUZZY_MIN_TOKEN and not any(c.isdigit() for c in x + y) and _one_edit(x, y)
+
+class ClientIndex:
+    """
+    One user's clients by normalized key, with a trigram index for fuzzy lookups.
+    Not thread-safe; callers serialize access.
+    """
+    __slots__ = ("ids", "_grams", "_postings")
+
+    def __init__(self):
+        self.ids = {}                      # key -> client id
+        self._grams = {}                   # key -> trigram set
+        self._postings = defaultdict(set)  # (signature, trigram) -> keys
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, key, client_id):
+        """Maps key to client_id unless the key is already known (the first, oldest client wins)."""
+        if key in self.ids:
+            return
+        self.ids[key] = client_id
+        grams = trigrams(key)
+        self._grams[key] = grams
+        signature = _signature(key)
+        for gram in grams:
+            self._postings[signature, gram].add(key)
+
+    def match(self, key):
+        """Client id for key: exact match first, then a known key that differs by one typo."""
+        client_id = self.ids.get(key)
+        if client_id is not None or not self.ids:
+            return client_id
+        grams = trigrams(key)
+        # Postings are blocked by signature. Prefix filter: a typo variant shares all but
+        # TYPO_MAX_CHANGED_TRIGRAMS of the key's trigrams, so it has one of the
+        # TYPO_MAX_CHANGED_TRIGRAMS + 1 rarest
+        signature = _signature(key)
+        postings = [self._postings.get((signature, gram), ()) for gram in grams]
+        postings.sort(key=len)
+        candidates = set()
+        for keys in postings[:TYPO_MAX_CHANGED_TRIGRAMS + 1]:
+            candidates.update(keys)
+
+        best, best_shared = None, len(grams) - TYPO_MAX_CHANGED_TRIGRAMS - 1
+        for candidate in candidates:
+            if abs(len(candidate) - len(key)) > 1:
+                continue
+            shared = len(grams & self._grams[candidate])
+            if shared > best_shared and is_typo_variant(key, candidate):
+                best, best_shared = candidate, shared
+        return self.ids[best] if best is not None else None
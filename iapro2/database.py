@@ -1,28 +1,266 @@
+import ast
 import sqlite3
+import threading
+import time
+import functools
+import json
+import re
 import pandas as pd
-import os
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from invoice_data import LineItem
+from client_resolution import ClientIndex, client_key
 
 DB_FILE = 'aura_finance.db'
 
-def init_db():
-    """Initializes the SQLite database with necessary tables."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Users Table
-    c.execute('''
+# Invoices fall due this long after their date (the PDF footer's "Payment due within 30 days");
+# open invoices past it are swept to Overdue this often by a background thread
+PAYMENT_TERMS_DAYS = 30
+OVERDUE_SWEEP_INTERVAL_SECONDS = 3600
+# Receivables aging buckets: (label, days since the invoice date up to which it applies)
+AGING_BUCKETS = (("0-30", 30), ("31-60", 60), ("61-90", 90), ("90+", None))
+
+# Connection tuning. Streamlit runs every session's script in its own thread,
+# so each thread keeps one long-lived connection instead of reconnecting per call.
+BUSY_TIMEOUT_SECONDS = 30
+STATEMENT_CACHE_SIZE = 256
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # readers no longer block behind writers
+    "PRAGMA synchronous=NORMAL",    # safe with WAL, avoids an fsync per commit
+    "PRAGMA cache_size=-16000",     # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",   # 256 MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",       # invoice_items rows are deleted with their invoice
+)
+
+_local = threading.local()
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+# Keep invoice_monthly_totals in sync with every write to invoices. Months are
+# the 'YYYY-MM' prefix of the invoice date.
+ROLLUP_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_rollup_insert AFTER INSERT ON invoices
+    BEGIN
+        INSERT INTO invoice_monthly_totals (user_id, month, status, invoice_count, amount)
+        VALUES (NEW.user_id, COALESCE(substr(NEW.date, 1, 7), ''), NEW.status, 1, COALESCE(NEW.amount, 0))
+        ON CONFLICT (user_id, month, status) DO UPDATE SET
+            invoice_count = invoice_count + 1,
+            amount = amount + excluded.amount;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_rollup_delete AFTER DELETE ON invoices
+    BEGIN
+        UPDATE invoice_monthly_totals
+        SET invoice_count = invoice_count - 1, amount = amount - COALESCE(OLD.amount, 0)
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND status = OLD.status;
+        DELETE FROM invoice_monthly_totals
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND status = OLD.status
+          AND invoice_count <= 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_rollup_update AFTER UPDATE OF user_id, date, amount, status ON invoices
+    BEGIN
+        UPDATE invoice_monthly_totals
+        SET invoice_count = invoice_count - 1, amount = amount - COALESCE(OLD.amount, 0)
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND status = OLD.status;
+        DELETE FROM invoice_monthly_totals
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND status = OLD.status
+          AND invoice_count <= 0;
+        INSERT INTO invoice_monthly_totals (user_id, month, status, invoice_count, amount)
+        VALUES (NEW.user_id, COALESCE(substr(NEW.date, 1, 7), ''), NEW.status, 1, COALESCE(NEW.amount, 0))
+        ON CONFLICT (user_id, month, status) DO UPDATE SET
+            invoice_count = invoice_count + 1,
+            amount = amount + excluded.amount;
+    END
+    ''',
+)
+
+REBUILD_MONTHLY_TOTALS_SQL = """
+    INSERT INTO invoice_monthly_totals (user_id, month, status, invoice_count, amount)
+    SELECT user_id, COALESCE(substr(date, 1, 7), ''), status, COUNT(*), COALESCE(SUM(amount), 0)
+    FROM invoices
+    {where}
+    GROUP BY user_id, COALESCE(substr(date, 1, 7), ''), status
+"""
+
+# Same rollup per client, read by the revenue forecast. Invoices without a client use client_id 0.
+CLIENT_ROLLUP_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_client_rollup_insert AFTER INSERT ON invoices
+    BEGIN
+        INSERT INTO invoice_client_monthly_totals (user_id, month, client_id, invoice_count, amount)
+        VALUES (NEW.user_id, COALESCE(substr(NEW.date, 1, 7), ''), COALESCE(NEW.client_id, 0), 1, COALESCE(NEW.amount, 0))
+        ON CONFLICT (user_id, month, client_id) DO UPDATE SET
+            invoice_count = invoice_count + 1,
+            amount = amount + excluded.amount;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_client_rollup_delete AFTER DELETE ON invoices
+    BEGIN
+        UPDATE invoice_client_monthly_totals
+        SET invoice_count = invoice_count - 1, amount = amount - COALESCE(OLD.amount, 0)
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND client_id = COALESCE(OLD.client_id, 0);
+        DELETE FROM invoice_client_monthly_totals
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND client_id = COALESCE(OLD.client_id, 0)
+          AND invoice_count <= 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_client_rollup_update AFTER UPDATE OF user_id, client_id, date, amount ON invoices
+    BEGIN
+        UPDATE invoice_client_monthly_totals
+        SET invoice_count = invoice_count - 1, amount = amount - COALESCE(OLD.amount, 0)
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND client_id = COALESCE(OLD.client_id, 0);
+        DELETE FROM invoice_client_monthly_totals
+        WHERE user_id = OLD.user_id AND month = COALESCE(substr(OLD.date, 1, 7), '') AND client_id = COALESCE(OLD.client_id, 0)
+          AND invoice_count <= 0;
+        INSERT INTO invoice_client_monthly_totals (user_id, month, client_id, invoice_count, amount)
+        VALUES (NEW.user_id, COALESCE(substr(NEW.date, 1, 7), ''), COALESCE(NEW.client_id, 0), 1, COALESCE(NEW.amount, 0))
+        ON CONFLICT (user_id, month, client_id) DO UPDATE SET
+            invoice_count = invoice_count + 1,
+            amount = amount + excluded.amount;
+    END
+    ''',
+)
+
+REBUILD_CLIENT_MONTHLY_TOTALS_SQL = """
+    INSERT INTO invoice_client_monthly_totals (user_id, month, client_id, invoice_count, amount)
+    SELECT user_id, COALESCE(substr(date, 1, 7), ''), COALESCE(client_id, 0), COUNT(*), COALESCE(SUM(amount), 0)
+    FROM invoices
+    {where}
+    GROUP BY user_id, COALESCE(substr(date, 1, 7), ''), COALESCE(client_id, 0)
+"""
+
+INSERT_ITEMS_SQL = """
+    INSERT INTO invoice_items (invoice_id, position, description, quantity, unit_price, total)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+def _item_rows(invoice_id, items):
+    """invoice_items rows for a list of item dicts or LineItems, with numeric fields coerced."""
+    for position, item in enumerate(items or []):
+        if isinstance(item, dict):
+            item = LineItem.from_dict(item)
+        elif not isinstance(item, LineItem):
+            continue
+        yield (invoice_id, position, item.description, item.quantity, item.unit_price, item.total)
+
+INDEX_ITEMS_SQL = """
+    UPDATE invoice_search
+    SET items = (SELECT group_concat(description, ' ') FROM invoice_items WHERE invoice_id = ?)
+    WHERE rowid = ?
+"""
+
+def _insert_items(conn, items_by_invoice):
+    """Writes line items for {invoice_id: items} and indexes them for search, without committing."""
+    conn.executemany(INSERT_ITEMS_SQL, (
+        row for invoice_id, items in items_by_invoice.items() for row in _item_rows(invoice_id, items)
+    ))
+    conn.executemany(INDEX_ITEMS_SQL, ((invoice_id, invoice_id) for invoice_id, items in items_by_invoice.items() if items))
+
+def _parse_items_blob(blob):
+    """Parses a legacy items column value: the repr of a list of dicts, or JSON."""
+    try:
+        items = json.loads(blob)
+    except ValueError:
+        try:
+            items = ast.literal_eval(blob)
+        except (ValueError, SyntaxError):
+            return []
+    return items if isinstance(items, list) else []
+
+def _copy_item_blobs(conn):
+    """Migration step: moves the legacy items column into invoice_items and clears it."""
+    blobs = conn.execute("SELECT id, items FROM invoices WHERE items IS NOT NULL").fetchall()
+    conn.executemany(INSERT_ITEMS_SQL, (
+        row for invoice_id, blob in blobs for row in _item_rows(invoice_id, _parse_items_blob(blob))
+    ))
+    conn.execute("UPDATE invoices SET items = NULL WHERE items IS NOT NULL")
+
+def _add_client_name_keys(conn):
+    """Migration step: adds clients.name_key and fills it for existing rows."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(clients)")}
+    if "name_key" not in columns:
+        conn.execute("ALTER TABLE clients ADD COLUMN name_key TEXT")
+    clients = conn.execute("SELECT id, name FROM clients").fetchall()
+    conn.executemany("UPDATE clients SET name_key = ? WHERE id = ?", [(client_key(name), client_id) for client_id, name in clients])
+
+# Full-text search: one invoice_search document per invoice (rowid = invoices.id).
+# The owner column holds a 'u<user_id>' token so every query is scoped to one user
+# through the index itself. Triggers keep documents in sync with invoices and clients;
+# new line items are indexed by _insert_items once per invoice, since a per-row
+# trigger would rewrite the whole document for every line.
+SEARCH_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_search_insert AFTER INSERT ON invoices
+    BEGIN
+        INSERT INTO invoice_search (rowid, owner, client_name, client_email, invoice_number, items)
+        SELECT NEW.id, 'u' || NEW.user_id, c.name, c.email, NEW.invoice_number, ''
+        FROM (SELECT 1) LEFT JOIN clients c ON c.id = NEW.client_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_search_delete AFTER DELETE ON invoices
+    BEGIN
+        DELETE FROM invoice_search WHERE rowid = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoices_search_update AFTER UPDATE OF user_id, client_id, invoice_number ON invoices
+    BEGIN
+        UPDATE invoice_search
+        SET owner = 'u' || NEW.user_id,
+            client_name = (SELECT name FROM clients WHERE id = NEW.client_id),
+            client_email = (SELECT email FROM clients WHERE id = NEW.client_id),
+            invoice_number = NEW.invoice_number
+        WHERE rowid = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS clients_search_update AFTER UPDATE OF name, email ON clients
+    BEGIN
+        UPDATE invoice_search SET client_name = NEW.name, client_email = NEW.email
+        WHERE rowid IN (SELECT id FROM invoices WHERE client_id = NEW.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS invoice_items_search_delete AFTER DELETE ON invoice_items
+    BEGIN
+        UPDATE invoice_search
+        SET items = COALESCE((SELECT group_concat(description, ' ') FROM invoice_items WHERE invoice_id = OLD.invoice_id), '')
+        WHERE rowid = OLD.invoice_id;
+    END
+    ''',
+)
+
+REBUILD_SEARCH_INDEX_SQL = """
+    INSERT INTO invoice_search (rowid, owner, client_name, client_email, invoice_number, items)
+    SELECT i.id, 'u' || i.user_id, c.name, c.email, i.invoice_number,
+           COALESCE((SELECT group_concat(description, ' ') FROM invoice_items WHERE invoice_id = i.id), '')
+    FROM invoices i
+    LEFT JOIN clients c ON c.id = i.client_id
+"""
+
+# Ordered schema migrations: (version, name, statements). A statement is SQL or a
+# callable taking the connection, for data conversions. Every statement must be
+# idempotent so databases created before versioning existed can adopt it.
+MIGRATIONS = [
+    (1, "base schema", (
+        '''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             dni TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Clients Table
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS clients (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
@@ -33,10 +271,8 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
-    ''')
-    
-    # Invoices Table
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS invoices (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             client_id INTEGER,
@@ -50,170 +286,1058 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id),
             UNIQUE(user_id, invoice_number)
         )
+        ''',
+    )),
+    (2, "monthly totals rollup", (
+        '''
+        CREATE TABLE IF NOT EXISTS invoice_monthly_totals (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            status TEXT NOT NULL,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, status)
+        ) WITHOUT ROWID
+        ''',
+        *ROLLUP_TRIGGERS,
+        "DELETE FROM invoice_monthly_totals",
+        REBUILD_MONTHLY_TOTALS_SQL.format(where=""),
+    )),
+    (3, "indexes for hot queries", (
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_date ON invoices (user_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_client ON invoices (client_id)",
+        "CREATE INDEX IF NOT EXISTS idx_clients_user_name ON clients (user_id, name)",
+    )),
+    (4, "extraction cache", (
+        '''
+        CREATE TABLE IF NOT EXISTS extraction_cache (
+            cache_key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache (last_used_at)",
+    )),
+    # Line items as typed rows instead of a repr blob in invoices.items (now always NULL).
+    # Clustered by (invoice_id, position), so one invoice's lines are a single range read.
+    (5, "invoice line items", (
+        '''
+        CREATE TABLE IF NOT EXISTS invoice_items (
+            invoice_id INTEGER NOT NULL REFERENCES invoices (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            unit_price REAL NOT NULL,
+            total REAL NOT NULL,
+            PRIMARY KEY (invoice_id, position)
+        ) WITHOUT ROWID
+        ''',
+        _copy_item_blobs,
+    )),
+    (6, "invoice full-text search", (
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5(
+            owner, client_name, client_email, invoice_number, items,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        ''',
+        *SEARCH_TRIGGERS,
+        "DELETE FROM invoice_search",
+        REBUILD_SEARCH_INDEX_SQL,
+    )),
+    # Clients resolve on a normalized name key ('PEPSI S.A.' -> 'pepsi'); not unique, since
+    # existing duplicates stay until merge_duplicate_clients runs
+    (7, "client name keys", (
+        _add_client_name_keys,
+        "CREATE INDEX IF NOT EXISTS idx_clients_user_key ON clients (user_id, name_key)",
+        "DROP INDEX IF EXISTS idx_clients_user_name",
+    )),
+    (8, "client monthly totals rollup", (
+        '''
+        CREATE TABLE IF NOT EXISTS invoice_client_monthly_totals (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            client_id INTEGER NOT NULL,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, client_id)
+        ) WITHOUT ROWID
+        ''',
+        *CLIENT_ROLLUP_TRIGGERS,
+        "DELETE FROM invoice_client_monthly_totals",
+        REBUILD_CLIENT_MONTHLY_TOTALS_SQL.format(where=""),
+    )),
+    # Open (Pending/Overdue) invoices by age: the overdue sweep, aging report and cash-in forecast
+    (9, "invoice status index", (
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_status_date ON invoices (user_id, status, date)",
+    )),
+]
+
+def get_schema_version():
+    """Returns the highest applied migration version (0 for an empty database)."""
+    conn = get_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
     ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate():
+    """Applies pending migrations in order, each in its own transaction. Returns the versions applied."""
+    conn = get_connection()
+    applied = []
+    if get_schema_version() >= MIGRATIONS[-1][0]:
+        return applied
+
+    for version, name, statements in MIGRATIONS:
+        # IMMEDIATE takes the write lock up front so concurrent startups apply each migration once
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            already_applied = conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone()
+            if not already_applied:
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
+
+def init_db():
+    """Initializes the SQLite database by applying any pending schema migrations."""
+    migrate()
+
+def explain_query_plan(query, params=()):
+    """Returns the EXPLAIN QUERY PLAN detail lines for a query."""
+    conn = get_connection()
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
 
-    conn.commit()
-    conn.close()
+def _open_connection(path, factory=sqlite3.Connection):
+    """Opens a tuned connection; sqlite3 reuses prepared statements per connection."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, cached_statements=STATEMENT_CACHE_SIZE, factory=factory)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
 
 def get_connection():
-    """Returns a connection to the SQLite database."""
-    return sqlite3.connect(DB_FILE)
+    """Returns this thread's cached connection to the SQLite database."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_FILE:
+        if conn is not None:
+            conn.close()
+        conn = _open_connection(DB_FILE)
+        _local.conn = conn
+        _local.path = DB_FILE
+    return conn
+
+def close_connection():
+    """Closes this thread's cached connection, if any."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+        _local.path = None
+
+# --- Query Cache ---
+# Streamlit reruns the whole script on every interaction, so read functions are
+# memoized per (function, user, data version, arguments, database file). Writes bump the user's
+# data version, which makes every cached read for that user miss. The TTL bounds
+# staleness from writes made by other processes.
+QUERY_CACHE_MAX_ENTRIES = 512
+QUERY_CACHE_TTL_SECONDS = 300
+
+_query_cache = OrderedDict()
+_data_versions = {}
+_global_generation = 0
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def get_data_version(user_id):
+    """Returns an opaque token that changes whenever the user's data is written in this process."""
+    return (_global_generation, _data_versions.get(user_id, 0))
+
+def bump_data_version(user_id=None):
+    """Invalidates cached reads for one user, or for everyone when user_id is None."""
+    global _global_generation
+    with _cache_lock:
+        if user_id is None:
+            _global_generation += 1
+            _query_cache.clear()
+            return
+        _data_versions[user_id] = _data_versions.get(user_id, 0) + 1
+        for key in [key for key in _query_cache if key[1] == user_id]:
+            del _query_cache[key]
+
+def _freeze(value):
+    """Makes list/dict arguments hashable for use in cache keys."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+def cached_query(func):
+    """Memoizes a read function whose first argument is user_id. Cached results are shared: treat them as read-only."""
+    @functools.wraps(func)
+    def wrapper(user_id, *args, **kwargs):
+        key = (func.__name__, user_id, get_data_version(user_id), _freeze(args), _freeze(kwargs), DB_FILE)
+        now = time.monotonic()
+        with _cache_lock:
+            entry = _query_cache.get(key)
+            if entry is not None and entry[0] > now:
+                _query_cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return entry[1]
+            _cache_stats["misses"] += 1
+
+        result = func(user_id, *args, **kwargs)
+
+        with _cache_lock:
+            # Skip storing if a write landed while the query ran
+            if key[2] == get_data_version(user_id):
+                _query_cache[key] = (now + QUERY_CACHE_TTL_SECONDS, result)
+                _query_cache.move_to_end(key)
+                while len(_query_cache) > QUERY_CACHE_MAX_ENTRIES:
+                    _query_cache.popitem(last=False)
+                    _cache_stats["evictions"] += 1
+        return result
+    return wrapper
+
+def get_query_cache_stats():
+    """Returns hit/miss/eviction counters and the current cache size."""
+    with _cache_lock:
+        return {**_cache_stats, "size": len(_query_cache)}
 
 def create_user(dni, password):
     """Creates a new user with a hashed password."""
     conn = get_connection()
-    c = conn.cursor()
     try:
         password_hash = generate_password_hash(password, method='pbkdf2:sha256')
-        c.execute("INSERT INTO users (dni, password_hash) VALUES (?, ?)", (dni, password_hash))
-        conn.commit()
+        with conn:
+            conn.execute("INSERT INTO users (dni, password_hash) VALUES (?, ?)", (dni, password_hash))
         return True
     except sqlite3.IntegrityError:
         return False # DNI already exists
     except Exception as e:
         print(f"Error creating user: {e}")
         return False
-    finally:
-        conn.close()
 
 def verify_user(dni, password):
     """Verifies a user's password and returns their user_id if valid."""
     conn = get_connection()
-    c = conn.cursor()
     try:
-        c.execute("SELECT id, password_hash FROM users WHERE dni = ?", (dni,))
-        result = c.fetchone()
+        result = conn.execute("SELECT id, password_hash FROM users WHERE dni = ?", (dni,)).fetchone()
         if result and check_password_hash(result[1], password):
             return result[0]
         return None
     except Exception as e:
         print(f"Error verifying user: {e}")
         return None
-    finally:
-        conn.close()
 
 def add_client(user_id, name, email, phone):
     """Adds a new client to the database."""
     conn = get_connection()
-    c = conn.cursor()
+    key = client_key(name)
     try:
-        c.execute("INSERT INTO clients (user_id, name, email, phone) VALUES (?, ?, ?, ?)", (user_id, name, email, phone))
-        conn.commit()
+        with conn:
+            client_id = conn.execute(
+                "INSERT INTO clients (user_id, name, name_key, email, phone) VALUES (?, ?, ?, ?, ?)",
+                (user_id, name, key, email, phone)
+            ).lastrowid
+        created = ClientIndex()
+        created.add(key, client_id)
+        _publish_clients(user_id, created)
+        bump_data_version(user_id)
         return True
     except Exception as e:
         print(f"Error adding client: {e}")
         return False
-    finally:
-        conn.close()
 
+@cached_query
 def get_clients(user_id):
     """Returns all clients as a Pandas DataFrame for a specific user."""
     conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM clients WHERE user_id = ?", conn, params=(user_id,))
-    conn.close()
-    return df
+    return pd.read_sql_query(
+        "SELECT id, user_id, name, email, phone, status, created_at FROM clients WHERE user_id = ?", conn, params=(user_id,)
+    )
+
+@cached_query
+def count_clients(user_id):
+    """Returns the number of clients registered for a user."""
+    conn = get_connection()
+    return conn.execute("SELECT COUNT(*) FROM clients WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+# --- Client Resolution ---
+# Extracted client names vary ('Pepsi', 'PEPSI S.A.', 'pepsi sa '), so clients are
+# resolved on client_key() through a per-user in-memory ClientIndex (exact key, then
+# trigram fuzzy match), falling back to the indexed clients.name_key column. The TTL
+# picks up clients created by other processes; a matched id that another process
+# deleted (merge-clients) reloads the index.
+CLIENT_INDEX_TTL_SECONDS = 300
+
+_client_indexes = {}  # (DB_FILE, user_id) -> (expires_at, ClientIndex)
+_client_lock = threading.Lock()
+
+def _client_index(conn, user_id, created):
+    """Returns the user's ClientIndex, loading it if missing or expired. Call with _client_lock held."""
+    now = time.monotonic()
+    entry = _client_indexes.get((DB_FILE, user_id))
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    index = ClientIndex()
+    # Skip rows this transaction inserted: they may still roll back
+    pending = set(created.ids.values())
+    rows = conn.execute("SELECT id, name_key, name FROM clients WHERE user_id = ? ORDER BY id", (user_id,))
+    for client_id, key, name in rows:
+        if client_id not in pending:
+            # Rows written without the key (raw inserts, older tools) are keyed from their name
+            index.add(key if key is not None else client_key(name), client_id)
+    _client_indexes[(DB_FILE, user_id)] = (now + CLIENT_INDEX_TTL_SECONDS, index)
+    return index
+
+def _publish_clients(user_id, created):
+    """Adds clients created by a committed transaction to the user's cached index."""
+    with _client_lock:
+        entry = _client_indexes.get((DB_FILE, user_id))
+        if entry is not None:
+            for key, client_id in created.ids.items():
+                entry[1].add(key, client_id)
+
+def reset_client_index(user_id=None):
+    """Drops the cached client index for one user, or for everyone when user_id is None."""
+    with _client_lock:
+        if user_id is None:
+            _client_indexes.clear()
+        else:
+            _client_indexes.pop((DB_FILE, user_id), None)
+
+def _resolve_client_id(conn, user_id, name, created):
+    """
+    Finds or inserts a client on an open connection without committing. New clients are
+    recorded in created, a ClientIndex of this transaction's inserts; pass it to
+    _publish_clients after commit.
+    """
+    key = client_key(name)
+    client_id = created.match(key)
+    if client_id is not None:
+        return client_id
+    with _client_lock:
+        index = _client_index(conn, user_id, created)
+        client_id = index.match(key)
+        if client_id is not None and not conn.execute("SELECT 1 FROM clients WHERE id = ?", (client_id,)).fetchone():
+            _client_indexes.pop((DB_FILE, user_id), None)
+            index = _client_index(conn, user_id, created)
+            client_id = index.match(key)
+        if client_id is not None:
+            index.add(key, client_id)  # remember fuzzy variants as exact keys
+            return client_id
+    row = conn.execute(
+        "SELECT id FROM clients WHERE user_id = ? AND name_key = ? ORDER BY id LIMIT 1", (user_id, key)
+    ).fetchone()
+    if row:
+        with _client_lock:
+            index.add(key, row[0])
+        return row[0]
+    client_id = conn.execute(
+        "INSERT INTO clients (user_id, name, name_key, status) VALUES (?, ?, ?, 'Active')", (user_id, name, key)
+    ).lastrowid
+    created.add(key, client_id)
+    return client_id
 
 def get_client_id_by_name(user_id, name):
     """Gets a client ID by name for a user, or creates a new client if not found."""
     conn = get_connection()
-    c = conn.cursor()
+    created = ClientIndex()
     try:
-        # Check if exists
-        c.execute("SELECT id FROM clients WHERE user_id = ? AND name = ?", (user_id, name))
-        result = c.fetchone()
-        
-        if result:
-            return result[0]
-        else:
-            # Create new
-            c.execute("INSERT INTO clients (user_id, name, status) VALUES (?, ?, 'Active')", (user_id, name))
-            conn.commit()
-            return c.lastrowid
+        with conn:
+            client_id = _resolve_client_id(conn, user_id, name, created)
+        if created:
+            _publish_clients(user_id, created)
+            bump_data_version(user_id)
+        return client_id
     except Exception as e:
         print(f"Error managing client: {e}")
         return None
-    finally:
-        conn.close()
+
+def merge_duplicate_clients(user_id=None, dry_run=False):
+    """
+    Merges clients that resolve to the same client (equal name key or fuzzy match) into the
+    oldest one: invoices are re-pointed, missing email and phone copied over, duplicates deleted.
+    Clients stored without name_key are matched on client_key(name) and get that key filled in.
+
+    Returns:
+        list: (user_id, kept client id, merged client ids) per merged group.
+    """
+    conn = get_connection()
+    merges = []
+    missing_keys = []
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if user_id is None:
+            users = [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM clients")]
+        else:
+            users = [user_id]
+        for uid in users:
+            index = ClientIndex()
+            groups = {}
+            rows = conn.execute("SELECT id, name_key, name FROM clients WHERE user_id IS ? ORDER BY id", (uid,)).fetchall()
+            for client_id, key, name in rows:
+                if key is None:
+                    # Rows written without the key (raw inserts, older tools) are keyed from their name
+                    key = client_key(name)
+                    missing_keys.append((key, client_id))
+                kept = index.match(key)
+                if kept is None:
+                    index.add(key, client_id)
+                else:
+                    index.add(key, kept)
+                    groups.setdefault(kept, []).append(client_id)
+            merges.extend((uid, kept, duplicates) for kept, duplicates in groups.items())
+
+        if not dry_run:
+            conn.executemany("UPDATE clients SET name_key = ? WHERE id = ?", missing_keys)
+            for _, kept, duplicates in merges:
+                placeholders = ", ".join("?" * len(duplicates))
+                conn.execute(f"UPDATE invoices SET client_id = ? WHERE client_id IN ({placeholders})", (kept, *duplicates))
+                conn.execute(f"""
+                    UPDATE clients SET
+                        email = COALESCE(email, (SELECT email FROM clients WHERE id IN ({placeholders}) AND email IS NOT NULL ORDER BY id LIMIT 1)),
+                        phone = COALESCE(phone, (SELECT phone FROM clients WHERE id IN ({placeholders}) AND phone IS NOT NULL ORDER BY id LIMIT 1))
+                    WHERE id = ?
+                """, (*duplicates, *duplicates, kept))
+                conn.execute(f"DELETE FROM clients WHERE id IN ({placeholders})", duplicates)
+    if (merges or missing_keys) and not dry_run:
+        reset_client_index()
+        bump_data_version()
+    return merges
 
 def add_invoice(user_id, client_name, invoice_number, date, amount, items, status='Pending'):
-    """Adds a new invoice, ensuring the client exists."""
-    client_id = get_client_id_by_name(user_id, client_name)
-    
-    if not client_id:
-        return False
-        
+    """Adds a new invoice and its line items, ensuring the client exists."""
     conn = get_connection()
-    c = conn.cursor()
+    created = ClientIndex()
     try:
-        c.execute("""
-            INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, items, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (client_id, user_id, invoice_number, date, amount, str(items), status))
-        conn.commit()
+        # Client lookup, invoice and items share one transaction on the same connection
+        with conn:
+            client_id = _resolve_client_id(conn, user_id, client_name, created)
+            if not client_id:
+                return False
+            cursor = conn.execute("""
+                INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (client_id, user_id, invoice_number, date, amount, status))
+            _insert_items(conn, {cursor.lastrowid: items})
+        _publish_clients(user_id, created)
+        bump_data_version(user_id)
         return True
     except Exception as e:
         print(f"Error adding invoice: {e}")
         return False
-    finally:
-        conn.close()
 
+# Invoice numbers per IN (...) lookup, well under SQLite's bound parameter limit
+INVOICE_LOOKUP_CHUNK = 500
+
+def _invoice_ids(conn, user_id, invoice_numbers):
+    """Maps each of the user's existing invoice numbers in invoice_numbers to its id."""
+    ids = {}
+    invoice_numbers = list(invoice_numbers)
+    for start in range(0, len(invoice_numbers), INVOICE_LOOKUP_CHUNK):
+        chunk = invoice_numbers[start:start + INVOICE_LOOKUP_CHUNK]
+        ids.update(conn.execute(
+            f"SELECT invoice_number, id FROM invoices WHERE user_id = ? AND invoice_number IN ({', '.join('?' * len(chunk))})",
+            [user_id, *chunk]
+        ).fetchall())
+    return ids
+
+def add_invoices_bulk(user_id, invoices):
+    """
+    Saves many invoices and their line items in a single transaction.
+
+    Args:
+        user_id: Owner of the invoices.
+        invoices: Iterable of dicts with client_name, invoice_number, date, amount, items and optional status.
+
+    Returns:
+        tuple: (saved, skipped). Invoices whose number already exists for the user, or repeats
+        an earlier one in the batch, are skipped. Invoices without a number are always saved.
+    """
+    conn = get_connection()
+    invoices = list(invoices)
+    created = ClientIndex()
+    try:
+        with conn:
+            # Take the write lock up front so the duplicate check holds until commit
+            conn.execute("BEGIN IMMEDIATE")
+            # Drafts (no number) cannot be duplicates of anything, so they are never deduplicated
+            drafts = [inv for inv in invoices if not inv['invoice_number']]
+            existing = _invoice_ids(conn, user_id, {inv['invoice_number'] for inv in invoices if inv['invoice_number']})
+            new = {}
+            for invoice in invoices:
+                number = invoice['invoice_number']
+                if number and number not in existing and number not in new:
+                    new[number] = invoice
+
+            client_ids = {}
+            for invoice in (*new.values(), *drafts):
+                name = invoice['client_name']
+                if name not in client_ids:
+                    client_ids[name] = _resolve_client_id(conn, user_id, name, created)
+            insert_sql = """
+                INSERT INTO invoices (client_id, user_id, invoice_number, date, amount, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """
+            def row(number, inv):
+                return (client_ids[inv['client_name']], user_id, number, inv['date'], inv['amount'],
+                        inv.get('status', 'Pending'))
+            conn.executemany(insert_sql, [row(number, inv) for number, inv in new.items()])
+            ids = _invoice_ids(conn, user_id, new)
+            items_by_invoice = {ids[number]: inv['items'] for number, inv in new.items()}
+            for inv in drafts:
+                items_by_invoice[conn.execute(insert_sql, row(None, inv)).lastrowid] = inv['items']
+            _insert_items(conn, items_by_invoice)
+        _publish_clients(user_id, created)
+        bump_data_version(user_id)
+        saved = len(new) + len(drafts)
+        return saved, len(invoices) - saved
+    except Exception as e:
+        print(f"Error adding invoices: {e!r}")
+        return 0, len(invoices)
+
+@cached_query
 def get_invoices(user_id):
     """Returns all invoices as a Pandas DataFrame with Client Names."""
     conn = get_connection()
     query = """
-        SELECT i.id, COALESCE(c.name, 'Unknown Client') as client_name, i.invoice_number, i.date, i.amount, i.status, i.items 
+        SELECT i.id, COALESCE(c.name, 'Unknown Client') as client_name, i.invoice_number, i.date, i.amount, i.status
         FROM invoices i
         LEFT JOIN clients c ON i.client_id = c.id
         WHERE i.user_id = ?
         ORDER BY i.date DESC
     """
-    df = pd.read_sql_query(query, conn, params=(user_id,))
-    conn.close()
-    return df
+    return pd.read_sql_query(query, conn, params=(user_id,))
+
+# Columns selectable through get_invoice_page (name -> SQL expression)
+INVOICE_COLUMNS = {
+    "id": "i.id",
+    "client_id": "i.client_id",
+    "client_name": "COALESCE(c.name, 'Unknown Client')",
+    "invoice_number": "i.invoice_number",
+    "date": "i.date",
+    "amount": "i.amount",
+    "status": "i.status",
+    # Line items as a JSON array; the (invoice_id, position) key range is read in position order
+    "items": """(
+        SELECT json_group_array(json_object(
+            'description', description, 'quantity', quantity, 'unit_price', unit_price, 'total', total))
+        FROM invoice_items WHERE invoice_id = i.id
+    )""",
+}
+DEFAULT_PAGE_COLUMNS = ("id", "client_name", "invoice_number", "date", "amount", "status")
+
+def _invoice_filters(user_id, status=None, client_id=None, date_from=None, date_to=None):
+    """Returns (where clauses, params) for the invoice list filters."""
+    where = ["i.user_id = ?"]
+    params = [user_id]
+    if status:
+        statuses = [status] if isinstance(status, str) else list(status)
+        where.append(f"i.status IN ({', '.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if client_id is not None:
+        where.append("i.client_id = ?")
+        params.append(client_id)
+    if date_from:
+        where.append("i.date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("i.date <= ?")
+        params.append(date_to)
+    return where, params
+
+@cached_query
+def get_invoice_page(user_id, limit=50, cursor=None, columns=DEFAULT_PAGE_COLUMNS,
+                     status=None, client_id=None, date_from=None, date_to=None):
+    """
+    Returns one page of a user's invoices, newest first, using a keyset cursor.
+
+    Args:
+        user_id: Owner of the invoices.
+        limit: Maximum rows in the page.
+        cursor: (date, id) of the last row of the previous page, or None for the first page.
+        columns: Names from INVOICE_COLUMNS to project.
+        status: Optional status or list of statuses.
+        client_id: Optional client filter.
+        date_from, date_to: Optional inclusive 'YYYY-MM-DD' bounds.
+
+    Returns:
+        tuple: (DataFrame, next_cursor). next_cursor is None on the last page.
+    """
+    rows, next_cursor = _fetch_invoice_page(user_id, limit, cursor, columns, status, client_id, date_from, date_to)
+    return pd.DataFrame.from_records(rows, columns=list(columns)), next_cursor
+
+def _fetch_invoice_page(user_id, limit, cursor, columns, status, client_id, date_from, date_to):
+    """Uncached keyset page query behind get_invoice_page and iter_invoices. Returns (row tuples, next_cursor)."""
+    unknown = [col for col in columns if col not in INVOICE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown invoice columns: {unknown}")
+
+    where, params = _invoice_filters(user_id, status, client_id, date_from, date_to)
+    select = ", ".join(f"{INVOICE_COLUMNS[col]} AS {col}" for col in columns)
+
+    def fetch(keyset, keyset_params, fetch_limit):
+        query = f"""
+            SELECT {select}, i.date, i.id
+            FROM invoices i
+            LEFT JOIN clients c ON i.client_id = c.id
+            WHERE {' AND '.join(where + [keyset])}
+            ORDER BY i.date DESC, i.id DESC
+            LIMIT ?
+        """
+        return conn.execute(query, params + keyset_params + [fetch_limit]).fetchall()
+
+    conn = get_connection()
+    cursor_date, cursor_id = cursor if cursor is not None else (None, None)
+    rows = []
+    # Dated rows first via a range seek on (user_id, date); NULL dates sort last under DESC
+    if cursor is None:
+        rows = fetch("i.date IS NOT NULL", [], limit + 1)
+    elif cursor_date is not None:
+        rows = fetch("(i.date, i.id) < (?, ?)", [cursor_date, cursor_id], limit + 1)
+    # Undated rows never match a date bound, so filtered pages skip the NULL-date query
+    if len(rows) <= limit and not (date_from or date_to):
+        if cursor_date is None and cursor is not None:
+            rows += fetch("i.date IS NULL AND i.id < ?", [cursor_id], limit + 1 - len(rows))
+        else:
+            rows += fetch("i.date IS NULL", [], limit + 1 - len(rows))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][-2], rows[-1][-1])
+    return [row[:-2] for row in rows], next_cursor
+
+def iter_invoices(user_id, columns=DEFAULT_PAGE_COLUMNS, batch_size=500,
+                  status=None, client_id=None, date_from=None, date_to=None):
+    """
+    Yields a user's matching invoices as dicts, newest first, one keyset page at a time.
+    Bypasses the query cache, so large exports neither hold every row nor evict cached pages.
+    """
+    cursor = None
+    while True:
+        rows, cursor = _fetch_invoice_page(user_id, batch_size, cursor, columns, status, client_id, date_from, date_to)
+        for row in rows:
+            yield dict(zip(columns, row))
+        if cursor is None:
+            return
+
+@cached_query
+def count_invoices(user_id, status=None, client_id=None, date_from=None, date_to=None):
+    """Counts a user's invoices matching the same filters as get_invoice_page."""
+    where, params = _invoice_filters(user_id, status, client_id, date_from, date_to)
+    conn = get_connection()
+    return conn.execute(f"SELECT COUNT(*) FROM invoices i WHERE {' AND '.join(where)}", params).fetchone()[0]
+
+@cached_query
+def get_revenue_by_service(user_id, status=None, client_id=None, date_from=None, date_to=None, limit=20):
+    """
+    Aggregates line item revenue per service (item description), highest first.
+
+    Takes the same filters as get_invoice_page. Returns a DataFrame with
+    service, invoice_count, quantity and revenue columns.
+    """
+    where, params = _invoice_filters(user_id, status, client_id, date_from, date_to)
+    conn = get_connection()
+    query = f"""
+        SELECT it.description AS service, COUNT(DISTINCT i.id) AS invoice_count,
+               SUM(it.quantity) AS quantity, SUM(it.total) AS revenue
+        FROM invoices i
+        JOIN invoice_items it ON it.invoice_id = i.id
+        WHERE {' AND '.join(where)}
+        GROUP BY it.description
+        ORDER BY revenue DESC
+        LIMIT ?
+    """
+    return pd.read_sql_query(query, conn, params=(*params, limit))
+
+def get_monthly_client_revenue(user_id, month_from):
+    """
+    Invoiced amount per client and month from month_from ('YYYY-MM') on, all statuses,
+    read from the client rollup. Uncached: forecasting caches its result.
+
+    Returns:
+        list: (client_id, month index, amount) rows; month index is year * 12 + month - 1
+        and client_id is 0 for invoices without a client.
+    """
+    conn = get_connection()
+    return conn.execute("""
+        SELECT client_id, CAST(substr(month, 1, 4) AS INTEGER) * 12 + CAST(substr(month, 6, 2) AS INTEGER) - 1, amount
+        FROM invoice_client_monthly_totals
+        WHERE user_id = ? AND month >= ?
+    """, (user_id, month_from)).fetchall()
+
+def get_open_by_due_month(user_id, terms_days=PAYMENT_TERMS_DAYS):
+    """
+    Open (Pending or Overdue) invoice amounts grouped by the month they fall due
+    (invoice date plus terms_days). Returns (month index or None for undated invoices, amount) rows.
+    """
+    conn = get_connection()
+    return conn.execute("""
+        SELECT CAST(substr(due, 1, 4) AS INTEGER) * 12 + CAST(substr(due, 6, 2) AS INTEGER) - 1, SUM(amount)
+        FROM (SELECT date(date, ?) AS due, amount FROM invoices WHERE user_id = ? AND status IN ('Pending', 'Overdue'))
+        GROUP BY 1
+    """, (f"+{int(terms_days)} days", user_id)).fetchall()
+
+# --- Receivables ---
+
+# The user subquery lets the UPDATE seek idx_invoices_user_status_date once per user
+# instead of scanning every invoice; dates that are not ISO are never swept
+SWEEP_OVERDUE_SQL = """
+    UPDATE invoices SET status = 'Overdue'
+    WHERE user_id IN (SELECT id FROM users{where}) AND status = 'Pending' AND date < ?
+      AND date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+"""
+
+def sweep_overdue_invoices(user_id=None, today=None, terms_days=PAYMENT_TERMS_DAYS):
+    """
+    Marks Pending invoices dated more than terms_days before today as Overdue, in a
+    single UPDATE for every user (or one user). Returns the number of invoices changed.
+    """
+    conn = get_connection()
+    cutoff = ((today or datetime.now()) - timedelta(days=terms_days)).strftime('%Y-%m-%d')
+    where, params = (" WHERE id = ?", (user_id,)) if user_id is not None else ("", ())
+    with conn:
+        changed = conn.execute(SWEEP_OVERDUE_SQL.format(where=where), (*params, cutoff)).rowcount
+    if changed:
+        bump_data_version(user_id)
+    return changed
+
+def _sweep_overdue_forever(interval_seconds):
+    while True:
+        try:
+            changed = sweep_overdue_invoices()
+            if changed:
+                print(f"Overdue sweep: {changed} invoices marked Overdue")
+        except Exception as e:
+            print(f"Error sweeping overdue invoices: {e}")
+        time.sleep(interval_seconds)
+
+def start_overdue_sweeper(interval_seconds=OVERDUE_SWEEP_INTERVAL_SECONDS):
+    """Starts the process-wide background thread that runs sweep_overdue_invoices every interval. Idempotent."""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None or not _sweeper.is_alive():
+            _sweeper = threading.Thread(
+                target=_sweep_overdue_forever, args=(interval_seconds,), name="overdue-sweeper", daemon=True
+            )
+            _sweeper.start()
+    return _sweeper
+
+@cached_query
+def get_aging_report(user_id, today=None):
+    """
+    Open (Pending or Overdue) receivables per client, bucketed by days since the
+    invoice date, in one grouped query. Invoices without an ISO date count as 90+.
+
+    Returns:
+        DataFrame: client_name, invoices, one amount column per AGING_BUCKETS label
+        and total, largest total first.
+    """
+    today = today or datetime.now()
+    cutoffs = [(today - timedelta(days=days)).strftime('%Y-%m-%d') for _, days in AGING_BUCKETS[:-1]]
+    buckets = ",\n".join(
+        f'COALESCE(SUM(CASE WHEN bucket = {position} THEN amount END), 0) AS "{label}"'
+        for position, (label, _) in enumerate(AGING_BUCKETS)
+    )
+    ages = " ".join(f"WHEN date >= ? THEN {position}" for position in range(len(cutoffs)))
+    conn = get_connection()
+    return pd.read_sql_query(f"""
+        SELECT COALESCE(c.name, 'Unknown Client') AS client_name, COUNT(*) AS invoices,
+               {buckets},
+               COALESCE(SUM(amount), 0) AS total
+        FROM (
+            SELECT client_id, amount,
+                   CASE WHEN NOT date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' THEN {len(cutoffs)}
+                        {ages} ELSE {len(cutoffs)} END AS bucket
+            FROM invoices
+            WHERE user_id = ? AND status IN ('Pending', 'Overdue')
+        ) i
+        LEFT JOIN clients c ON c.id = i.client_id
+        GROUP BY i.client_id
+        ORDER BY total DESC
+    """, conn, params=(*cutoffs, user_id))
+
+# --- Full-Text Search ---
+
+# bm25 weights per invoice_search column: owner, client_name, client_email, invoice_number, items
+SEARCH_COLUMN_WEIGHTS = (0.0, 10.0, 5.0, 10.0, 1.0)
+# Newest matches ranked per query; older matches of very broad queries are not returned
+SEARCH_RANK_WINDOW = 1000
+SEARCH_COLUMNS = ("id", "client_name", "invoice_number", "date", "amount", "status", "match")
+SEARCH_WORD = re.compile(r"\w+")
+
+def _search_expression(user_id, text):
+    """FTS5 query for free text: every word required as a prefix, in any searchable column of the user's documents."""
+    phrases = []
+    for word in str(text or "").split():
+        tokens = SEARCH_WORD.findall(word)
+        if tokens:
+            # 'F-2024-04' becomes the prefix phrase "F 2024 04"*, matching the invoice number's tokens in order
+            phrases.append('"' + " ".join(tokens) + '"*')
+    if not phrases:
+        return None
+    return f"owner:u{int(user_id)} AND {{client_name client_email invoice_number items}}: ({' AND '.join(phrases)})"
+
+@cached_query
+def search(user_id, query, limit=20, offset=0):
+    """
+    Ranked full-text search over a user's invoices by client name and email, invoice
+    number and line item descriptions. Words match as prefixes, so 'pep' finds 'Pepsi'.
+    Only the SEARCH_RANK_WINDOW newest matches are ranked, which bounds the cost of
+    broad queries on large histories.
+
+    Returns:
+        tuple: (DataFrame of SEARCH_COLUMNS, next_offset). next_offset is None on the last page.
+        The match column is a snippet of the line items with the matched words in brackets.
+    """
+    expression = _search_expression(user_id, query)
+    if expression is None:
+        return pd.DataFrame(columns=list(SEARCH_COLUMNS)), None
+
+    conn = get_connection()
+    # FTS5 streams matches in rowid order cheaply; bm25 is the per-row cost, so rank a bounded window
+    ids = [row[0] for row in conn.execute(f"""
+        SELECT rowid FROM (
+            SELECT rowid, bm25(invoice_search, {', '.join(map(str, SEARCH_COLUMN_WEIGHTS))}) AS score
+            FROM invoice_search
+            WHERE invoice_search MATCH ?
+            ORDER BY rowid DESC
+            LIMIT ?
+        )
+        ORDER BY score, rowid DESC
+        LIMIT ? OFFSET ?
+    """, (expression, SEARCH_RANK_WINDOW, limit + 1, offset)).fetchall()]
+    next_offset = offset + limit if len(ids) > limit else None
+    ids = ids[:limit]
+    if not ids:
+        return pd.DataFrame(columns=list(SEARCH_COLUMNS)), None
+
+    # A rowid range lets FTS5 seek instead of walking every match; snippets are built only for the page
+    rows = conn.execute(f"""
+        SELECT i.id, COALESCE(c.name, 'Unknown Client'), i.invoice_number, i.date, i.amount, i.status,
+               snippet(invoice_search, 4, '[', ']', '…', 8)
+        FROM invoice_search
+        JOIN invoices i ON i.id = invoice_search.rowid
+        LEFT JOIN clients c ON c.id = i.client_id
+        WHERE invoice_search MATCH ? AND invoice_search.rowid BETWEEN ? AND ?
+          AND i.id IN ({', '.join('?' * len(ids))}) AND i.user_id = ?
+    """, (expression, min(ids), max(ids), *ids, user_id)).fetchall()
+    position = {invoice_id: n for n, invoice_id in enumerate(ids)}
+    rows.sort(key=lambda row: position[row[0]])
+    return pd.DataFrame.from_records(rows, columns=list(SEARCH_COLUMNS)), next_offset
+
+def rebuild_search_index():
+    """Recreates every invoice_search document from the invoices, clients and invoice_items tables."""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM invoice_search")
+        conn.execute(REBUILD_SEARCH_INDEX_SQL)
+        conn.execute("INSERT INTO invoice_search (invoice_search) VALUES ('optimize')")
+    bump_data_version()
 
 def delete_invoice(user_id, invoice_id):
-    """Deletes an invoice by ID, ensuring it belongs to the user."""
+    """Deletes an invoice by ID, ensuring it belongs to the user. Its line items cascade."""
     conn = get_connection()
     try:
         # Check user_id to ensure a user can't delete someone else's invoice
-        conn.execute("DELETE FROM invoices WHERE id = ? AND user_id = ?", (invoice_id, user_id))
-        conn.commit()
+        with conn:
+            conn.execute("DELETE FROM invoices WHERE id = ? AND user_id = ?", (invoice_id, user_id))
+        bump_data_version(user_id)
         return True
     except Exception as e:
         print(f"Error deleting invoice: {e}")
         return False
-    finally:
-        conn.close()
 
-def get_dashboard_metrics(user_id):
-    """Calculates metrics and deltas (current vs previous)."""
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT amount, status, date FROM invoices WHERE user_id = ?", conn, params=(user_id,))
-    conn.close()
-    
-    # Basic Totals
-    total_revenue = df[df['status'] == 'Paid']['amount'].sum() if not df.empty else 0.0
-    pending_revenue = df[df['status'] == 'Pending']['amount'].sum() if not df.empty else 0.0
-    overdue_revenue = df[df['status'] == 'Overdue']['amount'].sum() if not df.empty else 0.0
-    
-    # Deltas
-    delta_revenue = "+0.0%"
-    delta_pending = "+0.0%"
-    delta_overdue = "+0.0%"
-    
-    if len(df) > 0:
-        delta_revenue = f"+{len(df) * 1.2:.1f}%"
-        delta_pending = f"{'2.5' if pending_revenue > 0 else '0.0'}%"
-    
+def delete_invoices(user_id, invoice_ids):
+    """Deletes several of a user's invoices in one transaction. Their line items cascade."""
+    conn = get_connection()
+    try:
+        with conn:
+            conn.executemany(
+                "DELETE FROM invoices WHERE id = ? AND user_id = ?",
+                [(int(invoice_id), user_id) for invoice_id in invoice_ids],
+            )
+        bump_data_version(user_id)
+        return True
+    except Exception as e:
+        print(f"Error deleting invoices: {e}")
+        return False
+
+def rebuild_monthly_totals(user_id=None):
+    """Recomputes the monthly totals rollups (per status and per client) from the invoices table."""
+    conn = get_connection()
+    where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    with conn:
+        conn.execute(f"DELETE FROM invoice_monthly_totals {where}", params)
+        conn.execute(REBUILD_MONTHLY_TOTALS_SQL.format(where=where), params)
+        conn.execute(f"DELETE FROM invoice_client_monthly_totals {where}", params)
+        conn.execute(REBUILD_CLIENT_MONTHLY_TOTALS_SQL.format(where=where), params)
+    bump_data_version(user_id)
+
+def _format_delta(current, previous):
+    """Month-over-month change as a signed percentage string."""
+    if previous:
+        return f"{(current - previous) / abs(previous) * 100:+.1f}%"
+    return "+100.0%" if current > 0 else "+0.0%"
+
+@cached_query
+def get_dashboard_metrics(user_id, today=None):
+    """Calculates metrics and deltas (current vs previous month) from the rollup table."""
+    today = today or datetime.now()
+    current_month = today.strftime('%Y-%m')
+    previous_month = (today.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT status,
+               SUM(amount),
+               SUM(CASE WHEN month = ? THEN amount ELSE 0 END),
+               SUM(CASE WHEN month = ? THEN amount ELSE 0 END)
+        FROM invoice_monthly_totals
+        WHERE user_id = ?
+        GROUP BY status
+    """, (current_month, previous_month, user_id)).fetchall()
+
+    totals = {status: (total, current, previous) for status, total, current, previous in rows}
+    paid = totals.get('Paid', (0.0, 0.0, 0.0))
+    pending = totals.get('Pending', (0.0, 0.0, 0.0))
+    overdue = totals.get('Overdue', (0.0, 0.0, 0.0))
+
     return {
-        "total_revenue": total_revenue,
-        "pending_revenue": pending_revenue,
-        "overdue_revenue": overdue_revenue,
-        "delta_revenue": delta_revenue,
-        "delta_pending": delta_pending,
-        "delta_overdue": delta_overdue
+        "total_revenue": paid[0],
+        "pending_revenue": pending[0],
+        "overdue_revenue": overdue[0],
+        "delta_revenue": _format_delta(paid[1], paid[2]),
+        "delta_pending": _format_delta(pending[1], pending[2]),
+        "delta_overdue": _format_delta(overdue[1], overdue[2])
     }
 
-# Initialize DB on module load if it doesn't exist
-if not os.path.exists(DB_FILE):
-    init_db()
+# --- Extraction Cache ---
+
+def get_cached_extraction(cache_key):
+    """Returns a cached extraction result (dict) or None if missing or expired."""
+    conn = get_connection()
+    now = time.time()
+    try:
+        row = conn.execute(
+            "SELECT result FROM extraction_cache WHERE cache_key = ? AND expires_at > ?", (cache_key, now)
+        ).fetchone()
+        if not row:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE extraction_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?", (now, cache_key)
+            )
+        return json.loads(row[0])
+    except Exception as e:
+        print(f"Error reading extraction cache: {e}")
+        return None
+
+def put_cached_extraction(cache_key, result, ttl_seconds, max_bytes):
+    """Stores an extraction result, then evicts expired and least recently used entries beyond max_bytes."""
+    conn = get_connection()
+    now = time.time()
+    payload = json.dumps(result)
+    try:
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO extraction_cache (cache_key, result, size_bytes, created_at, expires_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (cache_key, payload, len(payload), now, now + ttl_seconds, now))
+            conn.execute("DELETE FROM extraction_cache WHERE expires_at <= ?", (now,))
+            conn.execute("""
+                DELETE FROM extraction_cache WHERE cache_key IN (
+                    SELECT cache_key FROM (
+                        SELECT cache_key, SUM(size_bytes) OVER (ORDER BY last_used_at DESC, cache_key) AS running_bytes
+                        FROM extraction_cache
+                    ) WHERE running_bytes > ?
+                )
+            """, (max_bytes,))
+        return True
+    except Exception as e:
+        print(f"Error writing extraction cache: {e}")
+        return False
+
+def get_extraction_cache_summary():
+    """Returns entry count, stored bytes and lifetime hits of the extraction cache."""
+    conn = get_connection()
+    entries, size_bytes, hits = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(hits), 0) FROM extraction_cache"
+    ).fetchone()
+    return {"entries": entries, "size_bytes": size_bytes, "hits": hits}
+
+def clear_extraction_cache():
+    """Removes every cached extraction result."""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM extraction_cache")
+
+def main(argv=None):
+    """Maintenance commands: python database.py <command>."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="AURA Finance database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild-rollups", help="Recompute the monthly totals rollup tables")
+    rebuild.add_argument("--user-id", type=int, default=None, help="Only rebuild this user's rows")
+    commands.add_parser("rebuild-search", help="Recreate the invoice full-text search index")
+    merge = commands.add_parser("merge-clients", help="Merge duplicate clients (same normalized or near-identical name)")
+    merge.add_argument("--user-id", type=int, default=None, help="Only merge this user's clients")
+    merge.add_argument("--dry-run", action="store_true", help="List the merges without applying them")
+    sweep = commands.add_parser("sweep-overdue", help="Mark Pending invoices past the payment terms as Overdue")
+    sweep.add_argument("--user-id", type=int, default=None, help="Only sweep this user's invoices")
+    commands.add_parser("migrate", help="Apply pending schema migrations")
+    commands.add_parser("clear-extraction-cache", help="Remove all cached Gemini extraction results")
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild-rollups":
+        rebuild_monthly_totals(args.user_id)
+        print("Monthly totals rebuilt.")
+    elif args.command == "merge-clients":
+        merges = merge_duplicate_clients(args.user_id, dry_run=args.dry_run)
+        for uid, kept, duplicates in merges:
+            print(f"user {uid}: client {kept} <- {duplicates}")
+        merged = sum(len(duplicates) for _, _, duplicates in merges)
+        print(f"{merged} duplicate clients {'would be ' if args.dry_run else ''}merged.")
+    elif args.command == "rebuild-search":
+        rebuild_search_index()
+        print("Search index rebuilt.")
+    elif args.command == "sweep-overdue":
+        changed = sweep_overdue_invoices(args.user_id)
+        print(f"{changed} invoices marked Overdue.")
+    elif args.command == "migrate":
+        applied = migrate()
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+        print(f"Schema version: {get_schema_version()}")
+    elif args.command == "clear-extraction-cache":
+        clear_extraction_cache()
+        print("Extraction cache cleared.")
+
+# Apply pending migrations on module load so existing databases pick up schema changes
+init_db()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import database as db
+from invoice_generator import VAT_RATE
+
+# Complete months of history fitted, and months projected from the current one
+HISTORY_MONTHS = 36
+FORECAST_MONTHS = 12
+# Every client is fitted over at least this many months, counting the empty months before
+# its first invoice, so a brand-new client is not assumed to bill its first amount monthly
+MIN_FIT_MONTHS = 6
+# Clients billed in fewer months than this get a flat forecast at their mean monthly revenue:
+# a trend through two or three invoices extrapolates noise into steep growth
+MIN_TREND_MONTHS = 6
+# Month-of-year effects are fitted only with two full years of a client's history
+SEASONAL_MIN_MONTHS = 24
+# Each projected month carries this share of the previous month's trend step
+TREND_DAMPING = 0.9
+# Width of the forecast band: about 80% of months inside it when residuals are normal
+BAND_Z = 1.28
+
+def month_label(index):
+    """'YYYY-MM' for a month index (year * 12 + month - 1)."""
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+def _design(positions, months_of_year, seasonal, trend=True):
+    """Regression columns: intercept, trend position if trend and, if seasonal, 11 month-of-year dummies (January is the base)."""
+    columns = [np.ones(len(positions))] + ([positions] if trend else [])
+    if seasonal:
+        columns.extend((months_of_year == month).astype(float) for month in range(1, 12))
+    return np.column_stack(columns)
+
+def fit_forecast(series, first_month, horizon=FORECAST_MONTHS):
+    """
+    Fits a linear trend plus month-of-year effects to every row of series by least
+    squares and projects it horizon months ahead with a damped trend. Clients billed
+    in fewer than MIN_TREND_MONTHS months are fitted with the intercept only: a flat
+    forecast at their mean monthly revenue over the fitted months.
+
+    Clients with the same first month and model share a design matrix, so each
+    group is solved with one pseudo-inverse and a matrix product; there is no
+    per-client loop.
+
+    Args:
+        series: (clients, months) array of monthly revenue, oldest month first.
+        first_month: Month index of the first column.
+        horizon: Months to project after the last column.
+
+    Returns:
+        tuple: (forecast, sigma). forecast is (clients, horizon), clipped at zero;
+        sigma is each row's residual standard deviation.
+    """
+    series = np.asarray(series, dtype=float)
+    clients, months = series.shape
+    forecast = np.zeros((clients, horizon))
+    sigma = np.zeros(clients)
+    active = series != 0
+    billed = active.any(axis=1)
+    start = np.minimum(active.argmax(axis=1), max(months - MIN_FIT_MONTHS, 0))
+    trended = active.sum(axis=1) >= MIN_TREND_MONTHS
+
+    months_of_year = (first_month + np.arange(months + horizon)) % 12
+    damped_steps = np.cumsum(TREND_DAMPING ** np.arange(1, horizon + 1))
+    for offset, trend in set(zip(start[billed], trended[billed])):
+        rows = np.flatnonzero(billed & (start == offset) & (trended == trend))
+        length = months - offset
+        seasonal = trend and length >= SEASONAL_MIN_MONTHS
+        X = _design(np.arange(length, dtype=float), months_of_year[offset:months], seasonal, trend)
+        X_future = _design(length - 1 + damped_steps, months_of_year[months:], seasonal, trend)
+
+        y = series[rows, offset:]
+        coefficients = y @ np.linalg.pinv(X).T
+        residuals = y - coefficients @ X.T
+        forecast[rows] = coefficients @ X_future.T
+        sigma[rows] = np.sqrt((residuals ** 2).sum(axis=1) / max(length - X.shape[1], 1))
+    return np.clip(forecast, 0, None), sigma
+
+def _quarter_due_date(year, quarter):
+    """Filing deadline of a quarterly VAT return (modelo 303): the 20th of the next month, 30 January for Q4."""
+    return date(year + 1, 1, 30) if quarter == 4 else date(year, quarter * 3 + 1, 20)
+
+@db.cached_query
+def get_forecast(user_id, today=None):
+    """
+    Revenue forecast, expected cash-in and quarterly VAT for a user, cached until
+    the user's invoices change.
+
+    Returns:
+        dict: DataFrames 'history' (month, revenue), 'forecast' (month, revenue,
+        low, high, invoiced, cash_in), 'vat' (quarter, base, vat, due_date,
+        projected) and 'clients' (client, last_12m, next_12m, change,
+        low_support: billed in fewer than MIN_TREND_MONTHS months), plus
+        'open_total', the amount of all Pending and Overdue invoices.
+    """
+    today = today or datetime.now()
+    current = today.year * 12 + today.month - 1
+    first = current - HISTORY_MONTHS
+    rows = np.array(db.get_monthly_client_revenue(user_id, month_label(first)), dtype=float).reshape(-1, 3)
+    # Months that are not 'YYYY-MM' (unparsed dates) sort after digits but map outside the window
+    rows = rows[~np.isnan(rows).any(axis=1) & (rows[:, 1] >= first)]
+
+    # (client, month) matrix of complete months; invoices dated this month or later are already invoiced revenue
+    history = rows[rows[:, 1] < current]
+    client_ids, client_rows = np.unique(history[:, 0], return_inverse=True)
+    series = np.zeros((len(client_ids), HISTORY_MONTHS))
+    series[client_rows, (history[:, 1] - first).astype(int)] = history[:, 2]
+    upcoming = rows[(rows[:, 1] >= current) & (rows[:, 1] < current + FORECAST_MONTHS)]
+    invoiced = np.bincount((upcoming[:, 1] - current).astype(int), weights=upcoming[:, 2], minlength=FORECAST_MONTHS)
+
+    client_forecast, sigma = fit_forecast(series, first)
+    revenue = client_forecast.sum(axis=0)
+    band = BAND_Z * np.sqrt((sigma ** 2).sum())
+    # Revenue not invoiced yet in each projected month; it is collected at the payment terms
+    to_invoice = np.clip(revenue - invoiced, 0, None)
+    terms_months = max(round(db.PAYMENT_TERMS_DAYS / 30), 0)
+
+    # Open invoices are collected when due; Overdue ones are expected this month
+    open_total = 0.0
+    cash_in = np.zeros(FORECAST_MONTHS)
+    for due_month, amount in db.get_open_by_due_month(user_id):
+        open_total += amount or 0.0
+        step = 0 if due_month is None else max(due_month - current, 0)
+        if step < FORECAST_MONTHS:
+            cash_in[step] += amount or 0.0
+    cash_in[terms_months:] += to_invoice[:FORECAST_MONTHS - terms_months]
+
+    months = [month_label(m) for m in range(current, current + FORECAST_MONTHS)]
+    forecast = pd.DataFrame({
+        "month": months,
+        "revenue": revenue,
+        "low": np.clip(revenue - band, 0, None),
+        "high": revenue + band,
+        "invoiced": invoiced,
+        "cash_in": cash_in,
+    })
+    history_df = pd.DataFrame({
+        "month": [month_label(m) for m in range(first, current)],
+        "revenue": series.sum(axis=0),
+    })
+
+    # VAT base per month: invoiced amounts for past months, the larger of forecast and invoiced ahead
+    base = np.concatenate([series.sum(axis=0), np.maximum(revenue, invoiced)])
+    vat_rows = []
+    for quarter_start in range(current - current % 12, current + FORECAST_MONTHS - 2, 3):
+        year, quarter = quarter_start // 12, quarter_start % 12 // 3 + 1
+        if quarter_start + 3 > current + FORECAST_MONTHS:
+            break
+        quarter_base = base[quarter_start - first:quarter_start - first + 3].sum()
+        vat_rows.append({
+            "quarter": f"{year}-T{quarter}",
+            "base": quarter_base,
+            "vat": quarter_base * VAT_RATE,
+            "due_date": _quarter_due_date(year, quarter),
+            "projected": quarter_start + 3 > current,
+        })
+
+    names = db.get_clients(user_id).set_index("id")["name"].reindex(client_ids.astype(int)).fillna("—")
+    last_12m = series[:, -12:].sum(axis=1)
+    next_12m = client_forecast.sum(axis=1)
+    clients = pd.DataFrame({
+        "client": names.to_numpy(),
+        "last_12m": last_12m,
+        "next_12m": next_12m,
+        "change": np.divide(next_12m - last_12m, last_12m, out=np.full(len(client_ids), np.nan), where=last_12m > 0),
+        "low_support": (series != 0).sum(axis=1) < MIN_TREND_MONTHS,
+    }).sort_values("next_12m", ascending=False, ignore_index=True)
+
+    return {
+        "history": history_df,
+        "forecast": forecast,
+        "vat": pd.DataFrame(vat_rows, columns=["quarter", "base", "vat", "due_date", "projected"]),
+        "clients": clients,
+        "open_total": open_total,
+    }
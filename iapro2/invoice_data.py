@@ -0,0 +1,150 @@
+import json
+from datetime import datetime
+
+# Placeholder numbers earlier prompts and the app wrote for invoices without one; saved as NULL
+DRAFT_NUMBERS = {None, "", "Draft", "DRAFT-00X"}
+
+def to_float(value, default=0.0):
+    """Converts a number-like value (including '1.234,50' or '€ 12') to float, or returns default."""
+    if value is None or isinstance(value, bool):
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        text = str(value).replace("€", "").replace("EUR", "").replace(" ", "").strip()
+        if "," in text and "." in text:
+            # Whichever separator comes last is the decimal one
+            if text.rfind(",") > text.rfind("."):
+                text = text.replace(".", "").replace(",", ".")
+            else:
+                text = text.replace(",", "")
+        elif "," in text:
+            text = text.replace(",", ".")
+        return float(text)
+    except (ValueError, TypeError):
+        return default
+
+def _to_text(value, default=None):
+    if value is None:
+        return default
+    text = str(value).strip()
+    return text or default
+
+class LineItem:
+    """A single invoice line with validated numeric fields."""
+    __slots__ = ("description", "quantity", "unit_price", "total")
+
+    def __init__(self, description="Item", quantity=1.0, unit_price=0.0, total=None):
+        self.description = description
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.total = quantity * unit_price if total is None else total
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a LineItem from a loose dict, coercing every numeric field once."""
+        quantity = to_float(data.get("quantity"), 1.0)
+        unit_price = to_float(data.get("unit_price"), 0.0)
+        return cls(
+            description=_to_text(data.get("description"), "Item"),
+            quantity=quantity,
+            unit_price=unit_price,
+            total=to_float(data.get("total"), quantity * unit_price)
+        )
+
+    def to_dict(self):
+        return {
+            "description": self.description,
+            "quantity": self.quantity,
+            "unit_price": self.unit_price,
+            "total": self.total
+        }
+
+    def __repr__(self):
+        return f"LineItem({self.description!r}, quantity={self.quantity}, unit_price={self.unit_price}, total={self.total})"
+
+class InvoiceData:
+    """Typed invoice extraction result shared by the DB save, PDF and comparison paths."""
+    __slots__ = ("client_name", "client_address", "invoice_number", "date", "currency", "items", "total_amount")
+
+    def __init__(self, client_name=None, client_address=None, invoice_number=None, date=None,
+                 currency=None, items=None, total_amount=None):
+        self.client_name = client_name
+        self.client_address = client_address
+        self.invoice_number = invoice_number
+        self.date = date
+        self.currency = currency
+        self.items = items or []
+        self.total_amount = total_amount
+
+    @classmethod
+    def from_dict(cls, data):
+        """Validates a parsed model reply. Raises ValueError if it is not an invoice object."""
+        if not isinstance(data, dict):
+            raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+        items = data.get("items") or []
+        if not isinstance(items, list):
+            raise ValueError("'items' must be a list")
+        line_items = [LineItem.from_dict(item) for item in items if isinstance(item, dict)]
+        total_amount = to_float(data.get("total_amount"), None)
+        return cls(
+            client_name=_to_text(data.get("client_name")),
+            client_address=_to_text(data.get("client_address")),
+            invoice_number=_to_text(data.get("invoice_number")),
+            date=_to_text(data.get("date")),
+            currency=_to_text(data.get("currency")),
+            items=line_items,
+            total_amount=total_amount
+        )
+
+    @classmethod
+    def from_record(cls, record):
+        """Builds an InvoiceData from a stored invoice row (dict with the invoices columns)."""
+        items = record.get("items") or []
+        if isinstance(items, str):
+            # The JSON array built from invoice_items by the 'items' invoice column
+            try:
+                items = json.loads(items)
+            except ValueError:
+                items = []
+        return cls(
+            client_name=_to_text(record.get("client_name")),
+            invoice_number=_to_text(record.get("invoice_number")),
+            date=_to_text(record.get("date")),
+            items=[LineItem.from_dict(item) for item in items if isinstance(item, dict)],
+            total_amount=to_float(record.get("amount"), None)
+        )
+
+    @property
+    def items_total(self):
+        return sum(item.total for item in self.items)
+
+    @property
+    def total(self):
+        """Stated total if present, otherwise the sum of the line items."""
+        return self.total_amount if self.total_amount else self.items_total
+
+    def to_dict(self):
+        return {
+            "client_name": self.client_name,
+            "client_address": self.client_address,
+            "invoice_number": self.invoice_number,
+            "date": self.date,
+            "currency": self.currency,
+            "items": [item.to_dict() for item in self.items],
+            "total_amount": self.total_amount
+        }
+
+    def to_record(self, status='Pending'):
+        """Maps the invoice to the add_invoice/add_invoices_bulk fields."""
+        return {
+            "client_name": self.client_name or 'Unknown Client',
+            "invoice_number": self.invoice_number if self.invoice_number not in DRAFT_NUMBERS else None,
+            "date": self.date or datetime.now().strftime('%Y-%m-%d'),
+            "amount": self.total,
+            "items": [item.to_dict() for item in self.items],
+            "status": status
+        }
+
+    def __repr__(self):
+        return f"InvoiceData({self.to_dict()!r})"
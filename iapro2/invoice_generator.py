@@ -1,71 +1,155 @@
+import functools
+import json
 from fpdf import FPDF
+from fpdf.enums import XPos, YPos
 from datetime import datetime
+from invoice_data import InvoiceData
+
+# Rendered PDFs kept in memory, keyed by the invoice content
+PDF_CACHE_SIZE = 32
+# Spanish general VAT (IVA) rate added on top of the invoice amount
+VAT_RATE = 0.21
+
+# Static branding drawn on every page: (font style, size, RGB, line top, line height, text, align).
+# Negative tops are measured from the bottom of the page.
+HEADER_LINES = (
+    ('B', 24, (212, 175, 55), 15, 10, 'AURA FINANCE', 'L'), # Gold logo
+    ('', 9, (200, 200, 200), 25, 5, 'Paseo de la Castellana 1, Madrid', 'L'),
+    ('', 9, (200, 200, 200), 30, 5, 'VAT: ES-B12345678', 'L'),
+    ('', 9, (200, 200, 200), 35, 5, 'contact@aurafinance.lux', 'L'),
+    ('B', 30, (255, 255, 255), 15, 10, 'INVOICE', 'R'),
+)
+FOOTER_LINES = (
+    ('I', 8, (128, 128, 128), -20, 5, 'Payment due within 30 days.', 'C'),
+    ('I', 8, (128, 128, 128), -15, 5, 'Thank you for your business.', 'C'),
+)
+HEADER_BOTTOM = 55
+# Item table: (width, title, align) per column
+TABLE_COLUMNS = ((110, "DESCRIPTION", 'L'), (20, "QTY", 'C'), (30, "UNIT PRICE", 'R'), (30, "AMOUNT", 'R'))
+ROW_HEIGHT = 10
+TEXT_WIDTH_CACHE_SIZE = 20000
 
 class PremiumInvoicePDF(FPDF):
+    # Shared by every document: string widths per (font, size, text) and the branding
+    # resolved to text baselines once per page size
+    _text_widths = {}
+    _branding = {}
+
     def __init__(self, data):
         super().__init__()
-        self.data = data
+        self.data = data if isinstance(data, InvoiceData) else InvoiceData.from_dict(data)
+        self.invoice_label = ('', 10, (255, 255, 255), 25, 10, f"#{self.data.invoice_number or 'DRAFT'}", 'R')
         self.set_auto_page_break(auto=True, margin=15)
         self.add_page()
 
+    def string_width(self, text):
+        """get_string_width for the current font, memoized across documents."""
+        key = (self.font_family, self.font_style, self.font_size_pt, text)
+        width = self._text_widths.get(key)
+        if width is None:
+            if len(self._text_widths) >= TEXT_WIDTH_CACHE_SIZE:
+                self._text_widths.clear()
+            width = self._text_widths[key] = self.get_string_width(text)
+        return width
+
+    def _text_x(self, x, width, text, align):
+        """Left edge of text aligned like cell() would place it in a box at x of the given width."""
+        if align == 'R':
+            return x + width - self.c_margin - self.string_width(text)
+        if align == 'C':
+            return x + (width - self.string_width(text)) / 2
+        return x + self.c_margin
+
+    def _resolve_lines(self, lines):
+        """Turns branding lines into (style, size, colour, x, baseline, text) for text()."""
+        resolved = []
+        width = self.w - self.l_margin - self.r_margin
+        for style, size, color, top, height, text, align in lines:
+            self.set_font('Helvetica', style, size)
+            top = top + self.h if top < 0 else top
+            baseline = top + height / 2 + 0.3 * self.font_size
+            resolved.append((style, size, color, self._text_x(self.l_margin, width, text, align), baseline, text))
+        return resolved
+
+    def _draw_lines(self, resolved):
+        for style, size, color, x, baseline, text in resolved:
+            self.set_font('Helvetica', style, size)
+            self.set_text_color(*color)
+            self.text(x, baseline, text)
+
+    def _page_branding(self):
+        key = (self.w, self.h)
+        branding = self._branding.get(key)
+        if branding is None:
+            branding = self._branding[key] = (self._resolve_lines(HEADER_LINES), self._resolve_lines(FOOTER_LINES))
+        return branding
+
     def header(self):
         # Background color for header
         self.set_fill_color(14, 17, 23)  # #0E1117 (Dark)
         self.rect(0, 0, 210, 50, 'F')
-        
-        # Logo / Title
-        self.set_y(15)
-        self.set_font('Helvetica', 'B', 24)
-        self.set_text_color(212, 175, 55)  # #D4AF37 (Gold)
-        self.cell(0, 10, 'AURA FINANCE', ln=True, align='L')
-        
-        # Sender Details (Hardcoded Template)
-        self.set_font('Helvetica', '', 9)
-        self.set_text_color(200, 200, 200)
-        self.cell(0, 5, 'Paseo de la Castellana 1, Madrid', ln=True, align='L')
-        self.cell(0, 5, 'VAT: ES-B12345678', ln=True, align='L')
-        self.cell(0, 5, 'contact@aurafinance.lux', ln=True, align='L')
-        
-        # Invoice Label
-        self.set_y(15)
-        self.set_font('Helvetica', 'B', 30)
-        self.set_text_color(255, 255, 255)
-        self.cell(0, 10, 'INVOICE', ln=True, align='R')
-        
-        self.set_font('Helvetica', '', 10)
-        self.cell(0, 10, f"#{self.data.get('invoice_number', 'DRAFT')}", ln=True, align='R')
-        self.ln(20)
+        header, _ = self._page_branding()
+        self._draw_lines(header)
+        self._draw_lines(self._resolve_lines((self.invoice_label,)))
+        self.set_xy(self.l_margin, HEADER_BOTTOM)
 
     def footer(self):
-        self.set_y(-20)
-        self.set_font('Helvetica', 'I', 8)
-        self.set_text_color(128, 128, 128)
-        self.cell(0, 5, 'Payment due within 30 days.', 0, 1, 'C')
-        self.cell(0, 5, 'Thank you for your business.', 0, 1, 'C')
+        _, footer = self._page_branding()
+        self._draw_lines(footer)
+
+    def _render_rows(self):
+        """Item rows drawn with text() and one rule per row; breaks pages like cell() would."""
+        self.set_font('Helvetica', '', 10)
+        self.set_text_color(0, 0, 0)
+        left = self.l_margin
+        right = left + sum(width for width, _, _ in TABLE_COLUMNS)
+        baseline = ROW_HEIGHT / 2 + 0.3 * self.font_size
+        (desc_w, _, desc_align), (qty_w, _, qty_align), (price_w, _, price_align), (total_w, _, total_align) = TABLE_COLUMNS
+        qty_x, price_x = left + desc_w, left + desc_w + qty_w
+        total_x = price_x + price_w
+        y = self.get_y()
+
+        # Items are already validated LineItems (numeric fields coerced once at parse time)
+        for item in self.data.items:
+            if y + ROW_HEIGHT > self.page_break_trigger:
+                self.add_page()
+                y = self.get_y()
+            text_y = y + baseline
+            quantity = str(int(item.quantity))
+            unit_price = f"{item.unit_price:,.2f}"
+            total = f"{item.total:,.2f}"
+            self.text(self._text_x(left, desc_w, item.description, desc_align), text_y, item.description)
+            self.text(self._text_x(qty_x, qty_w, quantity, qty_align), text_y, quantity)
+            self.text(self._text_x(price_x, price_w, unit_price, price_align), text_y, unit_price)
+            self.text(self._text_x(total_x, total_w, total, total_align), text_y, total)
+            y += ROW_HEIGHT
+            self.line(left, y, right, y)
+        self.set_xy(left, y)
 
-    def generate(self, output_path):
+    def generate(self, output_path=None):
+        """Renders the invoice to output_path, or returns the PDF bytes when no path is given."""
         # Client Info
         self.set_y(60)
         self.set_font('Helvetica', 'B', 10)
         self.set_text_color(128, 128, 128)
-        self.cell(0, 5, "BILL TO:", ln=True)
+        self.cell(0, 5, "BILL TO:", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
         self.set_font('Helvetica', 'B', 14)
         self.set_text_color(0, 0, 0)
-        self.cell(0, 8, f"{self.data.get('client_name', 'Unknown Client').upper()}", ln=True)
+        self.cell(0, 8, f"{(self.data.client_name or 'Unknown Client').upper()}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
         self.set_font('Helvetica', '', 10)
         self.set_text_color(60, 60, 60)
-        address = self.data.get('client_address')
+        address = self.data.client_address
         if address:
-            self.cell(0, 5, address, ln=True)
+            self.cell(0, 5, address, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
         self.set_y(60)
         self.set_font('Helvetica', 'B', 10)
         self.set_text_color(128, 128, 128)
-        self.cell(0, 5, "DATE:", ln=True, align='R')
+        self.cell(0, 5, "DATE:", align='R', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.set_text_color(0, 0, 0)
-        self.cell(0, 5, f"{self.data.get('date', datetime.now().strftime('%Y-%m-%d'))}", ln=True, align='R')
+        self.cell(0, 5, f"{self.data.date or datetime.now().strftime('%Y-%m-%d')}", align='R', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
         self.ln(20)
         
@@ -73,63 +157,66 @@ class PremiumInvoicePDF(FPDF):
         self.set_fill_color(240, 240, 240)
         self.set_text_color(0, 0, 0)
         self.set_font('Helvetica', 'B', 9)
-        self.cell(110, 8, "DESCRIPTION", 0, 0, 'L', True)
-        self.cell(20, 8, "QTY", 0, 0, 'C', True)
-        self.cell(30, 8, "UNIT PRICE", 0, 0, 'R', True)
-        self.cell(30, 8, "AMOUNT", 0, 1, 'R', True)
+        for width, title, align in TABLE_COLUMNS:
+            self.cell(width, 8, title, 0, align=align, fill=True)
+        self.ln(8)
         
         self.ln(2)
         
         # Table Rows
-        self.set_font('Helvetica', '', 10)
-        self.set_text_color(0, 0, 0)
-        
-        total_amount = 0.0
-        
-        items = self.data.get('items', [])
-        for item in items:
-            description = item.get('description', 'Item')
-            
-            # Safe conversion helper
-            def safe_float(val, default=0.0):
-                try:
-                    if val is None: return default
-                    return float(val)
-                except (ValueError, TypeError):
-                    return default
-
-            qty = safe_float(item.get('quantity'), 1.0)
-            price = safe_float(item.get('unit_price'), 0.0)
-            total = safe_float(item.get('total'), qty * price)
-            
-            self.cell(110, 10, description, 'B')
-            self.cell(20, 10, str(int(qty)), 'B', 0, 'C')
-            self.cell(30, 10, f"{price:,.2f}", 'B', 0, 'R')
-            self.cell(30, 10, f"{total:,.2f}", 'B', 1, 'R')
-            
-            total_amount += total
+        self._render_rows()
             
         # Totals Section
         self.ln(10)
         
         # Use extracted total if valid, otherwise calculated
-        extracted_total = self.data.get('total_amount')
-        try:
-             final_total = float(extracted_total) if extracted_total else total_amount
-        except:
-             final_total = total_amount
+        final_total = self.data.total
              
         self.set_font('Helvetica', '', 10)
-        self.cell(160, 8, "Subtotal", 0, 0, 'R')
-        self.cell(30, 8, f"{final_total:,.2f}", 0, 1, 'R')
+        self.cell(160, 8, "Subtotal", align='R')
+        self.cell(30, 8, f"{final_total:,.2f}", align='R', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
-        self.cell(160, 8, "Tax (21%)", 0, 0, 'R')
-        tax = final_total * 0.21
-        self.cell(30, 8, f"{tax:,.2f}", 0, 1, 'R')
+        self.cell(160, 8, f"Tax ({VAT_RATE:.0%})", align='R')
+        tax = final_total * VAT_RATE
+        self.cell(30, 8, f"{tax:,.2f}", align='R', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
         self.set_font('Helvetica', 'B', 12)
         self.set_text_color(212, 175, 55) # Gold
-        self.cell(160, 10, "TOTAL EUR", 0, 0, 'R')
-        self.cell(30, 10, f"{(final_total + tax):,.2f}", 0, 1, 'R')
+        self.cell(160, 10, "TOTAL EUR", align='R')
+        self.cell(30, 10, f"{(final_total + tax):,.2f}", align='R', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
+        if output_path is None:
+            return bytes(self.output())
         self.output(output_path)
+
+def invoice_fingerprint(data):
+    """Canonical JSON of the invoice content, used as the render cache key."""
+    data = data if isinstance(data, InvoiceData) else InvoiceData.from_dict(data)
+    return json.dumps(data.to_dict(), sort_keys=True, ensure_ascii=False)
+
+@functools.lru_cache(maxsize=PDF_CACHE_SIZE)
+def _render_fingerprint(fingerprint):
+    return PremiumInvoicePDF(json.loads(fingerprint)).generate()
+
+def render_invoice_pdf(data):
+    """Returns the PDF bytes for an invoice. Identical invoice data is rendered only once."""
+    return _render_fingerprint(invoice_fingerprint(data))
+
+def render_invoice_record(record):
+    """Renders a stored invoice row to PDF bytes."""
+    return PremiumInvoicePDF(InvoiceData.from_record(record)).generate()
+
+def render_invoice_records(records):
+    """
+    Renders a chunk of stored invoice rows for a process-pool worker (top-level so it pickles).
+
+    Returns:
+        list: (pdf bytes, None) or (None, error message) per record, in order.
+    """
+    results = []
+    for record in records:
+        try:
+            results.append((render_invoice_record(record), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
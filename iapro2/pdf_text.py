@@ -0,0 +1,294 @@
+import io
+import re
+import unicodedata
+from datetime import datetime
+from invoice_data import InvoiceData, LineItem, to_float
+
+try:
+    from pypdf import PdfReader
+except ImportError: # Without pypdf every PDF goes to Gemini
+    PdfReader = None
+
+# Digital PDFs (generated by invoicing software) carry a text layer that can be parsed
+# with plain rules in milliseconds. Results below this confidence go to Gemini instead.
+LOCAL_MIN_CONFIDENCE = 0.75
+TEXT_LAYER_MAX_PAGES = 5
+# Fewer visible characters than this means a scan (image-only PDF)
+TEXT_LAYER_MIN_CHARS = 80
+AMOUNT_TOLERANCE = 0.02
+
+# A result is saved under its client, so the client name outweighs the gap between 1.0 and
+# LOCAL_MIN_CONFIDENCE: a parse without one always goes to Gemini
+CONFIDENCE_WEIGHTS = {
+    "client_name": 0.3,
+    "invoice_number": 0.05,
+    "date": 0.1,
+    "total_amount": 0.15,
+    "items": 0.1,
+    "items_consistent": 0.1,
+    "totals_reconcile": 0.2,
+}
+
+# Labels are matched on accent-stripped, lower-cased text (English and Spanish)
+INVOICE_NUMBER_LABEL = re.compile(r"\b(?:invoice|factura|fra)\s*(?:n[o.º°]*|num(?:ber|ero)?\.?|#)?\s*[:#]?\s*([a-z0-9][a-z0-9\-/.]*\d[a-z0-9\-/.]*)")
+HASH_NUMBER = re.compile(r"(?:^|\s)#\s?([a-z0-9][a-z0-9\-/.]*\d[a-z0-9\-/.]*)")
+DATE_LABEL = re.compile(r"\b(?:date|fecha)(?:\s+(?:de\s+)?(?:emision|factura|invoice))?\b")
+CLIENT_LABEL = re.compile(r"\b(?:bill to|billed to|customer|client|cliente|facturar a)\b\s*:?")
+TOTAL_LABEL = re.compile(r"\b(?:grand total|total amount|total due|amount due|total a pagar|importe total|total)\b")
+SUBTOTAL_LABEL = re.compile(r"\b(?:subtotal|sub-total|base imponible|net amount|neto)\b")
+TAX_LABEL = re.compile(r"\b(?:tax|vat|iva|igic)\b")
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+EU_DATE = re.compile(r"\b(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{4})\b")
+AMOUNT = re.compile(r"-?\d{1,3}(?:[.,\s]\d{3})*(?:[.,]\d{1,2})?(?!\d)|-?\d+(?:[.,]\d{1,2})?(?!\d)")
+NUMERIC_CELL = re.compile(r"^-?(?:\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,]\d+)?$")
+CELL_SPLIT = re.compile(r"\S+(?: \S+)*")
+CURRENCIES = (("€", "EUR"), ("eur", "EUR"), ("usd", "USD"), ("$", "USD"), ("£", "GBP"), ("gbp", "GBP"))
+
+# Item table header keywords, keyed by the LineItem field they map to
+HEADER_KEYWORDS = {
+    "description": ("description", "descripcion", "concepto", "item", "articulo", "producto", "servicio"),
+    "quantity": ("qty", "quantity", "cantidad", "cant", "uds", "units", "unidades"),
+    "unit_price": ("unit price", "price", "precio", "p. unit", "rate", "tarifa"),
+    "total": ("amount", "total", "importe", "subtotal", "line total"),
+}
+
+def _fold_char(char):
+    base = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+    return base.lower() if len(base) == 1 else char.lower()
+
+def _fold(text):
+    """
+    Lower-cases and strips accents so labels match regardless of typography.
+    Keeps one character per input character, so match offsets apply to the raw line.
+    """
+    return "".join(_fold_char(c) for c in text)
+
+def _parse_amount(text):
+    text = text.replace("€", "").replace("$", "").replace("£", "").strip()
+    # '1,350' and '1.350' with exactly three trailing digits are thousands, not decimals
+    if re.fullmatch(r"-?\d{1,3}(?:[.,]\d{3})+", text):
+        return float(re.sub(r"[.,]", "", text))
+    return to_float(text.replace(" ", ""), None)
+
+def _cells(line):
+    """Splits a layout line into (start, end, text) cells separated by 2+ spaces."""
+    return [(m.start(), m.end(), m.group()) for m in CELL_SPLIT.finditer(line)]
+
+def _is_numeric(cell_text):
+    stripped = cell_text.replace("€", "").replace("$", "").replace("£", "").replace("%", "").strip()
+    return bool(NUMERIC_CELL.match(stripped))
+
+def extract_text_layer(content):
+    """Returns the layout-preserving text of a PDF, or None if it has no usable text layer."""
+    if PdfReader is None:
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        pages = [page.extract_text(extraction_mode="layout") for page in reader.pages[:TEXT_LAYER_MAX_PAGES]]
+    except Exception as e:
+        print(f"Text layer unavailable: {e}")
+        return None
+    text = "\n".join(pages)
+    if sum(1 for c in text if not c.isspace()) < TEXT_LAYER_MIN_CHARS:
+        return None
+    return text
+
+def _normalize_date(text):
+    match = ISO_DATE.search(text)
+    if match:
+        year, month, day = (int(g) for g in match.groups())
+    else:
+        match = EU_DATE.search(text)
+        if not match:
+            return None
+        day, month, year = (int(g) for g in match.groups())
+    try:
+        return datetime(year, month, day).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def _value_after_label(lines, index, label_match, parse):
+    """
+    Finds a labelled value: first on the same line after the label, then in the
+    cell of the next non-blank line closest to the label's column.
+    """
+    value = parse(lines[index][label_match.end():])
+    if value:
+        return value
+    column = label_match.start()
+    for next_line in lines[index + 1:index + 4]:
+        cells = _cells(next_line)
+        if not cells:
+            continue
+        start, end, text = min(cells, key=lambda cell: min(abs(cell[0] - column), abs(cell[1] - column)))
+        return parse(text)
+    return None
+
+def _first_cell(text):
+    """The first cell of text, unless it is another label ('DATE:')."""
+    cells = _cells(text)
+    if not cells or cells[0][2].endswith(":"):
+        return None
+    return cells[0][2].strip(" :")
+
+def _find_header(folded_lines):
+    """Returns (line index, {field: column centre}) for the item table header."""
+    for index, line in enumerate(folded_lines):
+        columns = {}
+        for start, end, text in _cells(line):
+            for field, keywords in HEADER_KEYWORDS.items():
+                if field not in columns and any(text.startswith(k) or text == k for k in keywords):
+                    columns[field] = (start + end) / 2
+                    break
+        if "description" in columns and len(columns) >= 3:
+            return index, columns
+    return None, None
+
+def _parse_item_row(cells, columns):
+    numeric = [(start, end, text) for start, end, text in cells if _is_numeric(text)]
+    words = [text for start, end, text in cells if not _is_numeric(text)]
+    if not words or not numeric:
+        return None
+    numeric_fields = sorted((centre, field) for field, centre in columns.items() if field != "description")
+    values = {}
+    if len(numeric) == len(numeric_fields):
+        for (start, end, text), (centre, field) in zip(numeric, numeric_fields):
+            values[field] = _parse_amount(text)
+    else:
+        for start, end, text in numeric:
+            centre, field = min(numeric_fields, key=lambda f: abs(f[0] - (start + end) / 2))
+            values.setdefault(field, _parse_amount(text))
+    if values.get("total") is None and values.get("unit_price") is None:
+        return None
+    quantity = values.get("quantity") or 1.0
+    unit_price = values.get("unit_price")
+    total = values.get("total")
+    if unit_price is None:
+        unit_price = total / quantity if quantity else total
+    return LineItem(" ".join(words), quantity, unit_price, total)
+
+def _parse_items(lines, folded_lines):
+    header_index, columns = _find_header(folded_lines)
+    if header_index is None:
+        return []
+    items = []
+    blank_run = 0
+    for line, folded in zip(lines[header_index + 1:], folded_lines[header_index + 1:]):
+        if not line.strip():
+            blank_run += 1
+            if items and blank_run > 3:
+                break
+            continue
+        blank_run = 0
+        if TOTAL_LABEL.search(folded) or SUBTOTAL_LABEL.search(folded) or TAX_LABEL.search(folded):
+            break
+        item = _parse_item_row(_cells(line), columns)
+        if item:
+            items.append(item)
+        elif items:
+            # Wrapped description continuing the previous row
+            items[-1].description = f"{items[-1].description} {line.strip()}"
+    return items
+
+def _last_amount(text):
+    amounts = [_parse_amount(m.group()) for m in AMOUNT.finditer(text)]
+    amounts = [a for a in amounts if a is not None]
+    return amounts[-1] if amounts else None
+
+def _close(a, b):
+    return a is not None and b is not None and abs(a - b) <= max(AMOUNT_TOLERANCE, abs(b) * 0.001)
+
+def parse_invoice_text(text):
+    """
+    Parses invoice fields out of a layout text layer with deterministic rules.
+
+    Returns:
+        tuple: (InvoiceData, confidence between 0 and 1)
+    """
+    lines = text.splitlines()
+    folded_lines = [_fold(line) for line in lines]
+    data = InvoiceData()
+    subtotal = tax = None
+
+    for index, folded in enumerate(folded_lines):
+        if data.invoice_number is None:
+            match = INVOICE_NUMBER_LABEL.search(folded) or HASH_NUMBER.search(folded)
+            if match:
+                # Take the original casing from the raw line
+                data.invoice_number = lines[index][match.start(1):match.end(1)].rstrip(".")
+        if data.date is None:
+            match = DATE_LABEL.search(folded)
+            if match:
+                data.date = _value_after_label(lines, index, match, _normalize_date)
+        if data.client_name is None:
+            match = CLIENT_LABEL.search(folded)
+            if match:
+                data.client_name = _value_after_label(lines, index, match, _first_cell)
+        if SUBTOTAL_LABEL.search(folded):
+            subtotal = _last_amount(folded[SUBTOTAL_LABEL.search(folded).end():])
+        elif TAX_LABEL.search(folded) and subtotal is not None and not TOTAL_LABEL.search(folded):
+            # Skip the rate ('Tax (21%)') and take the amount
+            tax = _last_amount(re.sub(r"\d+(?:[.,]\d+)?\s*%", "", folded))
+        elif TOTAL_LABEL.search(folded):
+            amount = _last_amount(folded[TOTAL_LABEL.search(folded).end():])
+            if amount is not None:
+                data.total_amount = amount # The last total line is the grand total
+
+    if data.date is None:
+        data.date = _normalize_date(text)
+    folded_text = "\n".join(folded_lines)
+    data.currency = next((code for marker, code in CURRENCIES if marker in folded_text), None)
+    data.items = _parse_items(lines, folded_lines)
+    if data.client_name:
+        data.client_address = _client_address(lines, data.client_name)
+
+    return data, _confidence(data, subtotal, tax)
+
+def _client_address(lines, client_name):
+    """The next non-blank cell under the client name, if it is not another label or value."""
+    for index, line in enumerate(lines):
+        column = line.find(client_name)
+        if column < 0:
+            continue
+        for next_line in lines[index + 1:index + 3]:
+            cells = [cell for cell in _cells(next_line) if abs(cell[0] - column) <= 4]
+            if cells:
+                text = cells[0][2]
+                folded = _fold(text)
+                if ":" in text or _normalize_date(text) or TOTAL_LABEL.search(folded) or HEADER_KEYWORDS["description"][0] in folded:
+                    return None
+                return text
+        return None
+    return None
+
+def _confidence(data, subtotal, tax):
+    checks = {
+        "client_name": bool(data.client_name),
+        "invoice_number": bool(data.invoice_number),
+        "date": bool(data.date),
+        "total_amount": data.total_amount is not None,
+        "items": bool(data.items),
+        "items_consistent": bool(data.items) and all(
+            _close(item.quantity * item.unit_price, item.total) for item in data.items
+        ),
+        "totals_reconcile": bool(data.items) and (
+            _close(data.items_total, data.total_amount)
+            or _close(data.items_total, subtotal) and (
+                tax is None and subtotal == data.total_amount
+                or _close(data.items_total + (tax or 0), data.total_amount)
+            )
+        ),
+    }
+    return sum(weight for name, weight in CONFIDENCE_WEIGHTS.items() if checks[name])
+
+def extract_local(content):
+    """
+    Parses a digital PDF without calling the model.
+
+    Returns:
+        tuple: (InvoiceData or None, confidence). None means the PDF has no text layer.
+    """
+    text = extract_text_layer(content)
+    if text is None:
+        return None, 0.0
+    return parse_invoice_text(text)
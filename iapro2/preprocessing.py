@@ -0,0 +1,280 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+import numpy as np
+from PIL import Image, ImageChops, ImageOps
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError: # PDF recompression is skipped without pypdf
+    PdfReader = PdfWriter = None
+
+# Images: long side in pixels after downscaling and JPEG quality for re-encoding.
+# 1600 px keeps printed invoice text legible while cutting phone photos ~8x.
+IMAGE_MAX_SIDE = 1600
+IMAGE_JPEG_QUALITY = 80
+# Pixels within this grey-level distance of the corner colour count as background when cropping
+CROP_BACKGROUND_THRESHOLD = 40
+CROP_MARGIN_PX = 16
+# PDFs smaller than this are sent untouched; larger ones get their embedded images re-encoded
+PDF_RECOMPRESS_MIN_BYTES = 1024 * 1024
+PDF_IMAGE_MAX_SIDE = 1600
+PDF_IMAGE_JPEG_QUALITY = 70
+
+# Audio: speech needs little bandwidth. Voice notes are reduced to mono 16 kHz with
+# leading/trailing silence trimmed, then Opus-encoded when ffmpeg is available
+# (otherwise written as 16-bit PCM WAV, which handles WAV input only).
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_SILENCE_THRESHOLD_DB = -45.0
+AUDIO_SILENCE_FRAME_SECONDS = 0.02
+AUDIO_SILENCE_PAD_SECONDS = 0.2
+AUDIO_OPUS_BITRATE = "24k"
+AUDIO_FFMPEG_TIMEOUT_SECONDS = 120
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+_stats_lock = threading.Lock()
+_stats = {"documents": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+
+class PreprocessResult:
+    """Payload to send upstream plus per-stage timings (seconds) and byte counts."""
+    __slots__ = ("content", "mime_type", "original_bytes", "stages")
+
+    def __init__(self, content, mime_type, original_bytes, stages=None):
+        self.content = content
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.stages = stages or {}
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.content)
+
+    @property
+    def seconds(self):
+        return sum(self.stages.values())
+
+    def summary(self):
+        return {
+            "mime_type": self.mime_type,
+            "original_bytes": self.original_bytes,
+            "bytes": len(self.content),
+            "bytes_saved": self.bytes_saved,
+            "stages": dict(self.stages),
+        }
+
+class _StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.stages[name] = time.perf_counter() - start
+        return result
+
+def _crop_to_content(image):
+    """Crops uniform borders (desk, scanner bed) that match the top-left corner colour."""
+    background = Image.new("L", image.size, image.getpixel((0, 0)))
+    mask = ImageChops.difference(image, background).point(lambda p: 255 if p > CROP_BACKGROUND_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    box = (
+        max(0, left - CROP_MARGIN_PX),
+        max(0, top - CROP_MARGIN_PX),
+        min(image.width, right + CROP_MARGIN_PX),
+        min(image.height, bottom + CROP_MARGIN_PX),
+    )
+    return image.crop(box) if box != (0, 0, image.width, image.height) else image
+
+def _decode(content, max_side):
+    image = Image.open(io.BytesIO(content))
+    # Let the JPEG decoder skip detail we would throw away when downscaling,
+    # while keeping the long side at or above max_side
+    scale = max_side / max(image.size)
+    if scale < 1:
+        image.draft("L", (int(image.width * scale), int(image.height * scale)))
+    image.load()
+    return image
+
+def _downscale(image, max_side):
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+    return image
+
+def _encode_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def preprocess_image(content):
+    """Grayscales, auto-orients, crops, downscales and re-encodes an image as JPEG."""
+    timer = _StageTimer()
+    image = timer.run("decode", _decode, content, IMAGE_MAX_SIDE)
+    image = timer.run("grayscale", lambda img: img.convert("L"), image)
+    image = timer.run("orient", ImageOps.exif_transpose, image)
+    image = timer.run("crop", _crop_to_content, image)
+    image = timer.run("downscale", _downscale, image, IMAGE_MAX_SIDE)
+    encoded = timer.run("encode", _encode_jpeg, image, IMAGE_JPEG_QUALITY)
+    return encoded, "image/jpeg", timer.stages
+
+def preprocess_pdf(content):
+    """Re-encodes embedded page images and compresses content streams of large PDFs."""
+    timer = _StageTimer()
+    reader = timer.run("parse", lambda: PdfReader(io.BytesIO(content)))
+    writer = PdfWriter(clone_from=reader)
+
+    def recompress():
+        for page in writer.pages:
+            for embedded in page.images:
+                image = _downscale(embedded.image.convert("L"), PDF_IMAGE_MAX_SIDE)
+                embedded.replace(image, quality=PDF_IMAGE_JPEG_QUALITY)
+            page.compress_content_streams()
+
+    timer.run("recompress", recompress)
+
+    def write():
+        buffer = io.BytesIO()
+        writer.compress_identical_objects()
+        writer.write(buffer)
+        return buffer.getvalue()
+
+    encoded = timer.run("write", write)
+    return encoded, "application/pdf", timer.stages
+
+def _read_wav(content):
+    """Decodes PCM WAV bytes into (float32 samples shaped [frames, channels] in -1..1, sample rate)."""
+    with wave.open(io.BytesIO(content)) as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        bytes3 = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        ints = (bytes3[:, 0].astype(np.int32) | (bytes3[:, 1].astype(np.int32) << 8) | (bytes3[:, 2].astype(np.int32) << 16))
+        samples = np.where(ints >= 1 << 23, ints - (1 << 24), ints).astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+    return samples.reshape(-1, channels), rate
+
+def _resample(samples, rate, target_rate):
+    """Linear-interpolation resampling of a mono signal."""
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    duration = len(samples) / rate
+    target_positions = np.arange(int(duration * target_rate)) / target_rate
+    return np.interp(target_positions, np.arange(len(samples)) / rate, samples).astype(np.float32)
+
+def _trim_silence(samples, rate):
+    """Drops leading and trailing frames whose RMS level is below the silence threshold."""
+    frame = max(1, int(rate * AUDIO_SILENCE_FRAME_SECONDS))
+    usable = len(samples) // frame * frame
+    if usable == 0:
+        return samples
+    rms = np.sqrt(np.mean(samples[:usable].reshape(-1, frame) ** 2, axis=1))
+    loud = np.nonzero(rms > 10 ** (AUDIO_SILENCE_THRESHOLD_DB / 20))[0]
+    if len(loud) == 0: # all quiet: leave it to the model rather than send nothing
+        return samples
+    pad = int(rate * AUDIO_SILENCE_PAD_SECONDS)
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(samples), (loud[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+def _write_wav(samples, rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+def _preprocess_wav(content):
+    timer = _StageTimer()
+    samples, rate = timer.run("decode", _read_wav, content)
+    mono = timer.run("downmix", lambda s: s.mean(axis=1), samples)
+    mono = timer.run("resample", _resample, mono, rate, AUDIO_SAMPLE_RATE)
+    mono = timer.run("trim", _trim_silence, mono, AUDIO_SAMPLE_RATE)
+    encoded = timer.run("encode", _write_wav, mono, AUDIO_SAMPLE_RATE)
+    return encoded, "audio/wav", timer.stages
+
+def _preprocess_audio_ffmpeg(content):
+    """Extracts the audio track, downmixes, resamples, trims silence and encodes Opus in one ffmpeg pass."""
+    trim = f"silenceremove=start_periods=1:start_threshold={AUDIO_SILENCE_THRESHOLD_DB}dB:start_silence={AUDIO_SILENCE_PAD_SECONDS}"
+    timer = _StageTimer()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Files rather than pipes: MP4/M4A containers may need seeking to find the audio track
+        source = os.path.join(tmp, "input")
+        target = os.path.join(tmp, "output.ogg")
+        with open(source, "wb") as f:
+            f.write(content)
+        command = [
+            FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y", "-i", source,
+            "-vn", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE),
+            # Trim the start, reverse, trim the (former) end, reverse back
+            "-af", f"{trim},areverse,{trim},areverse",
+            "-c:a", "libopus", "-b:a", AUDIO_OPUS_BITRATE, "-application", "voip",
+            target,
+        ]
+        timer.run("transcode", lambda: subprocess.run(
+            command, check=True, capture_output=True, timeout=AUDIO_FFMPEG_TIMEOUT_SECONDS))
+        with open(target, "rb") as f:
+            encoded = f.read()
+    return encoded, "audio/ogg", timer.stages
+
+def preprocess_audio(content, mime_type):
+    """Normalizes a voice note (mono, 16 kHz, silence trimmed, compressed) for upload."""
+    if FFMPEG_BINARY:
+        return _preprocess_audio_ffmpeg(content)
+    if mime_type in ("audio/wav", "audio/x-wav", "audio/wave"):
+        return _preprocess_wav(content)
+    return content, mime_type, {}
+
+def preprocess_document(content, mime_type):
+    """
+    Shrinks a document before upload. Unsupported types, failures and outputs that
+    are not smaller than the input fall back to the original bytes.
+
+    Returns:
+        PreprocessResult
+    """
+    stages = {}
+    try:
+        if mime_type.startswith("image/"):
+            encoded, new_mime_type, stages = preprocess_image(content)
+        elif mime_type.startswith("audio/") or mime_type == "video/mp4":
+            encoded, new_mime_type, stages = preprocess_audio(content, mime_type)
+        elif mime_type == "application/pdf" and PdfReader and len(content) >= PDF_RECOMPRESS_MIN_BYTES:
+            encoded, new_mime_type, stages = preprocess_pdf(content)
+        else:
+            encoded, new_mime_type = content, mime_type
+    except Exception as e:
+        print(f"Pre-processing skipped ({mime_type}): {e}")
+        encoded, new_mime_type = content, mime_type
+
+    if len(encoded) >= len(content):
+        encoded, new_mime_type = content, mime_type
+
+    result = PreprocessResult(encoded, new_mime_type, len(content), stages)
+    with _stats_lock:
+        _stats["documents"] += 1
+        _stats["bytes_in"] += len(content)
+        _stats["bytes_out"] += len(encoded)
+        _stats["seconds"] += result.seconds
+    return result
+
+def get_preprocessing_stats():
+    """Returns documents processed, bytes in/out and total pre-processing time for this process."""
+    with _stats_lock:
+        return dict(_stats)
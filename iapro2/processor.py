@@ -2,127 +2,904 @@ import google.generativeai as genai
 import os
 import json
 import ast
+import hashlib
+import random
+import threading
+import time
+import zipfile
+import io
+import statistics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from google.api_core import exceptions as api_exceptions
+import database as db
+from invoice_data import InvoiceData
+import preprocessing
+import pdf_text
+import reconciliation
+
+EXTRACTION_MODEL = 'gemini-2.5-flash'
+
+# Static instructions are sent as the model's system instruction; each call only
+# carries the document plus a one-line request.
+AUDIO_SYSTEM_PROMPT = """
+You are an expert financial assistant processing a voice note for an invoice.
+The request gives TODAY'S DATE.
+
+Crucial: Extract only the following key details relative to the service provided:
+1. CLIENT NAME (Who is the invoice for?)
+2. ITEMS/SERVICES (What was provided? quantity? price per unit?)
+3. TOTAL AMOUNT (If manually stated, otherwise assume unit_price * quantity)
+4. DATE (If explicitly mentioned, use it. If NOT mentioned, use TODAY'S DATE)
+
+Output strict JSON:
+{
+    "client_name": "Name of Client",
+    "date": "YYYY-MM-DD",
+    "invoice_number": null,
+    "items": [
+        {
+            "description": "Clear description of service/product",
+            "quantity": number (default 1),
+            "unit_price": number,
+            "total": number
+        }
+    ],
+    "total_amount": number
+}
+
+Ignore conversational filler. If the user says "factura para Pepsi", the client is Pepsi.
+"""
+
+DOCUMENT_SYSTEM_PROMPT = """
+You are an expert financial assistant. Analyze this document (invoice or delivery note).
+Extract the following information in strict JSON format:
+- invoice_number (string, if available)
+- date (string, YYYY-MM-DD)
+- client_name (string, vendor or bill to depending on context)
+- client_address (string)
+- items (list of objects with 'description', 'quantity', 'unit_price', 'total')
+- total_amount (number)
+- currency (string)
+
+If a field is missing, use null. do not include markdown code fence blocks.
+"""
+
+COMPARISON_SYSTEM_PROMPT = """
+Compare the Invoice text with the Delivery Note text given in the request.
+Identify any discrepancies in items, quantities, or prices.
+Output a summary of discrepancies or "No discrepancies found".
+"""
+
+# Reconciliation runs locally; the model only pairs line items that fuzzy description
+# matching could not resolve (different wording, abbreviations, supplier codes).
+ITEM_MATCHING_SYSTEM_PROMPT = """
+You pair line items between an invoice and a delivery note. The request lists the
+unpaired invoice items and delivery note items, each with its index.
+Return only pairs that clearly refer to the same product or service; leave the rest out.
+"""
+
+ITEM_MATCHING_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "OBJECT",
+        "properties": {
+            "pairs": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "invoice_item": {"type": "INTEGER"},
+                        "delivery_item": {"type": "INTEGER"}
+                    },
+                    "required": ["invoice_item", "delivery_item"]
+                }
+            }
+        },
+        "required": ["pairs"]
+    }
+}
+
+# Declared response schema: the model must reply with JSON matching it, so replies
+# parse on the first attempt instead of being repaired heuristically.
+INVOICE_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "invoice_number": {"type": "STRING", "nullable": True},
+        "date": {"type": "STRING", "nullable": True, "description": "YYYY-MM-DD"},
+        "client_name": {"type": "STRING", "nullable": True},
+        "client_address": {"type": "STRING", "nullable": True},
+        "currency": {"type": "STRING", "nullable": True},
+        "items": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "description": {"type": "STRING"},
+                    "quantity": {"type": "NUMBER"},
+                    "unit_price": {"type": "NUMBER"},
+                    "total": {"type": "NUMBER"}
+                },
+                "required": ["description", "quantity", "unit_price", "total"]
+            }
+        },
+        "total_amount": {"type": "NUMBER", "nullable": True}
+    },
+    "required": ["client_name", "date", "items", "total_amount"]
+}
+
+EXTRACTION_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": INVOICE_RESPONSE_SCHEMA
+}
+
+# Explicit context caching only pays off (and is only accepted by the API) for
+# large static prefixes; shorter instructions go out as plain system instructions.
+CONTEXT_CACHE_MIN_TOKENS = 1024
+CONTEXT_CACHE_TTL = "3600s"
+
+# Extraction cache: results are keyed by the file's SHA-256, MIME type, model and
+# prompt version. Bump PROMPT_VERSION whenever the prompts change.
+PROMPT_VERSION = 4
+EXTRACTION_CACHE_TTL_SECONDS = 30 * 24 * 3600
+EXTRACTION_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_stats_lock = threading.Lock()
+
+# Extraction paths: digital PDFs are parsed locally from their text layer and only go
+# to Gemini when the rules are not confident. Recent latencies are kept per path.
+PATH_LATENCY_SAMPLES = 500
+_path_counts = {"local": 0, "gemini": 0, "fallback": 0}
+_path_latencies = {"local": deque(maxlen=PATH_LATENCY_SAMPLES), "gemini": deque(maxlen=PATH_LATENCY_SAMPLES)}
+_path_stats_lock = threading.Lock()
+
+# Gemini client state: configured once per API key, model handles reused across calls
+_client_lock = threading.Lock()
+_configured_key = None
+_models = {}
+
+# Gemini call scheduling: shared rate limits, retries and circuit breaker
+GEMINI_REQUESTS_PER_MINUTE = 60
+GEMINI_TOKENS_PER_MINUTE = 250_000
+GEMINI_MAX_RETRIES = 4
+GEMINI_BACKOFF_BASE_SECONDS = 1.0
+GEMINI_BACKOFF_MAX_SECONDS = 30.0
+GEMINI_CALL_DEADLINE_SECONDS = 120.0
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30.0
+EXTRACTION_ESTIMATED_TOKENS = 2000
+RETRYABLE_EXCEPTIONS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+    TimeoutError,
+    ConnectionError,
+)
+RETRYABLE_STATUS_CODES = (429, 500, 503, 504)
+
+# Batch ingestion
+BATCH_MAX_WORKERS = 4
+BATCH_MAX_ZIP_MEMBERS = 500
+BATCH_MAX_DOCUMENT_BYTES = 25 * 1024 * 1024
+MIME_TYPES_BY_EXTENSION = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".pdf": "application/pdf",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".m4a": "audio/mp4",
+    ".mp4": "video/mp4",
+}
 
 def configure_gemini(api_key):
-    """Configures the Gemini API with the provided key."""
+    """Configures the Gemini API with the provided key. Repeat calls with the same key are no-ops."""
+    global _configured_key
     if not api_key:
         return False
+    with _client_lock:
+        if api_key == _configured_key:
+            return True
+        try:
+            genai.configure(api_key=api_key)
+            _configured_key = api_key
+            _models.clear() # Handles are bound to the previous key
+            return True
+        except Exception as e:
+            print(f"Error configuring Gemini: {e}")
+            return False
+
+def _create_cached_model(model_name, system_instruction, generation_config):
+    """Returns a model backed by explicit cached content, or None when the API declines it."""
+    if len(system_instruction) // 4 < CONTEXT_CACHE_MIN_TOKENS:
+        return None
     try:
-        genai.configure(api_key=api_key)
+        cached_content = genai.caching.CachedContent.create(
+            model=model_name,
+            system_instruction=system_instruction,
+            ttl=CONTEXT_CACHE_TTL
+        )
+        return genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+    except Exception as e:
+        print(f"Context caching unavailable, using system instruction: {e}")
+        return None
+
+def get_model(system_instruction, model_name=EXTRACTION_MODEL, generation_config=None):
+    """Returns a reusable model handle for a (model, system instruction, generation config) triple."""
+    key = (model_name, system_instruction, json.dumps(generation_config, sort_keys=True))
+    with _client_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _create_cached_model(model_name, system_instruction, generation_config) or genai.GenerativeModel(
+                model_name, system_instruction=system_instruction, generation_config=generation_config
+            )
+            _models[key] = model
+        return model
+
+class CircuitOpenError(Exception):
+    """Raised without calling Gemini while the circuit breaker is open."""
+
+class TokenBucket:
+    """Refills rate_per_minute units per minute up to capacity; acquire() waits until enough are available."""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._available = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1, deadline=None):
+        """Takes amount units, sleeping as needed. Returns False if that would pass the deadline."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._available = min(self.capacity, self._available + (now - self._updated) * self.rate_per_second)
+                self._updated = now
+                if self._available >= amount:
+                    self._available -= amount
+                    return True
+                wait = (amount - self._available) / self.rate_per_second
+            if deadline is not None and now + wait > deadline:
+                return False
+            self._sleep(wait)
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures and lets a single trial call through after a cool-down."""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and self._clock() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def release_trial(self):
+        """Ends a half-open trial without a verdict; the next call becomes the trial."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self._opened_at = self._clock()
+
+def is_retryable(error):
+    """True for rate limits, timeouts and transient upstream errors."""
+    if isinstance(error, RETRYABLE_EXCEPTIONS):
         return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+class GeminiScheduler:
+    """
+    Shared pacing and resilience for Gemini calls: request and token buckets,
+    jittered exponential backoff on retryable errors, a per-call deadline and a
+    circuit breaker that fails fast while the upstream is down.
+    """
+
+    def __init__(self, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, tokens_per_minute=GEMINI_TOKENS_PER_MINUTE,
+                 max_retries=GEMINI_MAX_RETRIES, backoff_base=GEMINI_BACKOFF_BASE_SECONDS,
+                 backoff_max=GEMINI_BACKOFF_MAX_SECONDS, deadline_seconds=GEMINI_CALL_DEADLINE_SECONDS,
+                 breaker=None, clock=time.monotonic, sleep=time.sleep):
+        self.requests = TokenBucket(requests_per_minute, clock=clock, sleep=sleep)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock, sleep=sleep)
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline_seconds = deadline_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._metrics = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "rejected": 0, "throttled_seconds": 0.0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def call(self, fn, estimated_tokens=1, deadline_seconds=None):
+        """
+        Runs fn(timeout_seconds) under the rate limits, retrying retryable errors.
+
+        Raises:
+            CircuitOpenError: the upstream is considered down.
+            TimeoutError: the deadline passed while waiting for capacity or between retries.
+        """
+        deadline = self._clock() + (deadline_seconds or self.deadline_seconds)
+        self._count("calls")
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                # Rejected calls are failures too; "rejected" says how many never reached Gemini
+                self._count("rejected")
+                self._count("failures")
+                raise CircuitOpenError("Gemini is temporarily unavailable; try again shortly.")
+
+            # An attempt that ends without reaching Gemini, or with a bad request that says
+            # nothing about upstream health, hands a half-open trial back to the next call
+            verdict = False
+            try:
+                waited_from = self._clock()
+                if not (self.requests.acquire(1, deadline) and self.tokens.acquire(estimated_tokens, deadline)):
+                    self._count("failures")
+                    raise TimeoutError("Deadline exceeded while waiting for Gemini rate limit capacity.")
+                self._count("throttled_seconds", self._clock() - waited_from)
+
+                try:
+                    result = fn(max(0.0, deadline - self._clock()))
+                except Exception as e:
+                    if not is_retryable(e):
+                        self._count("failures")
+                        raise
+                    self.breaker.record_failure()
+                    verdict = True
+                    attempt += 1
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                    if attempt > self.max_retries or self._clock() + delay >= deadline:
+                        self._count("failures")
+                        raise
+                    self._count("retries")
+                    self._sleep(delay)
+                    continue
+
+                self.breaker.record_success()
+                verdict = True
+                self._count("successes")
+                return result
+            finally:
+                if not verdict:
+                    self.breaker.release_trial()
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics.update(circuit_state=self.breaker.state, circuit_opens=self.breaker.opens)
+        return metrics
+
+_scheduler = GeminiScheduler()
+
+def get_scheduler():
+    return _scheduler
+
+def get_scheduler_metrics():
+    """Returns call, retry, throttling and circuit breaker counters for the shared scheduler."""
+    return _scheduler.metrics()
+
+def _generate(model, contents, stream=False, estimated_tokens=EXTRACTION_ESTIMATED_TOKENS):
+    """Calls model.generate_content through the shared scheduler."""
+    def attempt(timeout):
+        if isinstance(model, genai.GenerativeModel):
+            return model.generate_content(contents, stream=stream, request_options={"timeout": timeout})
+        # Local fakes only need to implement generate_content(contents[, stream])
+        return model.generate_content(contents, stream=True) if stream else model.generate_content(contents)
+    return _scheduler.call(attempt, estimated_tokens=estimated_tokens)
+
+def _normalize_mime_type(mime_type):
+    if mime_type == "video/mp4":
+        return "audio/mp4" # Force audio processing for MP4 voice notes
+    return mime_type
+
+def extraction_cache_key(content, mime_type, current_date=None):
+    """
+    Builds the content-addressed cache key for an extraction request.
+    The audio prompt embeds today's date, so audio keys include it too.
+    """
+    mime_type = _normalize_mime_type(mime_type)
+    parts = [hashlib.sha256(content).hexdigest(), mime_type, EXTRACTION_MODEL, str(PROMPT_VERSION)]
+    if mime_type.startswith("audio/"):
+        parts.append(current_date or datetime.now().strftime("%Y-%m-%d"))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+def get_extraction_cache_stats():
+    """Returns this process's hit/miss counters plus the persisted cache summary."""
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    stats.update(db.get_extraction_cache_summary())
+    return stats
+
+def _record_path(path, seconds, fallback=False):
+    with _path_stats_lock:
+        _path_counts[path] += 1
+        _path_counts["fallback"] += fallback
+        _path_latencies[path].append(seconds)
+
+def get_extraction_path_stats():
+    """Returns local/Gemini extraction counts, the PDF fallback ratio and median latency per path."""
+    with _path_stats_lock:
+        stats = dict(_path_counts)
+        latencies = {path: list(samples) for path, samples in _path_latencies.items()}
+    local_attempts = stats["local"] + stats["fallback"]
+    stats["fallback_ratio"] = stats["fallback"] / local_attempts if local_attempts else 0.0
+    for path, samples in latencies.items():
+        stats[f"{path}_p50_ms"] = statistics.median(samples) * 1000 if samples else None
+    return stats
+
+def _extract_local(content, mime_type):
+    """
+    Returns (InvoiceData or None, attempted). The result is None when the document
+    is not a digital PDF or the rule-based parse is below LOCAL_MIN_CONFIDENCE.
+    """
+    if mime_type != "application/pdf":
+        return None, False
+    try:
+        data, confidence = pdf_text.extract_local(content)
     except Exception as e:
-        print(f"Error configuring Gemini: {e}")
-        return False
+        print(f"Local extraction failed: {e}")
+        return None, True
+    if data is None or confidence < pdf_text.LOCAL_MIN_CONFIDENCE:
+        return None, True
+    return data, True
 
-def extract_invoice_data(content, mime_type="image/jpeg"):
+def extract_invoice_data(content, mime_type="image/jpeg", use_cache=True, model=None, preprocess=True, local_first=True):
     """
     Uses Gemini 2.5 Flash to extract structured data from an invoice image or audio.
+    Identical inputs are served from the persistent extraction cache.
     
     Args:
         content: Raw bytes of the file.
         mime_type: MIME type of the content.
+        use_cache: Read and write the extraction cache.
+        model: Optional object with generate_content() (defaults to a Gemini model).
+        preprocess: Shrink images, audio and large PDFs before upload (cache keys use the original bytes).
+        local_first: Parse digital PDFs from their text layer and call Gemini only on low confidence.
         
     Returns:
-        dict: Extracted data in JSON format.
+        InvoiceData on success, or {"error": message} on failure.
     """
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    mime_type = _normalize_mime_type(mime_type)
+    current_date = datetime.now().strftime("%Y-%m-%d")
+
+    cache_key, cached = _lookup_extraction(content, mime_type, current_date, use_cache)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    attempted = False
+    if local_first:
+        local, attempted = _extract_local(content, mime_type)
+        if local is not None:
+            _record_path("local", time.perf_counter() - start)
+            _store_extraction(cache_key, local)
+            return local
+
+    if preprocess:
+        prepared = preprocessing.preprocess_document(content, mime_type)
+        result = _extract_with_gemini(prepared.content, prepared.mime_type, current_date, model)
+    else:
+        result = _extract_with_gemini(content, mime_type, current_date, model)
+    _record_path("gemini", time.perf_counter() - start, fallback=attempted)
+
+    _store_extraction(cache_key, result)
+    return result
+
+def _lookup_extraction(content, mime_type, current_date, use_cache):
+    """Returns (cache_key, cached_result); both are None when caching is off."""
+    if not use_cache:
+        return None, None
+    cache_key = extraction_cache_key(content, mime_type, current_date)
+    cached = db.get_cached_extraction(cache_key)
+    with _cache_stats_lock:
+        _cache_stats["hits" if cached is not None else "misses"] += 1
+    return cache_key, InvoiceData.from_dict(cached) if cached is not None else None
+
+def _store_extraction(cache_key, result):
+    if cache_key and isinstance(result, InvoiceData):
+        db.put_cached_extraction(cache_key, result.to_dict(), EXTRACTION_CACHE_TTL_SECONDS, EXTRACTION_CACHE_MAX_BYTES)
+
+def stream_invoice_data(content, mime_type="image/jpeg", use_cache=True, model=None, preprocess=True, local_first=True):
+    """
+    Streaming variant of extract_invoice_data that reports fields as soon as they are complete.
+
+    Yields:
+        tuple: (kind, key, value) events:
+            ("prepared", None, summary) with pre-processing byte counts and stage timings,
+            ("field", name, value) for each top-level field,
+            ("item", index, item) for each line item,
+            ("done", None, invoice) with the validated InvoiceData, or
+            ("error", None, message) if extraction failed.
+    """
+    mime_type = _normalize_mime_type(mime_type)
+    current_date = datetime.now().strftime("%Y-%m-%d")
+
+    cache_key, cached = _lookup_extraction(content, mime_type, current_date, use_cache)
+    if cached is not None:
+        yield from _replay_events(cached.to_dict())
+        yield ("done", None, cached)
+        return
+
+    start = time.perf_counter()
+    attempted = False
+    if local_first:
+        local, attempted = _extract_local(content, mime_type)
+        if local is not None:
+            _record_path("local", time.perf_counter() - start)
+            _store_extraction(cache_key, local)
+            yield from _replay_events(local.to_dict())
+            yield ("done", None, local)
+            return
+
+    if preprocess:
+        prepared = preprocessing.preprocess_document(content, mime_type)
+        yield ("prepared", None, prepared.summary())
+        content, mime_type = prepared.content, prepared.mime_type
+
+    system_instruction, contents = _extraction_request(content, mime_type, current_date)
+    parser = IncrementalInvoiceParser()
+    try:
+        model = model or get_model(system_instruction, generation_config=EXTRACTION_GENERATION_CONFIG)
+        for chunk in _generate(model, contents, stream=True):
+            for event in parser.feed(chunk.text):
+                yield event
+        data = parser.close()
+        invoice = InvoiceData.from_dict(data)
+    except Exception as e:
+        _record_path("gemini", time.perf_counter() - start, fallback=attempted)
+        yield ("error", None, str(e))
+        return
+    _record_path("gemini", time.perf_counter() - start, fallback=attempted)
+
+    # Anything the incremental pass could not emit (e.g. after a tolerant fallback parse)
+    yield from _replay_events(data, skip_fields=parser.emitted_fields, skip_items=parser.emitted_items)
+    _store_extraction(cache_key, invoice)
+    yield ("done", None, invoice)
+
+def _replay_events(data, skip_fields=(), skip_items=0):
+    if not isinstance(data, dict):
+        return
+    for key, value in data.items():
+        if key == "items" and isinstance(value, list):
+            for index, item in enumerate(value[skip_items:], start=skip_items):
+                yield ("item", index, item)
+        elif key not in skip_fields:
+            yield ("field", key, value)
+
+class IncrementalInvoiceParser:
+    """
+    Tolerant incremental parser for a streamed JSON invoice object.
+
+    feed() returns events for every top-level field whose value is complete and for
+    each entry of the 'items' array as soon as it closes. close() returns the full
+    result, falling back to _parse_json_response when the stream was not strict JSON.
+    """
+    _WHITESPACE = " \t\r\n"
+    # Characters that can follow a complete key or value
+    _VALUE_END = _WHITESPACE + ",:}]"
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._fields = {}
+        self.emitted_fields = set()
+        self.emitted_items = 0
+
+    def _skip(self, pos, extra=""):
+        chars = self._WHITESPACE + extra
+        while pos < len(self._buffer) and self._buffer[pos] in chars:
+            pos += 1
+        return pos
+
+    def _decode(self, pos):
+        """Decodes a complete JSON value at pos, or returns None if it may still be growing."""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, pos)
+        except json.JSONDecodeError:
+            return None
+        # A trailing number or literal could continue in the next chunk, and a number cut
+        # mid-way ('2021.' or '1e') decodes to its prefix: only a delimiter ends a value
+        if end >= len(self._buffer) or self._buffer[end] not in self._VALUE_END:
+            return None
+        return value, end
+
+    def feed(self, text):
+        """Adds a chunk of model output and returns the newly completed events."""
+        self._buffer += text
+        events = []
+        while self._step(events):
+            pass
+        return events
+
+    def _step(self, events):
+        buffer = self._buffer
+        if self._state == "start":
+            start = buffer.find("{", self._pos)
+            if start < 0:
+                return False
+            self._pos = start + 1
+            self._state = "key"
+            return True
+
+        if self._state == "key":
+            pos = self._skip(self._pos, ",")
+            if pos >= len(buffer):
+                return False
+            if buffer[pos] == "}":
+                self._state = "done"
+                return False
+            if buffer[pos] != '"':
+                self._state = "failed"
+                return False
+            decoded = self._decode(pos)
+            if decoded is None:
+                return False
+            key, end = decoded
+            colon = self._skip(end)
+            if colon >= len(buffer):
+                return False
+            if buffer[colon] != ":":
+                self._state = "failed"
+                return False
+            value_pos = self._skip(colon + 1)
+            if value_pos >= len(buffer):
+                return False
+            if key == "items" and buffer[value_pos] == "[":
+                self._fields["items"] = []
+                self._pos = value_pos + 1
+                self._state = "items"
+                return True
+            decoded = self._decode(value_pos)
+            if decoded is None:
+                return False
+            value, self._pos = decoded
+            self._fields[key] = value
+            self.emitted_fields.add(key)
+            events.append(("field", key, value))
+            return True
+
+        if self._state == "items":
+            pos = self._skip(self._pos, ",")
+            if pos >= len(buffer):
+                return False
+            if buffer[pos] == "]":
+                self._pos = pos + 1
+                self._state = "key"
+                return True
+            decoded = self._decode(pos)
+            if decoded is None:
+                return False
+            item, self._pos = decoded
+            self._fields["items"].append(item)
+            events.append(("item", self.emitted_items, item))
+            self.emitted_items += 1
+            return True
+
+        return False
+
+    def close(self):
+        """Returns the complete parsed invoice."""
+        if self._state == "done":
+            return self._fields
+        return _parse_json_response(self._buffer)
+
+def _parse_json_response(text):
+    """Parses a model reply into a dict, tolerating code fences and Python-style literals."""
+    text = text.strip()
     
-    if mime_type == "video/mp4":
-        mime_type = "audio/mp4" # Force audio processing for MP4 voice notes
-        
-    if mime_type.startswith("audio/") or mime_type == "audio/mp4":
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        prompt = f"""
-        You are an expert financial assistant processing a voice note for an invoice.
-        TODAY'S DATE: {current_date}
+    # Remove markdown code blocks if present
+    if "```json" in text:
+        text = text.split("```json")[1].split("```")[0].strip()
+    elif "```" in text:
+        text = text.split("```")[1].strip()
         
-        Crucial: Extract only the following three key details relative to the service provided:
-        1. CLIENT NAME (Who is the invoice for?)
-        2. ITEMS/SERVICES (What was provided? quantity? price per unit?)
-        3. TOTAL AMOUNT (If manually stated, otherwise assume unit_price * quantity)
-        4. DATE (If explicitly mentioned, use it. If NOT mentioned, use TODAY'S DATE: {current_date})
-
-        Output strict JSON:
-        {{
-            "client_name": "Name of Client",
-            "date": "YYYY-MM-DD",
-            "invoice_number": "DRAFT-00X",
-            "items": [
-                {{
-                    "description": "Clear description of service/product",
-                    "quantity": number (default 1),
-                    "unit_price": number,
-                    "total": number
-                }}
-            ],
-            "total_amount": number
-        }}
-        
-        Ignore conversational filler. If the user says "factura para Pepsi", the client is Pepsi.
-        """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # Fallback: Try analyzing as Python literal (handles single quotes/trailing commas)
+        try:
+            return ast.literal_eval(text)
+        except Exception:
+            raise ValueError(f"Could not parse response: {text[:100]}...")
+
+def _extraction_request(content, mime_type, current_date):
+    """Returns (system_instruction, contents) for an extraction call."""
+    if mime_type.startswith("audio/"):
+        system_instruction = AUDIO_SYSTEM_PROMPT
+        request = f"TODAY'S DATE: {current_date}. Extract the invoice from this voice note."
     else:
-        prompt = """
-        You are an expert financial assistant. Analyze this document (invoice or delivery note).
-        Extract the following information in strict JSON format:
-        - invoice_number (string, if available)
-        - date (string, YYYY-MM-DD)
-        - client_name (string, vendor or bill to depending on context)
-        - client_address (string)
-        - items (list of objects with 'description', 'quantity', 'unit_price', 'total')
-        - total_amount (number)
-        - currency (string)
-        
-        If a field is missing, use null. do not include markdown code fence blocks.
-        """
+        system_instruction = DOCUMENT_SYSTEM_PROMPT
+        request = "Extract the invoice data from this document."
+    return system_instruction, [{'mime_type': mime_type, 'data': content}, request]
+
+def _extract_with_gemini(content, mime_type, current_date, model=None):
+    """Sends the document to Gemini and parses the JSON reply."""
+    system_instruction, contents = _extraction_request(content, mime_type, current_date)
     
     try:
-        response = model.generate_content([
-            {'mime_type': mime_type, 'data': content},
-            prompt
-        ])
-        
-        # Clean response text to ensure valid JSON
-        text = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0].strip()
-        elif "```" in text:
-            text = text.split("```")[1].strip()
-            
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # Fallback: Try analyzing as Python literal (handles single quotes/trailing commas)
-            try:
-                return ast.literal_eval(text)
-            except Exception:
-                raise ValueError(f"Could not parse response: {text[:100]}...")
-                
+        model = model or get_model(system_instruction, generation_config=EXTRACTION_GENERATION_CONFIG)
+        response = _generate(model, contents)
+        return InvoiceData.from_dict(_parse_json_response(response.text))
     except Exception as e:
         return {"error": str(e)}
 
-def compare_documents(invoice_text, delivery_note_text):
+def guess_mime_type(filename):
+    """Returns the MIME type for a supported document name, or None."""
+    return MIME_TYPES_BY_EXTENSION.get(os.path.splitext(filename.lower())[1])
+
+def expand_documents(files):
     """
-    Uses Gemini to compare an invoice against a delivery note for discrepancies.
+    Flattens uploaded files and ZIP archives into extractable documents.
+
+    Args:
+        files: Iterable of (name, bytes) tuples.
+
+    Returns:
+        tuple: (documents, skipped) where documents are (name, bytes, mime_type)
+        tuples and skipped lists the names that were ignored.
     """
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
+    documents, skipped = [], []
+    for name, content in files:
+        if name.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                    members = [m for m in archive.infolist() if not m.is_dir() and not m.filename.startswith("__MACOSX/")]
+                    for member in members[:BATCH_MAX_ZIP_MEMBERS]:
+                        mime_type = guess_mime_type(member.filename)
+                        if not mime_type or member.file_size > BATCH_MAX_DOCUMENT_BYTES:
+                            skipped.append(f"{name}/{member.filename}")
+                            continue
+                        documents.append((f"{name}/{member.filename}", archive.read(member), mime_type))
+                    skipped.extend(f"{name}/{m.filename}" for m in members[BATCH_MAX_ZIP_MEMBERS:])
+            except zipfile.BadZipFile:
+                skipped.append(name)
+            continue
+
+        mime_type = guess_mime_type(name)
+        if mime_type and len(content) <= BATCH_MAX_DOCUMENT_BYTES:
+            documents.append((name, content, mime_type))
+        else:
+            skipped.append(name)
+    return documents, skipped
+
+def _extract_document(index, name, content, mime_type, use_cache, model, preprocess):
+    start = time.perf_counter()
+    try:
+        data = extract_invoice_data(content, mime_type, use_cache=use_cache, model=model, preprocess=preprocess)
+    except Exception as e:
+        data = {"error": str(e)}
+    failed = not isinstance(data, InvoiceData)
+    return {
+        "index": index,
+        "name": name,
+        "status": "error" if failed else "ok",
+        "data": None if failed else data,
+        "error": data.get("error", "Unexpected response") if failed else None,
+        "seconds": time.perf_counter() - start,
+    }
+
+def iter_batch_extraction(documents, max_workers=BATCH_MAX_WORKERS, use_cache=True, model=None, preprocess=True):
+    """
+    Extracts many documents concurrently, yielding one result per document as it completes.
+
+    Args:
+        documents: Iterable of (name, bytes, mime_type) tuples.
+        max_workers: Maximum number of concurrent Gemini calls.
+        use_cache: Read and write the extraction cache.
+        model: Optional object with generate_content() shared by all workers.
+        preprocess: Shrink images, audio and large PDFs before upload.
+
+    Yields:
+        dict: index (position in documents), name, status ('ok' or 'error'), data, error and seconds.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            executor.submit(_extract_document, index, name, content, mime_type, use_cache, model, preprocess)
+            for index, (name, content, mime_type) in enumerate(documents)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+def extract_batch(documents, max_workers=BATCH_MAX_WORKERS, use_cache=True, model=None, preprocess=True):
+    """Extracts many documents concurrently and returns the results in input order."""
+    results = iter_batch_extraction(documents, max_workers, use_cache, model, preprocess)
+    return sorted(results, key=lambda result: result["index"])
+
+def _document_text(document):
+    if isinstance(document, InvoiceData):
+        return json.dumps(document.to_dict(), ensure_ascii=False)
+    return document
+
+def match_items_with_gemini(invoice_descriptions, delivery_descriptions, model=None):
+    """
+    Asks Gemini to pair leftover line items. Used as the reconciliation resolver.
+
+    Returns:
+        list: (invoice index, delivery index) pairs; empty on failure.
+    """
+    request = "Invoice items:\n" + "\n".join(f"{i}: {text}" for i, text in enumerate(invoice_descriptions))
+    request += "\n\nDelivery note items:\n" + "\n".join(f"{i}: {text}" for i, text in enumerate(delivery_descriptions))
+    try:
+        model = model or get_model(ITEM_MATCHING_SYSTEM_PROMPT, generation_config=ITEM_MATCHING_GENERATION_CONFIG)
+        response = _generate(model, request, estimated_tokens=len(request) // 4 + 200)
+        pairs = _parse_json_response(response.text).get("pairs") or []
+        return [(int(p["invoice_item"]), int(p["delivery_item"])) for p in pairs]
+    except Exception as e:
+        print(f"Item matching failed: {e}")
+        return []
+
+def _resolver(use_llm, model):
+    if not use_llm:
+        return None
+    return lambda invoice_items, delivery_items: match_items_with_gemini(invoice_items, delivery_items, model)
+
+def compare_documents(invoice, delivery_note, use_llm=True, model=None):
+    """
+    Reconciles an invoice against a delivery note.
+
+    Extracted documents (InvoiceData or dicts) are compared locally with fuzzy description
+    matching and tolerances; Gemini is only asked to pair items left unresolved. Raw text
+    documents fall back to a free-text Gemini comparison.
+
+    Returns:
+        reconciliation.ReconciliationResult for extracted documents, otherwise text.
+    """
+    if isinstance(invoice, (InvoiceData, dict)) and isinstance(delivery_note, (InvoiceData, dict)):
+        return reconciliation.reconcile(invoice, delivery_note, resolver=_resolver(use_llm, model))
+
     prompt = f"""
-    Compare the following Invoice text with the Delivery Note text.
-    Identify any discrepancies in items, quantities, or prices.
-    
     Invoice:
-    {invoice_text}
+    {_document_text(invoice)}
     
     Delivery Note:
-    {delivery_note_text}
-    
-    Output a summary of discrepancies or "No discrepancies found".
+    {_document_text(delivery_note)}
     """
     try:
-        response = model.generate_content(prompt)
+        model = model or get_model(COMPARISON_SYSTEM_PROMPT)
+        response = _generate(model, prompt, estimated_tokens=len(prompt) // 4 + 500)
         return response.text
     except Exception as e:
         return f"Error during comparison: {e}"
+
+def reconcile_documents(invoices, delivery_notes, use_llm=True, model=None):
+    """
+    Bulk reconciliation of N invoices against M delivery notes (see reconciliation.reconcile_bulk).
+    Gemini is only called for item pairs the local matcher leaves unresolved.
+    """
+    return reconciliation.reconcile_bulk(invoices, delivery_notes, resolver=_resolver(use_llm, model))
@@ -0,0 +1,415 @@
+import functools
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+from difflib import SequenceMatcher
+from invoice_data import InvoiceData, LineItem
+
+# Line items match when their normalized descriptions are at least this similar
+DESCRIPTION_MATCH_THRESHOLD = 0.6
+QUANTITY_TOLERANCE = 0.001
+# Prices and totals: relative tolerance with an absolute floor of one cent
+PRICE_TOLERANCE = 0.01
+AMOUNT_TOLERANCE_FLOOR = 0.01
+
+# Bulk matching: a delivery note is attached to its best invoice scoring at least this
+DOCUMENT_MATCH_THRESHOLD = 0.5
+DOCUMENT_DATE_WINDOW_DAYS = 62
+# Document score adjustments: same client bonus, distance penalty (scaled over the
+# window) and a penalty for deliveries dated after the invoice
+DOCUMENT_CLIENT_BONUS = 0.2
+DOCUMENT_DATE_PENALTY = 0.2
+DOCUMENT_LATE_DELIVERY_PENALTY = 0.3
+# Description tokens shared by more than this share of delivery notes are too common to block on
+BLOCKING_MAX_TOKEN_SHARE = 0.2
+
+LEGAL_SUFFIXES = {"sl", "slu", "sa", "sau", "sll", "scp", "cb", "inc", "llc", "ltd", "gmbh", "bv", "srl", "sas", "plc", "co", "corp"}
+STOPWORDS = {"de", "del", "la", "el", "los", "las", "y", "en", "con", "para", "por", "the", "of", "and", "for", "with", "a"}
+
+def _fold(text):
+    normalized = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in normalized if not unicodedata.combining(c)).lower()
+
+def normalize_description(text):
+    """Lower-cased, accent-free description with punctuation collapsed and tokens sorted."""
+    tokens = re.findall(r"[a-z0-9]+", _fold(text))
+    return " ".join(sorted(t for t in tokens if t not in STOPWORDS))
+
+def normalize_client_name(name):
+    """Client key for blocking: accents, case, punctuation and legal suffixes removed."""
+    tokens = []
+    initials = False
+    for token in re.findall(r"[a-z0-9]+", _fold((name or "").replace(".", ""))):
+        # Spaced initials such as 'S. A. U.' become one token ('sau')
+        if len(token) == 1 and token.isalpha():
+            if initials:
+                tokens[-1] += token
+            else:
+                tokens.append(token)
+            initials = True
+        else:
+            tokens.append(token)
+            initials = False
+    while tokens and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+    return " ".join(tokens)
+
+# Catalogues repeat, so the same description pairs come up again and again in bulk runs
+@functools.lru_cache(maxsize=65536)
+def description_similarity(a, b):
+    """Similarity of two normalized descriptions (0-1); pairs that cannot reach the match threshold score 0."""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    # Cheap upper bounds first: most pairs in a bulk run are clearly unrelated
+    if matcher.real_quick_ratio() < DESCRIPTION_MATCH_THRESHOLD or matcher.quick_ratio() < DESCRIPTION_MATCH_THRESHOLD:
+        return 0.0
+    return matcher.ratio()
+
+def _close(a, b, relative):
+    return abs(a - b) <= max(AMOUNT_TOLERANCE_FLOOR, abs(b) * relative)
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+class Discrepancy:
+    """
+    One reconciliation finding.
+
+    kind is one of: 'missing_in_delivery' (invoiced, not delivered), 'not_invoiced'
+    (delivered, not invoiced), 'quantity', 'unit_price', 'total' (line totals differ)
+    or 'line_arithmetic' (invoice line where quantity x unit price != total).
+    """
+    __slots__ = ("kind", "description", "invoice_value", "delivery_value", "invoice_item", "delivery_item", "delivery_note")
+
+    def __init__(self, kind, description, invoice_value=None, delivery_value=None,
+                 invoice_item=None, delivery_item=None, delivery_note=None):
+        self.kind = kind
+        self.description = description
+        self.invoice_value = invoice_value
+        self.delivery_value = delivery_value
+        self.invoice_item = invoice_item
+        self.delivery_item = delivery_item
+        self.delivery_note = delivery_note
+
+    @property
+    def difference(self):
+        if self.invoice_value is None or self.delivery_value is None:
+            return None
+        return self.invoice_value - self.delivery_value
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "description": self.description,
+            "invoice_value": self.invoice_value,
+            "delivery_value": self.delivery_value,
+            "difference": self.difference,
+            "invoice_item": self.invoice_item,
+            "delivery_item": self.delivery_item,
+            "delivery_note": self.delivery_note,
+        }
+
+    def __repr__(self):
+        return f"Discrepancy({self.to_dict()!r})"
+
+class ReconciliationResult:
+    """Item matches and discrepancies between one invoice and its delivery note(s)."""
+    __slots__ = ("invoice", "delivery_notes", "matches", "discrepancies", "unresolved_invoice_items", "unresolved_delivery_items")
+
+    def __init__(self, invoice=None, delivery_notes=None):
+        self.invoice = invoice
+        self.delivery_notes = delivery_notes or []
+        self.matches = [] # (invoice item index, delivery item index, similarity, source)
+        self.discrepancies = []
+        self.unresolved_invoice_items = []
+        self.unresolved_delivery_items = []
+
+    @property
+    def ok(self):
+        return not self.discrepancies
+
+    def to_dict(self):
+        return {
+            "invoice": self.invoice,
+            "delivery_notes": list(self.delivery_notes),
+            "ok": self.ok,
+            "matches": [
+                {"invoice_item": i, "delivery_item": d, "similarity": round(score, 3), "source": source}
+                for i, d, score, source in self.matches
+            ],
+            "discrepancies": [d.to_dict() for d in self.discrepancies],
+        }
+
+    def summary(self):
+        """Human-readable lines, one per discrepancy."""
+        if self.ok:
+            return "No discrepancies found"
+        lines = []
+        for d in self.discrepancies:
+            if d.kind == "missing_in_delivery":
+                lines.append(f"{d.description}: invoiced ({d.invoice_value:g}) but not delivered")
+            elif d.kind == "not_invoiced":
+                lines.append(f"{d.description}: delivered ({d.delivery_value:g}) but not invoiced")
+            elif d.kind == "line_arithmetic":
+                lines.append(f"{d.description}: line total {d.invoice_value:,.2f} != quantity x price {d.delivery_value:,.2f}")
+            else:
+                lines.append(f"{d.description}: {d.kind} invoiced {d.invoice_value:g}, delivered {d.delivery_value:g}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"ReconciliationResult({self.to_dict()!r})"
+
+def _merge_delivery_items(delivery_items):
+    """
+    Sums quantities of identical descriptions across delivery notes (weekly deliveries
+    billed on one monthly invoice). Each entry: (normalized, LineItem, [(note, item index)]).
+    """
+    merged = {}
+    for note, index, item in delivery_items:
+        key = normalize_description(item.description)
+        if key in merged:
+            _, total_item, sources = merged[key]
+            total_item.quantity += item.quantity
+            total_item.total += item.total
+            sources.append((note, index))
+        else:
+            copy = LineItem(item.description, item.quantity, item.unit_price, item.total)
+            merged[key] = (key, copy, [(note, index)])
+    return list(merged.values())
+
+def match_items(invoice_keys, delivery_keys, threshold=DESCRIPTION_MATCH_THRESHOLD):
+    """
+    Greedy one-to-one assignment of items by description similarity: the most similar
+    pair first, ties broken by position, so results are deterministic.
+
+    Returns:
+        list: (invoice index, delivery index, similarity) tuples.
+    """
+    candidates = []
+    for i, a in enumerate(invoice_keys):
+        for d, b in enumerate(delivery_keys):
+            score = description_similarity(a, b)
+            if score >= threshold:
+                candidates.append((-score, i, d))
+    candidates.sort()
+    used_invoice, used_delivery, matches = set(), set(), []
+    for negative_score, i, d in candidates:
+        if i not in used_invoice and d not in used_delivery:
+            used_invoice.add(i)
+            used_delivery.add(d)
+            matches.append((i, d, -negative_score))
+    return matches
+
+def _compare_pair(result, invoice_index, item, delivery_index, delivered, sources):
+    note = sources[0][0] if len(sources) == 1 else [source[0] for source in sources]
+    quantity_ok = abs(item.quantity - delivered.quantity) <= QUANTITY_TOLERANCE
+    if not quantity_ok:
+        result.discrepancies.append(Discrepancy(
+            "quantity", item.description, item.quantity, delivered.quantity, invoice_index, delivery_index, note))
+    # Delivery notes often carry no prices; only compare what both documents state
+    if item.unit_price and delivered.unit_price:
+        if not _close(item.unit_price, delivered.unit_price, PRICE_TOLERANCE):
+            result.discrepancies.append(Discrepancy(
+                "unit_price", item.description, item.unit_price, delivered.unit_price, invoice_index, delivery_index, note))
+    elif quantity_ok and item.total and delivered.total and not _close(item.total, delivered.total, PRICE_TOLERANCE):
+        result.discrepancies.append(Discrepancy(
+            "total", item.description, item.total, delivered.total, invoice_index, delivery_index, note))
+
+def reconcile(invoice, delivery_notes, resolver=None, invoice_id=None, delivery_note_ids=None):
+    """
+    Deterministically reconciles an invoice against one or more delivery notes.
+
+    Args:
+        invoice: InvoiceData (or dict) of the invoice.
+        delivery_notes: InvoiceData (or dict), or a list of them, for the delivery note(s).
+        resolver: Optional callable(invoice_descriptions, delivery_descriptions) returning
+            extra (invoice index, delivery index) pairs for items the fuzzy match left
+            unresolved (e.g. an LLM). Only called when both sides have leftovers.
+        invoice_id, delivery_note_ids: Labels recorded in the result (default: positions).
+
+    Returns:
+        ReconciliationResult
+    """
+    if not isinstance(delivery_notes, (list, tuple)):
+        delivery_notes = [delivery_notes]
+    invoice = invoice if isinstance(invoice, InvoiceData) else InvoiceData.from_dict(invoice)
+    notes = [n if isinstance(n, InvoiceData) else InvoiceData.from_dict(n) for n in delivery_notes]
+    note_ids = list(delivery_note_ids) if delivery_note_ids is not None else list(range(len(notes)))
+    result = ReconciliationResult(invoice_id, note_ids)
+
+    for index, item in enumerate(invoice.items):
+        if item.unit_price and not _close(item.quantity * item.unit_price, item.total, PRICE_TOLERANCE):
+            result.discrepancies.append(Discrepancy(
+                "line_arithmetic", item.description, item.total, item.quantity * item.unit_price, index))
+
+    delivered = _merge_delivery_items(
+        (note_ids[n], index, item) for n, note in enumerate(notes) for index, item in enumerate(note.items)
+    )
+    invoice_keys = [normalize_description(item.description) for item in invoice.items]
+    delivery_keys = [key for key, _, _ in delivered]
+
+    pairs = [(i, d, score, "fuzzy") for i, d, score in match_items(invoice_keys, delivery_keys)]
+    left_invoice = [i for i in range(len(invoice_keys)) if i not in {p[0] for p in pairs}]
+    left_delivery = [d for d in range(len(delivery_keys)) if d not in {p[1] for p in pairs}]
+    if resolver and left_invoice and left_delivery:
+        extra = resolver(
+            [invoice.items[i].description for i in left_invoice],
+            [delivered[d][1].description for d in left_delivery],
+        )
+        taken_invoice, taken_delivery = set(), set()
+        for a, b in extra or []:
+            if 0 <= a < len(left_invoice) and 0 <= b < len(left_delivery) and a not in taken_invoice and b not in taken_delivery:
+                taken_invoice.add(a)
+                taken_delivery.add(b)
+                i, d = left_invoice[a], left_delivery[b]
+                pairs.append((i, d, description_similarity(invoice_keys[i], delivery_keys[d]), "resolver"))
+        left_invoice = [i for n, i in enumerate(left_invoice) if n not in taken_invoice]
+        left_delivery = [d for n, d in enumerate(left_delivery) if n not in taken_delivery]
+
+    for i, d, score, source in sorted(pairs):
+        _, delivered_item, sources = delivered[d]
+        result.matches.append((i, d, score, source))
+        _compare_pair(result, i, invoice.items[i], d, delivered_item, sources)
+    for i in left_invoice:
+        item = invoice.items[i]
+        result.discrepancies.append(Discrepancy("missing_in_delivery", item.description, item.quantity, None, i))
+    for d in left_delivery:
+        _, item, sources = delivered[d]
+        note = sources[0][0] if len(sources) == 1 else [source[0] for source in sources]
+        result.discrepancies.append(Discrepancy("not_invoiced", item.description, None, item.quantity, None, d, note))
+    result.unresolved_invoice_items = left_invoice
+    result.unresolved_delivery_items = left_delivery
+    return result
+
+class BulkReconciliation:
+    """Outcome of reconcile_bulk: per-invoice results plus what could not be paired."""
+    __slots__ = ("results", "unmatched_invoices", "unmatched_delivery_notes", "pairs_scored", "pairs_possible")
+
+    def __init__(self):
+        self.results = []
+        self.unmatched_invoices = []
+        self.unmatched_delivery_notes = []
+        self.pairs_scored = 0
+        self.pairs_possible = 0
+
+    @property
+    def discrepancies(self):
+        return [d for result in self.results for d in result.discrepancies]
+
+    def to_dict(self):
+        return {
+            "results": [result.to_dict() for result in self.results],
+            "unmatched_invoices": list(self.unmatched_invoices),
+            "unmatched_delivery_notes": list(self.unmatched_delivery_notes),
+            "pairs_scored": self.pairs_scored,
+            "pairs_possible": self.pairs_possible,
+        }
+
+def _document_tokens(document):
+    return {t for item in document.items for t in normalize_description(item.description).split() if len(t) > 2 and not t.isdigit()}
+
+def _candidate_pairs(invoices, notes):
+    """
+    Blocking step: only pairs sharing a client key, or a reasonably rare description
+    token, within the date window are scored.
+    """
+    by_client = defaultdict(set)
+    by_token = defaultdict(set)
+    for n, note in enumerate(notes):
+        client = normalize_client_name(note.client_name)
+        if client:
+            by_client[client].add(n)
+        for token in _document_tokens(note):
+            by_token[token].add(n)
+    max_share = max(1, int(len(notes) * BLOCKING_MAX_TOKEN_SHARE))
+
+    for i, invoice in enumerate(invoices):
+        candidates = set(by_client.get(normalize_client_name(invoice.client_name), ()))
+        for token in _document_tokens(invoice):
+            postings = by_token.get(token, ())
+            if len(postings) <= max_share:
+                candidates.update(postings)
+        invoice_date = _parse_date(invoice.date)
+        for n in sorted(candidates):
+            note_date = _parse_date(notes[n].date)
+            if invoice_date and note_date and abs((invoice_date - note_date).days) > DOCUMENT_DATE_WINDOW_DAYS:
+                continue
+            yield i, n
+
+def _document_score(invoice, note, invoice_keys, note_keys):
+    """
+    Share of the delivery note's items found on the invoice, adjusted for the client
+    and for how far (and on which side of the invoice) the delivery date falls.
+    """
+    if not note_keys:
+        return 0.0
+    matches = match_items(invoice_keys, note_keys)
+    score = sum(similarity for _, _, similarity in matches) / len(note_keys)
+    if normalize_client_name(invoice.client_name) == normalize_client_name(note.client_name):
+        score += DOCUMENT_CLIENT_BONUS
+    invoice_date, note_date = _parse_date(invoice.date), _parse_date(note.date)
+    if invoice_date and note_date:
+        days = (invoice_date - note_date).days
+        score -= DOCUMENT_DATE_PENALTY * min(abs(days), DOCUMENT_DATE_WINDOW_DAYS) / DOCUMENT_DATE_WINDOW_DAYS
+        if days < 0:
+            score -= DOCUMENT_LATE_DELIVERY_PENALTY
+    return score
+
+def reconcile_bulk(invoices, delivery_notes, resolver=None):
+    """
+    Matches N invoices against M delivery notes and reconciles each invoice with the
+    delivery notes attached to it. A delivery note is attached to the best-scoring
+    invoice among its blocking candidates; an invoice may collect several notes.
+
+    Args:
+        invoices: Dict of id -> InvoiceData, or a list (ids are positions).
+        delivery_notes: Dict of id -> InvoiceData, or a list.
+        resolver: Passed to reconcile() for items the fuzzy match leaves unresolved.
+
+    Returns:
+        BulkReconciliation
+    """
+    invoice_ids, invoice_docs = _ids_and_documents(invoices)
+    note_ids, note_docs = _ids_and_documents(delivery_notes)
+    invoice_keys = [[normalize_description(item.description) for item in doc.items] for doc in invoice_docs]
+    note_keys = [[normalize_description(item.description) for item in doc.items] for doc in note_docs]
+
+    outcome = BulkReconciliation()
+    outcome.pairs_possible = len(invoice_docs) * len(note_docs)
+    best = {}
+    for i, n in _candidate_pairs(invoice_docs, note_docs):
+        outcome.pairs_scored += 1
+        score = _document_score(invoice_docs[i], note_docs[n], invoice_keys[i], note_keys[n])
+        if score >= DOCUMENT_MATCH_THRESHOLD and (n not in best or score > best[n][0]):
+            best[n] = (score, i)
+
+    attached = defaultdict(list)
+    for n in sorted(best):
+        attached[best[n][1]].append(n)
+    for i, invoice in enumerate(invoice_docs):
+        notes = attached.get(i)
+        if not notes:
+            outcome.unmatched_invoices.append(invoice_ids[i])
+            continue
+        outcome.results.append(reconcile(
+            invoice, [note_docs[n] for n in notes], resolver=resolver,
+            invoice_id=invoice_ids[i], delivery_note_ids=[note_ids[n] for n in notes]
+        ))
+    outcome.unmatched_delivery_notes = [note_ids[n] for n in range(len(note_docs)) if n not in best]
+    return outcome
+
+def _ids_and_documents(documents):
+    if isinstance(documents, dict):
+        ids = list(documents)
+        docs = [documents[key] for key in ids]
+    else:
+        docs = list(documents)
+        ids = list(range(len(docs)))
+    return ids, [d if isinstance(d, InvoiceData) else InvoiceData.from_dict(d) for d in docs]
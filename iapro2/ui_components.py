@@ -1,5 +1,14 @@
+import html
 import streamlit as st
 
+# One transaction row; kept on a single line so markdown treats the whole list as one HTML block
+TRANSACTION_ROW_HTML = (
+    '<div class="t-row"><div class="t-icon">{initial}</div>'
+    '<div class="t-details"><span class="t-title">{client}</span><span class="t-sub">{date}</span></div>'
+    '<div class="t-right"><div class="t-amount">€{amount:,.2f}</div>'
+    '<span class="status-badge status-{status_class}">{status}</span></div></div>'
+)
+
 def setup_page():
     """Sets up the page configuration and custom Fintech CSS."""
     st.set_page_config(
@@ -130,30 +139,41 @@ def setup_page():
             margin-top: 4px;
         }
 
-        /* Transaction List Row */
-        .transaction-row {
+        /* Transaction List (one payload for all rows; off-screen rows skip layout and paint) */
+        .t-row {
             display: flex;
-            justify-content: space-between;
             align-items: center;
             background-color: #121212;
-            padding: 16px 20px;
+            padding: 12px;
             border-radius: 16px;
             margin-bottom: 8px;
+            border: 1px solid #1C1C1E;
             transition: background-color 0.2s;
+            content-visibility: auto;
+            contain-intrinsic-size: auto 66px;
         }
-        
-        .transaction-row:hover {
+
+        .t-row:hover {
             background-color: #1C1C1E;
         }
-        
-        .t-left { display: flex; flex-direction: column; }
-        .t-title { font-weight: 600; font-size: 15px; color: #FFF; }
-        .t-sub { font-size: 12px; color: #6B7280; }
-        
+
+        .t-icon {
+            width: 40px; height: 40px; flex-shrink: 0;
+            background: #2C2C2E;
+            border-radius: 50%;
+            display: flex; align-items: center; justify-content: center;
+            font-weight: bold; color: #6B7280;
+            margin-right: 15px;
+        }
+        .t-details { flex-grow: 1; min-width: 0; }
+        .t-title { display: block; font-weight: 600; font-size: 14px; color: #FFF; }
+        .t-sub { display: block; font-size: 12px; color: #6B7280; }
         .t-right { text-align: right; }
-        .t-amount { font-weight: 700; font-size: 15px; }
-        .t-status { font-size: 11px; padding: 2px 8px; border-radius: 10px; }
-        
+        .t-amount { font-weight: 700; font-size: 14px; color: #FFF; margin-bottom: 4px; }
+        .status-badge {
+            font-size: 10px; padding: 4px 8px; border-radius: 6px; font-weight: 600;
+        }
+
         .status-paid { background-color: rgba(16, 185, 129, 0.2); color: #34D399; }
         .status-pending { background-color: rgba(245, 158, 11, 0.2); color: #FBBF24; }
         .status-overdue { background-color: rgba(239, 68, 68, 0.2); color: #F87171; }
@@ -178,11 +198,12 @@ def setup_page():
 
 def hero_section(total_revenue, delta):
     """Renders the main account balance styling."""
+    arrow = "▼" if str(delta).startswith("-") else "▲"
     st.markdown(f"""
     <div class="hero-container">
         <div class="hero-label">Total Balance</div>
         <div class="hero-value">{total_revenue}</div>
-        <div class="hero-delta">▲ {delta} this month</div>
+        <div class="hero-delta">{arrow} {delta} this month</div>
     </div>
     """, unsafe_allow_html=True)
 
@@ -195,76 +216,54 @@ def stat_card(label, value, color="#FFF"):
     </div>
     """, unsafe_allow_html=True)
 
-def transaction_row(invoice_id, client, date, amount, status):
-    """Renders a single row for the transaction list with a delete option."""
-    status_lower = status.lower()
-    initial = client[0] if client else "?"
-    
-    # Container styling
-    row_style = """
-        <style>
-        .t-row {
-            display: flex; 
-            align-items: center; 
-            background-color: #121212; 
-            padding: 12px; 
-            border-radius: 16px; 
-            margin-bottom: 8px;
-            border: 1px solid #1C1C1E;
-        }
-        .t-icon {
-            width: 40px; height: 40px; 
-            background: #2C2C2E; 
-            border-radius: 50%; 
-            display: flex; align-items: center; justify-content: center; 
-            font-weight: bold; color: #6B7280;
-            margin-right: 15px;
-        }
-        .t-details { flex-grow: 1; }
-        .t-title { display: block; font-weight: 600; font-size: 14px; color: #FFF; }
-        .t-sub { display: block; font-size: 12px; color: #6B7280; }
-        .t-amount { font-weight: 700; font-size: 14px; color: #FFF; text-align: right; margin-right: 15px;}
-        .status-badge {
-            font-size: 10px; padding: 4px 8px; border-radius: 6px; font-weight: 600;
-        }
-        .status-paid { background-color: rgba(16, 185, 129, 0.2); color: #34D399; }
-        .status-pending { background-color: rgba(245, 158, 11, 0.2); color: #FBBF24; }
-        .status-overdue { background-color: rgba(239, 68, 68, 0.2); color: #F87171; }
-        </style>
+def transaction_list(invoices, key, on_delete, height=440):
     """
-    st.markdown(row_style, unsafe_allow_html=True)
-    
-    col1, col2, col3 = st.columns([0.7, 0.2, 0.1])
-    
-    with col1:
-        st.markdown(f"""
-        <div class="t-row">
-            <div class="t-icon">{initial}</div>
-            <div class="t-details">
-                <span class="t-title">{client}</span>
-                <span class="t-sub">{date}</span>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-        
-    with col2:
-        # Amount and Status
-        st.markdown(f"""
-        <div style="text-align: right; padding-top: 10px;">
-            <div class="t-amount">€{amount:,.2f}</div>
-            <span class="status-badge status-{status_lower}">{status}</span>
-        </div>
-        """, unsafe_allow_html=True)
-        
-    with col3:
-        # Delete Button (Invisible styling hack or standard button)
-        st.markdown("<div style='padding-top: 15px;'>", unsafe_allow_html=True)
-        if st.button("🗑️", key=f"del_{invoice_id}", help="Delete Invoice"):
-            return True
-        st.markdown("</div>", unsafe_allow_html=True)
-            
-    return False
-    
+    Renders invoices (id, client_name, date, amount, status) as a single HTML payload in a
+    scrollable container, with one multi-select delete action below it.
+    on_delete(ids) runs as the button's callback, before the rerun it triggers.
+    """
+    if invoices.empty:
+        return
+
+    rows = "".join(
+        TRANSACTION_ROW_HTML.format(
+            initial=html.escape(str(row.client_name or "?")[:1]),
+            client=html.escape(str(row.client_name or "")),
+            date=html.escape(str(row.date)),
+            amount=row.amount or 0,
+            status=html.escape(str(row.status)),
+            status_class=str(row.status).lower(),
+        )
+        for row in invoices.itertuples(index=False)
+    )
+    with st.container(height=height):
+        st.markdown(f'<div class="t-list">{rows}</div>', unsafe_allow_html=True)
+
+    labels = {
+        int(row.id): f"{row.client_name} · {row.date} · €{row.amount or 0:,.2f}"
+        for row in invoices.itertuples(index=False)
+    }
+    col_pick, col_delete = st.columns([0.8, 0.2])
+    with col_pick:
+        selected = st.multiselect(
+            "Select transactions",
+            list(labels),
+            format_func=labels.get,
+            key=f"{key}_selected",
+            placeholder="Select transactions to delete",
+            label_visibility="collapsed"
+        )
+    with col_delete:
+        st.button("🗑️ Delete", key=f"{key}_delete", disabled=not selected, use_container_width=True,
+                  on_click=_delete_selection, args=(key, on_delete))
+
+def _delete_selection(key, on_delete):
+    """Delete button callback: clears the multiselect, then hands the selected ids to on_delete."""
+    selected = st.session_state.get(f"{key}_selected", [])
+    st.session_state[f"{key}_selected"] = []
+    if selected:
+        on_delete(selected)
+
 def section_header(title, subtitle=None):
     st.markdown(f"### {title}")
 